@@ -0,0 +1,113 @@
+import numpy as np
+
+from config import ALIGNMENT_CARRY_MARGIN_SECONDS, ALIGNMENT_MAX_TOKENS
+
+# Imported lazily by audio_processor: alignment uses faster-whisper's tokenizer and the
+# model's cross-attention alignment (WhisperModel.encode / find_alignment)
+
+WHISPER_SAMPLE_RATE = 16000
+# Languages written without spaces between words; faster-whisper splits them into characters
+NO_SPACE_LANGUAGES = {"zh", "ja", "th", "lo", "my", "yue"}
+
+
+def lyric_lines(lyrics: str) -> list:
+    """
+    Non-empty lines of a lyrics text; each becomes one segment.
+    """
+    return [line.strip() for line in lyrics.splitlines() if line.strip()]
+
+
+def _next_active(offset: float, regions) -> float:
+    # Windows start at singing rather than in the instrumental passages between regions
+    for start, end in regions or []:
+        if end > offset:
+            return max(offset, start)
+    return offset
+
+
+def _words_by_line(words: list, line_token_counts: list) -> list:
+    """
+    Distribute the aligned words of a run of lines back to the lines, by token position.
+    """
+    bounds = np.cumsum(line_token_counts)
+    per_line = [[] for _ in line_token_counts]
+    position = 0
+    for word in words:
+        per_line[min(int(np.searchsorted(bounds, position, side="right")), len(per_line) - 1)].append(word)
+        position += len(word["tokens"])
+    return per_line
+
+
+def align_lyrics(model, audio: np.ndarray, lines: list, language: str = None, regions=None):
+    """
+    Force-align known lyric lines to 16 kHz mono audio. Yields (line index, words) in order,
+    where words are dicts with word, start, end (seconds of `audio`) and probability.
+
+    The audio is processed in Whisper's 30 s windows. Each window is encoded once and the
+    next lines (up to ALIGNMENT_MAX_TOKENS tokens) are aligned to it with the model's
+    cross-attention (DTW over the alignment heads), so nothing is decoded and no text can be
+    hallucinated. Lines ending within ALIGNMENT_CARRY_MARGIN_SECONDS of the window's end may
+    actually continue past it, so they are carried over to the next window, which starts where
+    the last accepted line ended. With `regions` (vocal activity), windows skip the gaps between them.
+    """
+    from faster_whisper.audio import pad_or_trim
+    from faster_whisper.tokenizer import Tokenizer
+
+    if language is None:
+        language = model.detect_language(audio)[0] if model.model.is_multilingual else "en"
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language=language)
+    separator = "" if language in NO_SPACE_LANGUAGES else " "
+    line_tokens = [tokenizer.encode(separator + line) for line in lines]
+
+    window_seconds = model.feature_extractor.chunk_length
+    duration = len(audio) / WHISPER_SAMPLE_RATE
+    offset = 0.0
+    next_line = 0
+    while next_line < len(lines):
+        offset = _next_active(offset, regions)
+        if duration - offset < model.feature_extractor.time_per_frame * 2:
+            # More lyrics than audio: the remaining lines get no timing of their own
+            for index in range(next_line, len(lines)):
+                yield index, []
+            return
+        chunk = audio[int(offset * WHISPER_SAMPLE_RATE):int((offset + window_seconds) * WHISPER_SAMPLE_RATE)]
+        features = model.feature_extractor(chunk)
+        num_frames = features.shape[-1] - 1
+        encoder_output = model.encode(pad_or_trim(features[:, :num_frames]))
+        window_end = num_frames * model.feature_extractor.time_per_frame
+        last_window = offset + window_end >= duration - 1e-3
+
+        # The next lines, as many as fit the token budget (at least one)
+        count = 1
+        while (next_line + count < len(lines)
+               and sum(len(tokens) for tokens in line_tokens[next_line:next_line + count + 1]) <= ALIGNMENT_MAX_TOKENS):
+            count += 1
+        candidates = line_tokens[next_line:next_line + count]
+        words = model.find_alignment(tokenizer, [[token for tokens in candidates for token in tokens]],
+                                     encoder_output, num_frames)[0]
+        per_line = _words_by_line(words, [len(tokens) for tokens in candidates])
+
+        accepted = 0
+        for line_words in per_line:
+            line_end = max((word["end"] for word in line_words), default=0.0)
+            if not last_window and line_end > window_end - ALIGNMENT_CARRY_MARGIN_SECONDS:
+                break
+            accepted += 1
+        if accepted == 0:
+            first_start = min((word["start"] for word in per_line[0]), default=0.0)
+            if first_start > 2 * ALIGNMENT_CARRY_MARGIN_SECONDS:
+                # The first line starts late in this window: align it again from just before it
+                offset += first_start - ALIGNMENT_CARRY_MARGIN_SECONDS
+                continue
+            # A line longer than the window can only be aligned in part
+            accepted = 1
+
+        ends = []
+        for index in range(accepted):
+            shifted = [{**word, "start": float(word["start"]) + offset, "end": float(word["end"]) + offset}
+                       for word in per_line[index]]
+            ends += [word["end"] for word in shifted]
+            yield next_line + index, shifted
+        next_line += accepted
+        # The next window starts where the last accepted line ended
+        offset = max(ends) if ends else offset + window_end
@@ -1,60 +1,36 @@
 import os
-import sys
+import re
+import shutil
+import subprocess
+import threading
 import traceback
 from pathlib import Path
 
+import numpy as np
 import soundfile as sf
-import torch
-from demucs.apply import apply_model
-from demucs.audio import AudioFile
-from demucs.pretrained import get_model
-from faster_whisper import WhisperModel
-
-from config import (BANNED_PHRASES, DEMUCS_MODEL_NAME, UPLOAD_DIR,
-                    WHISPER_MODEL_NAME, WHISPER_SETTINGS, setup_ffmpeg)
-
-# Initialize FFmpeg on module load
-setup_ffmpeg()
-
-try:
-    from moviepy.video.io.VideoFileClip import VideoFileClip
-    from moviepy.audio.io.AudioFileClip import AudioFileClip
-except ImportError:
-    try:
-        from moviepy.editor import VideoFileClip, AudioFileClip
-    except ImportError:
-        from moviepy import VideoFileClip, AudioFileClip
+
+from config import (BANNED_PHRASES,
+                    DEMUCS_STREAM_OVERLAP_SECONDS, DEMUCS_STREAM_WINDOW_SECONDS,
+                    DEMUCS_STREAMING_MIN_SECONDS, EXTRACT_CHANNELS,
+                    EXTRACT_SAMPLE_RATE, SEPARATION_PROFILE,
+                    SEPARATION_PROFILES,
+                    WHISPER_BATCH_SIZE, WHISPER_MODEL_NAME, WHISPER_SETTINGS,
+                    setup_ffmpeg)
+from models import MODELS, WHISPER_POOL, separation_model_key
+from segments import SegmentStore, write_subtitles
+from storage import open_stem_writer, stem_samples, stem_suffix, write_stem
 
 # --- Constants ---
+WHISPER_SAMPLE_RATE = 16000
+DECODE_BLOCK_SIZE = 1024 * 1024
 # BANNED_PHRASES is now imported from config
 
-def format_timestamp(seconds: float) -> str:
-    """
-    Format seconds into SRT timestamp format: HH:MM:SS,mmm
-    """
-    ms = int((seconds - int(seconds)) * 1000)
-    full_seconds = int(seconds)
-    hours = full_seconds // 3600
-    minutes = (full_seconds % 3600) // 60
-    seconds_rem = full_seconds % 60
-    return f"{hours:02d}:{minutes:02d}:{seconds_rem:02d},{ms:03d}"
-
-def create_srt(segments: list, output_path: Path):
+def create_srt(segments, output_path: Path):
     """
-    Create an SRT file from segments list.
+    Create an SRT file from segments (dicts, Pydantic Segments or a SegmentStore).
     """
     try:
-        with open(output_path, "w", encoding="utf-8") as f:
-            for i, seg in enumerate(segments):
-                # Using 1-based index for SRT
-                f.write(f"{i + 1}\n")
-                # seg might be a dict (from Whisper) or an object (from Pydantic)
-                start = seg["start"] if isinstance(seg, dict) else seg.start
-                end = seg["end"] if isinstance(seg, dict) else seg.end
-                text = seg["text"].strip() if isinstance(seg, dict) else seg.text.strip()
-                
-                f.write(f"{format_timestamp(start)} --> {format_timestamp(end)}\n")
-                f.write(f"{text}\n\n")
+        write_subtitles(segments, output_path, "srt")
         return True
     except Exception as e:
         print(f"Error creating SRT: {e}")
@@ -87,7 +63,7 @@ def burn_subtitles(video_path: Path, srt_path: Path, output_path: Path):
         
         # Run FFmpeg
         # overwrite_output=True corresponds to -y
-        out.run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+        out.run(cmd=ffmpeg_binary(), overwrite_output=True, capture_stdout=True, capture_stderr=True)
         
         print(f"Burned video saved to: {output_path}")
         return True
@@ -97,61 +73,192 @@ def burn_subtitles(video_path: Path, srt_path: Path, output_path: Path):
         print(f"Error burning subtitles: {e}")
         return False
 
-from faster_whisper import WhisperModel
-
-class _WhisperModelManager:
-    _instance = None
-    _model = None
-    _model_name = None
-
-    @classmethod
-    def get_model(cls, model_name: str):
-        if cls._model is None or cls._model_name != model_name:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            # Fast fallback or specific compute type
-            compute_type = "float16" if device == "cuda" else "int8"
-            
-            print(f"--- Loading faster-whisper model ({model_name}) on {device} ({compute_type}) ---")
-            try:
-                cls._model = WhisperModel(model_name, device=device, compute_type=compute_type)
-                cls._model_name = model_name
-            except Exception as e:
-                print(f"Failed to load model on {device}: {e}. Falling back to CPU...")
-                cls._model = WhisperModel(model_name, device="cpu", compute_type="int8")
-                cls._model_name = model_name
-        return cls._model
-
-def transcribe_audio_generator(audio_path: Path):
-    """
-    Transcribe audio using faster-whisper and yield segments one by one.
+def segment_record(segment, offset: float = 0.0, segment_id=None):
+    """
+    Convert a faster-whisper segment to the NDJSON/Segment record shape, shifted by `offset` seconds.
+    Returns None for empty or hallucinated (banned phrase) segments.
+    """
+    text = segment.text.strip()
+
+    # Skip if text contains any banned phrases or is empty
+    if any(phrase in text for phrase in BANNED_PHRASES) or not text:
+        print(f"Skipping hallucinated or empty segment: {text}")
+        return None
+
+    start = segment.start + offset
+    end = segment.end + offset
+    print(f"Segment: [{start:.2f} -> {end:.2f}] {text}")
+    return {
+        "id": segment.id if segment_id is None else segment_id,
+        "start": round(start, 2),
+        "end": round(end, 2),
+        "text": text
+    }
+
+_ffmpeg_lock = threading.Lock()
+_ffmpeg_configured = False
+
+def ffmpeg_binary() -> str:
+    # FFmpeg paths are configured on first use rather than on module load
+    global _ffmpeg_configured
+    with _ffmpeg_lock:
+        if not _ffmpeg_configured:
+            setup_ffmpeg()
+            _ffmpeg_configured = True
+    return os.environ.get("FFMPEG_BINARY", "ffmpeg")
+
+def probe_duration(audio_path: Path) -> float:
+    """
+    Duration of an audio or video file in seconds, read from its header.
     """
     try:
-        print(f"--- Start Transcription Generator: {audio_path.name} ---")
-        model = _WhisperModelManager.get_model(WHISPER_MODEL_NAME)
+        return sf.info(str(audio_path)).duration
+    except Exception:
+        pass
+    # ffmpeg reports the container duration while probing the input
+    result = subprocess.run([ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", str(audio_path)],
+                            capture_output=True, text=True, errors="replace")
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        raise RuntimeError(f"Could not determine duration of {audio_path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def decode_audio(audio_path: Path, samplerate: int, channels: int, mmap_path: Path = None):
+    """
+    Decode the audio of any ffmpeg-readable file straight to float32 PCM in a single pass.
+    Returns a [Time, Channels] array; with mmap_path the samples are streamed to that file
+    and returned as a read-only memory map instead of being held in RAM.
+    """
+    cmd = [ffmpeg_binary(), "-nostdin", "-hide_banner", "-loglevel", "error",
+           "-i", str(audio_path), "-vn", "-f", "f32le", "-ac", str(channels), "-ar", str(samplerate), "-"]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if mmap_path:
+        with open(mmap_path, "wb") as f:
+            shutil.copyfileobj(process.stdout, f, DECODE_BLOCK_SIZE)
+        data = None
+    else:
+        data = process.stdout.read()
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {audio_path}: {stderr.decode(errors='replace').strip()}")
 
-        segments, info = model.transcribe(
-            str(audio_path),
-            **WHISPER_SETTINGS
+    if mmap_path:
+        if Path(mmap_path).stat().st_size == 0:
+            return np.zeros((0, channels), dtype=np.float32)
+        return np.memmap(mmap_path, dtype=np.float32, mode="r").reshape(-1, channels)
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, channels)
+
+def open_decoder_pipe(output_path: Path, samplerate: int, channels: int, log_file=subprocess.DEVNULL):
+    """
+    Start an ffmpeg process that decodes whatever is written to its stdin into a float32 WAV,
+    so audio can be decoded while the input is still arriving. Inputs that need seeking
+    (e.g. MP4s with the index at the end) cannot be decoded this way; ffmpeg then writes
+    an error to `log_file`.
+    """
+    cmd = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+           "-i", "pipe:0", "-vn", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(samplerate),
+           str(output_path)]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log_file)
+
+def _is_soundfile_at(audio_path: Path, samplerate: int, channels: int) -> bool:
+    # Extracted audio is WAV; stems may also be FLAC (STEM_FORMAT)
+    try:
+        info = sf.info(str(audio_path))
+    except Exception:
+        return False
+    return info.format in ("WAV", "FLAC") and info.samplerate == samplerate and info.channels == channels
+
+def load_audio(audio_path: Path, samplerate: int, channels: int):
+    """
+    Load audio as a [Time, Channels] float32 array, reading WAV/FLAC files already in the requested
+    layout directly and decoding anything else once through ffmpeg.
+    """
+    if _is_soundfile_at(audio_path, samplerate, channels):
+        return sf.read(str(audio_path), dtype="float32", always_2d=True)[0]
+    return decode_audio(audio_path, samplerate, channels)
+
+TRANSCRIPTION_MODES = ("sequential", "batched")
+# Batched decoding transcribes at most one Whisper window (30 s) per clip
+BATCHED_CLIP_MAX_SECONDS = 30
+
+def _transcribe(model, audio, mode: str, batch_size: int = None, regions=None):
+    """
+    Start a faster-whisper transcription in the requested mode and return (segments, info).
+    "batched" splits the audio into VAD-detected chunks and decodes them in batches,
+    trading segment-by-segment latency for much higher throughput on many-core CPUs.
+    `regions`, if given, are the (start, end) seconds to decode instead of the whole audio;
+    timestamps stay on the audio's timeline.
+    """
+    if mode == "batched":
+        from faster_whisper import BatchedInferencePipeline
+        # Batched decoding needs speech chunks, so VAD is always on in this mode
+        # (faster-whisper ignores it when clip timestamps are given)
+        settings = {**WHISPER_SETTINGS, "vad_filter": True}
+        if regions is not None:
+            settings["clip_timestamps"] = [{"start": start, "end": end} for start, end in regions]
+        return BatchedInferencePipeline(model=model).transcribe(
+            audio, batch_size=batch_size or WHISPER_BATCH_SIZE, **settings
         )
+    if regions is not None:
+        return model.transcribe(audio, **WHISPER_SETTINGS,
+                                clip_timestamps=[t for region in regions for t in region])
+    return model.transcribe(audio, **WHISPER_SETTINGS)
+
+def vocal_regions(audio, mode: str = "sequential"):
+    """
+    Regions of 16 kHz vocals worth transcribing, in the form _transcribe expects for `mode`.
+    """
+    from vocal_activity import active_seconds, detect_vocal_regions
+
+    max_seconds = BATCHED_CLIP_MAX_SECONDS if mode == "batched" else None
+    regions = detect_vocal_regions(audio, WHISPER_SAMPLE_RATE, max_seconds)
+    duration = len(audio) / WHISPER_SAMPLE_RATE
+    print(f"Vocal activity: {len(regions)} regions, {active_seconds(regions):.1f}s of {duration:.1f}s")
+    return regions
+
+def transcribe_audio_generator(audio, mode: str = "sequential", batch_size: int = None,
+                               model_name: str = WHISPER_MODEL_NAME, start_seconds: float = 0.0,
+                               first_id: int = None, vocal_gate: bool = False):
+    """
+    Transcribe audio using faster-whisper and yield segments one by one, in time order.
+    `audio` is a file path or a 16 kHz mono float32 array; `mode` is one of TRANSCRIPTION_MODES.
+    With `start_seconds` only the audio from that point on is transcribed (timestamps stay on
+    the original timeline), and `first_id` renumbers segments consecutively from that id.
+    With `vocal_gate` (for separated vocals) only regions with audible singing are decoded.
+    """
+    try:
+        name = audio.name if isinstance(audio, Path) else "<array>"
+        print(f"--- Start Transcription Generator: {name} ({model_name}) ---")
+
+        if isinstance(audio, Path):
+            # Hand Whisper the samples directly instead of letting it decode the file again
+            audio = load_audio(audio, WHISPER_SAMPLE_RATE, 1)[:, 0]
+        if start_seconds:
+            audio = audio[int(start_seconds * WHISPER_SAMPLE_RATE):]
+            if len(audio) == 0:
+                print("--- Transcription Generator Finished (nothing left to transcribe) ---")
+                return
+
+        regions = vocal_regions(audio, mode) if vocal_gate else None
+        if regions == []:
+            print("--- Transcription Generator Finished (no vocal activity) ---")
+            return
+
+        # The replica stays checked out until the generator finishes or is closed
+        with WHISPER_POOL.acquire(model_name) as model:
+            segments, info = _transcribe(model, audio, mode, batch_size, regions)
+
+            print(f"Detected language: {info.language} ({info.language_probability:.2f})")
+
+            next_id = first_id
+            for segment in segments:
+                record = segment_record(segment, start_seconds, next_id)
+                if record:
+                    if next_id is not None:
+                        next_id += 1
+                    yield record
 
-        print(f"Detected language: {info.language} ({info.language_probability:.2f})")
-
-        for segment in segments:
-            text = segment.text.strip()
-            
-            # Skip if text contains any banned phrases or is empty
-            if any(phrase in text for phrase in BANNED_PHRASES) or not text:
-                print(f"Skipping hallucinated or empty segment: {text}")
-                continue
-                
-            print(f"Segment: [{segment.start:.2f} -> {segment.end:.2f}] {text}")
-            yield {
-                "id": segment.id,
-                "start": round(segment.start, 2),
-                "end": round(segment.end, 2),
-                "text": text
-            }
-            
         print("--- Transcription Generator Finished ---")
 
     except Exception as e:
@@ -160,105 +267,274 @@ def transcribe_audio_generator(audio_path: Path):
         traceback.print_exc()
         yield {"error": str(e)}
 
+def align_audio_generator(audio, lyrics: str, model_name: str = WHISPER_MODEL_NAME, vocal_gate: bool = False):
+    """
+    Force-align known lyrics to audio and yield one segment per non-empty lyric line, in order,
+    with the timing of its words (see alignment.align_lyrics). Nothing is decoded, so this is much
+    cheaper than transcribing and the text is exactly the given lyrics.
+    `audio` is a file path or a 16 kHz mono float32 array.
+    """
+    from alignment import align_lyrics, lyric_lines
+
+    try:
+        name = audio.name if isinstance(audio, Path) else "<array>"
+        print(f"--- Start Alignment Generator: {name} ({model_name}) ---")
+
+        if isinstance(audio, Path):
+            audio = load_audio(audio, WHISPER_SAMPLE_RATE, 1)[:, 0]
+        lines = lyric_lines(lyrics)
+        regions = vocal_regions(audio) if vocal_gate else None
+
+        with WHISPER_POOL.acquire(model_name) as model:
+            previous_end = 0.0
+            for index, words in align_lyrics(model, audio, lines, WHISPER_SETTINGS.get("language"), regions):
+                # A line that could not be placed (more lyrics than audio) is pinned to the previous one
+                start = min((word["start"] for word in words), default=previous_end)
+                end = max((word["end"] for word in words), default=previous_end)
+                previous_end = end
+                print(f"Line: [{start:.2f} -> {end:.2f}] {lines[index]}")
+                yield {
+                    "id": index + 1,
+                    "start": round(start, 2),
+                    "end": round(end, 2),
+                    "text": lines[index],
+                    "words": [{"word": word["word"].strip(), "start": round(word["start"], 2),
+                               "end": round(word["end"], 2), "probability": round(float(word["probability"]), 3)}
+                              for word in words if word["word"].strip()],
+                }
+
+        print("--- Alignment Generator Finished ---")
+
+    except Exception as e:
+        print(f"!!! Error in align_audio_generator: {e}")
+        traceback.print_exc()
+        yield {"error": str(e)}
+
 def transcribe_audio(audio_path: Path):
     """
     Transcribe audio using the generator and return results in the original format.
     (Kept for backward compatibility)
     """
-    full_result = {
-        "text": "",
-        "segments": []
-    }
-    
+    segments = []
     for segment in transcribe_audio_generator(audio_path):
         if "error" in segment:
             return None
-        full_result["segments"].append(segment)
-        full_result["text"] += segment["text"]
-    
-    return full_result
+        segments.append(segment)
+
+    return {
+        "text": SegmentStore.from_segments(segments).joined_text(),
+        "segments": segments
+    }
 
 def extract_audio(video_path: Path, output_path: Path):
     """
-    Extract audio from video file using moviepy.
+    Extract audio from video file as a lossless float32 WAV at the Demucs sample rate,
+    decoded once by ffmpeg (no intermediate lossy encode).
     """
     try:
-        video = VideoFileClip(str(video_path))
-        video.audio.write_audiofile(str(output_path), logger=None)
-        video.close()
+        _decode_to_wav(video_path, output_path, EXTRACT_SAMPLE_RATE, EXTRACT_CHANNELS)
         return True
     except Exception as e:
+        if hasattr(e, 'stderr') and e.stderr:
+            print(f"FFmpeg error: {e.stderr.decode()}")
         print(f"Error extracting audio: {e}")
         return False
 
-def separate_vocals(audio_path: Path, output_dir: Path):
+def _demucs_progress(progress_callback, length: int, shifts: int, stride: int):
+    """
+    Adapt Demucs' per-chunk apply_model callback to a 0..1 fraction.
+    """
+    def callback(info: dict):
+        if info.get("state") != "end":
+            return
+        within_shift = min((info["segment_offset"] + stride) / length, 1.0) if length else 1.0
+        within_model = (info["shift_idx"] + within_shift) / max(shifts, 1)
+        progress_callback((info["model_idx_in_bag"] + within_model) / info["models"])
+    return callback
+
+def _decode_to_wav(audio_path: Path, output_path: Path, samplerate: int, channels: int):
+    """
+    Decode any ffmpeg-readable input to a float32 WAV on disk, without holding it in memory.
+    """
+    import ffmpeg
+    (
+        ffmpeg.input(str(audio_path))
+        .output(str(output_path), ac=channels, ar=samplerate, acodec="pcm_f32le")
+        .run(cmd=ffmpeg_binary(), overwrite_output=True, capture_stdout=True, capture_stderr=True)
+    )
+
+def iter_separated_chunks(model, device, audio_path: Path, work_dir: Path, progress_callback=None,
+                          window_seconds: float = DEMUCS_STREAM_WINDOW_SECONDS, profile: dict = None):
+    """
+    Separate a track window by window and yield (start_frame, vocals, no_vocals) blocks.
+    Windows overlap by DEMUCS_STREAM_OVERLAP_SECONDS and are linearly crossfaded, so the
+    yielded blocks are final, contiguous and [Time, Channels]. Peak memory depends on
+    the window size, not on the track length. `profile` is one of SEPARATION_PROFILES.
+    """
+    import torch
+    from separation import separate_block
+
+    profile = profile or SEPARATION_PROFILES[SEPARATION_PROFILE]
+    samplerate = model.samplerate
+    window = int(window_seconds * samplerate)
+    overlap = int(DEMUCS_STREAM_OVERLAP_SECONDS * samplerate)
+    hop = window - overlap
+    fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)[:, None]
+    fade_out = 1.0 - fade_in
+
+    # Extracted audio is already a WAV in the model's layout and is read window by window;
+    # anything else is decoded once into a memory-mapped scratch file
+    decoded_path = None
+    if _is_soundfile_at(audio_path, samplerate, model.audio_channels):
+        source = sf.SoundFile(str(audio_path))
+        total = source.frames
+
+        def read(pos, n):
+            source.seek(pos)
+            return source.read(n, dtype="float32", always_2d=True)
+    else:
+        decoded_path = work_dir / f"{audio_path.stem}.decoded.f32"
+        source = decode_audio(audio_path, samplerate, model.audio_channels, mmap_path=decoded_path)
+        total = len(source)
+
+        def read(pos, n):
+            return np.array(source[pos:pos + n])
+
+    try:
+        # First pass: global normalization statistics of the mono reference,
+        # matching the whole-track normalization of the in-memory path
+        count, total_sum, total_sq = 0, 0.0, 0.0
+        for pos in range(0, total, window):
+            ref = read(pos, min(window, total - pos)).mean(axis=1, dtype=np.float64)
+            count += len(ref)
+            total_sum += ref.sum()
+            total_sq += np.square(ref).sum()
+        ref_mean = total_sum / max(count, 1)
+        ref_std = max(np.sqrt(max(total_sq / max(count, 1) - ref_mean ** 2, 0.0)), 1e-8)
+
+        tail = None
+        pos = 0
+        while pos < total:
+            block = read(pos, min(window, total - pos))
+            n = len(block)
+            is_last = pos + n >= total
+
+            vocals, no_vocals = separate_block(model, torch.from_numpy(block.T.copy()), device, profile,
+                                               ref_mean, ref_std)
+            vocals = vocals.cpu().numpy().T
+            no_vocals = no_vocals.cpu().numpy().T
+
+            if tail is not None:
+                # Every window after the first is longer than the overlap
+                tail_vocals, tail_no_vocals = tail
+                vocals[:overlap] = tail_vocals * fade_out + vocals[:overlap] * fade_in
+                no_vocals[:overlap] = tail_no_vocals * fade_out + no_vocals[:overlap] * fade_in
+
+            if is_last:
+                yield pos, vocals, no_vocals
+            else:
+                yield pos, vocals[:n - overlap], no_vocals[:n - overlap]
+                tail = (vocals[n - overlap:].copy(), no_vocals[n - overlap:].copy())
+
+            if progress_callback:
+                progress_callback((pos + n) / total)
+            pos += hop
+    finally:
+        if decoded_path is None:
+            source.close()
+        else:
+            # Release the memory map before deleting its file (required on Windows)
+            source = None
+            decoded_path.unlink(missing_ok=True)
+
+def _separate_vocals_streaming(model, device, audio_path: Path, output_dir: Path, progress_callback=None,
+                               chunk_callback=None, window_seconds: float = DEMUCS_STREAM_WINDOW_SECONDS,
+                               profile: dict = None):
+    """
+    Bounded-memory separation: stems are written incrementally as windows complete.
+    chunk_callback, if given, receives each finished (start_seconds, vocals, samplerate) block.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    filename_stem = audio_path.stem
+    vocals_path = output_dir / f"{filename_stem}_vocals{stem_suffix()}"
+    no_vocals_path = output_dir / f"{filename_stem}_no_vocals{stem_suffix()}"
+
+    print(f"Starting streaming separation ({window_seconds}s windows)...")
+    with open_stem_writer(vocals_path, model.samplerate, model.audio_channels) as vocals_out, \
+            open_stem_writer(no_vocals_path, model.samplerate, model.audio_channels) as no_vocals_out:
+        chunks = iter_separated_chunks(model, device, audio_path, output_dir, progress_callback, window_seconds,
+                                       profile)
+        for start_frame, vocals, no_vocals in chunks:
+            vocals_out.write(stem_samples(vocals))
+            no_vocals_out.write(stem_samples(no_vocals))
+            if chunk_callback:
+                chunk_callback(start_frame / model.samplerate, vocals, model.samplerate)
+
+    print(f"Saved to {vocals_path} and {no_vocals_path}")
+    return vocals_path
+
+def separate_vocals(audio_path: Path, output_dir: Path, progress_callback=None, chunk_callback=None,
+                    window_seconds: float = DEMUCS_STREAM_WINDOW_SECONDS, profile: str = SEPARATION_PROFILE):
     """
     Separate vocals using Demucs Python API.
-    Uses AudioFile (ffmpeg) for loading and soundfile for saving.
+    Uses load_audio (single ffmpeg decode) for loading and soundfile for saving.
+    Tracks longer than DEMUCS_STREAMING_MIN_SECONDS, or any track when chunk_callback is given,
+    are separated in streaming windows of `window_seconds`.
+    progress_callback, if given, is called with the completed fraction (0..1).
+    `profile` names the speed/quality settings in SEPARATION_PROFILES.
     """
+    import torch
+    from separation import effective_segment, separate_block, torch_threads
+
     try:
-        print(f"Loading Demucs model ({DEMUCS_MODEL_NAME})...")
-        model = get_model(DEMUCS_MODEL_NAME)
-
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        model.to(device)
-
-        try:
-            print(f"Attempting to load audio with Demucs AudioFile: {audio_path}")
-            # Use Demucs AudioFile which wraps ffmpeg
-            wav = AudioFile(audio_path).read(
-                streams=0,
-                samplerate=model.samplerate,
-                channels=model.audio_channels
-            )
-        except Exception as e:
-            print(f"Demucs AudioFile failed: {e}. Falling back to moviepy...")
-            audio = AudioFileClip(str(audio_path))
-
-            # Load as numpy and convert to torch
-            audio_data = audio.to_soundarray(fps=model.samplerate)
-            # MoviePy returns [Time, Channels], Demucs wants [Channels, Time]
-            wav = torch.from_numpy(audio_data.T).float()
-            audio.close()
-
-
-        # Substrate Demucs normalization
-        # Ref: https://github.com/facebookresearch/demucs/blob/main/demucs/separate.py
-        ref = wav.mean(0)
-        wav = (wav - ref.mean()) / ref.std()
-        
-        print("Starting separation...")
-        # Add batch dimension: [1, Channels, Time] and apply model
-        sources = apply_model(model, wav[None], device=device, shifts=1, split=True, overlap=0.25, progress=True)[0]
-        
-        # Denormalize to restore original amplitude
-        sources = sources * ref.std() + ref.mean()
+        settings = SEPARATION_PROFILES[profile]
+        # Resident model: loaded once per process and shared between requests
+        kind, name = separation_model_key(settings)
+        model = MODELS.get(kind, name)
+        device = MODELS.device(kind, name)
+        print(f"Separation profile: {profile} ({kind} {name})")
+
+        with torch_threads(settings["threads"]):
+            if chunk_callback or probe_duration(audio_path) >= DEMUCS_STREAMING_MIN_SECONDS:
+                return _separate_vocals_streaming(model, device, audio_path, output_dir, progress_callback,
+                                                  chunk_callback, window_seconds, settings)
+
+            print(f"Loading audio: {audio_path}")
+            # [Time, Channels] -> Demucs wants [Channels, Time]
+            audio_data = load_audio(audio_path, model.samplerate, model.audio_channels)
+            wav = torch.from_numpy(np.ascontiguousarray(audio_data.T))
+            del audio_data
+
+            # Substrate Demucs normalization
+            # Ref: https://github.com/facebookresearch/demucs/blob/main/demucs/separate.py
+            ref = wav.mean(0)
+
+            print("Starting separation...")
+            callback = None
+            if progress_callback:
+                # A pretrained model is usually a BagOfModels; its sub-models carry the segment length
+                segment = effective_segment(model, settings) or float(getattr(model, "models", [model])[0].segment)
+                stride = int((1 - settings["overlap"]) * segment * model.samplerate)
+                callback = _demucs_progress(progress_callback, wav.shape[-1], settings["shifts"], stride)
+            vocals, no_vocals = separate_block(model, wav, device, settings, ref.mean(), ref.std(),
+                                               progress=True, callback=callback)
 
         # Save vocals and no_vocals
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        vocals_idx = model.sources.index('vocals')
-        vocals = sources[vocals_idx]
-        
-        # Create no_vocals by summing everything else
-        no_vocals = torch.zeros_like(vocals)
-        for i, src in enumerate(sources):
-            if i != vocals_idx:
-                no_vocals += src
-        
         # Save using soundfile
         vocals_np = vocals.cpu().numpy().T
         no_vocals_np = no_vocals.cpu().numpy().T
         
         filename_stem = audio_path.stem
-        vocals_path = output_dir / f"{filename_stem}_vocals.wav"
-        no_vocals_path = output_dir / f"{filename_stem}_no_vocals.wav"
+        vocals_path = output_dir / f"{filename_stem}_vocals{stem_suffix()}"
+        no_vocals_path = output_dir / f"{filename_stem}_no_vocals{stem_suffix()}"
         
         print(f"Saving to {vocals_path}")
-        sf.write(str(vocals_path), vocals_np, model.samplerate)
+        write_stem(vocals_path, vocals_np, model.samplerate)
         
         print(f"Saving to {no_vocals_path}")
-        sf.write(str(no_vocals_path), no_vocals_np, model.samplerate)
+        write_stem(no_vocals_path, no_vocals_np, model.samplerate)
         
         return vocals_path
 
@@ -0,0 +1,299 @@
+"""
+Batch processing of whole directories of videos.
+
+Runs extract -> separate -> transcribe (-> export) for every video across a pool of worker
+processes, each holding its own models. Progress is kept in a manifest next to the outputs,
+so an interrupted batch resumes where it stopped and finished videos are skipped.
+
+    python batch_process.py /data/catalogue --output-dir /data/lyrics
+    python batch_process.py videos.txt --export soft --workers 2
+    python batch_process.py /data/catalogue --retry-failed
+
+A manifest file lists one video per line (relative paths are resolved against the file).
+Stage results are content-addressed cached as for the API, so re-running a video whose
+output was deleted only repeats the stages whose cache was removed as well.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from config import BATCH_VIDEO_EXTENSIONS, BATCH_WORKER_MEMORY_MB, SEPARATION_PROFILE, SEPARATION_PROFILES
+from segments import SUBTITLE_FORMATS
+
+STAGES = ("extract", "separate", "transcribe", "export")
+PROGRESS_NAME = "batch_progress.json"
+SUMMARY_NAME = "batch_summary.csv"
+
+
+# --- Inputs ---
+
+def collect_videos(source: Path, recursive: bool = False):
+    """
+    Videos to process as (path, relative name) pairs, from a directory or a manifest file.
+    """
+    if source.is_dir():
+        pattern = "**/*" if recursive else "*"
+        paths = sorted(p for p in source.glob(pattern)
+                       if p.is_file() and p.suffix.lower() in BATCH_VIDEO_EXTENSIONS)
+        return [(p.resolve(), p.relative_to(source)) for p in paths]
+
+    videos = []
+    for line in source.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        path = Path(line)
+        if not path.is_absolute():
+            path = source.parent / path
+        videos.append((path.resolve(), Path(path.name)))
+    return videos
+
+
+def default_workers() -> int:
+    """
+    Worker processes the machine can run side by side: one per core, limited by memory.
+    """
+    cpus = os.cpu_count() or 1
+    try:
+        memory_mb = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        memory_mb = None
+    by_memory = max(memory_mb // BATCH_WORKER_MEMORY_MB, 1) if memory_mb else cpus
+    return max(1, min(cpus, by_memory))
+
+
+# --- Progress manifest ---
+
+class ProgressManifest:
+    """
+    Per-video status, outputs and stage timings, rewritten atomically after every video.
+    A video counts as done only while its size and modification time are unchanged.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.items = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                self.items = json.load(f).get("items", {})
+
+    @staticmethod
+    def _fingerprint(video_path: Path) -> dict:
+        stat = video_path.stat()
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def is_done(self, video_path: Path) -> bool:
+        entry = self.items.get(str(video_path))
+        if not entry or entry.get("status") != "done":
+            return False
+        if any(not Path(output).exists() for output in entry.get("outputs", {}).values()):
+            return False
+        return entry.get("fingerprint") == self._fingerprint(video_path)
+
+    def status(self, video_path: Path):
+        entry = self.items.get(str(video_path))
+        return entry.get("status") if entry else None
+
+    def record(self, video_path: Path, result: dict):
+        self.items[str(video_path)] = {**result, "fingerprint": self._fingerprint(video_path)}
+        self.save()
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "items": self.items}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+# --- Worker ---
+
+def _init_worker(threads: int, stand_in_models: bool):
+    import models
+    # Share the cores between workers instead of every process using all of them
+    models.WHISPER_CPU_THREADS = threads
+    import torch
+    torch.set_num_threads(threads)
+    if stand_in_models:
+        from benchmark import install_stand_in_models
+        install_stand_in_models()
+
+
+class StageFailed(Exception):
+    pass
+
+
+def process_video(video: str, output_stem: str, options: dict) -> dict:
+    """
+    Run the pipeline for one video in a worker process. Returns its manifest entry.
+    """
+    from segments import SegmentStore, write_subtitles
+    from services import (ensure_audio, ensure_vocals, export_subtitled_video, media_duration,
+                          transcribe_cached)
+
+    video_path = Path(video)
+    stem = Path(output_stem)
+    stem.parent.mkdir(parents=True, exist_ok=True)
+    timings = {}
+    outputs = {}
+    audio_seconds = None
+
+    def timed(stage: str, run):
+        start = time.perf_counter()
+        try:
+            result = run()
+        finally:
+            timings[stage] = round(time.perf_counter() - start, 3)
+        if result is None:
+            raise StageFailed(f"{stage} failed")
+        return result
+
+    start = time.perf_counter()
+    try:
+        audio_path = timed("extract", lambda: ensure_audio(video_path))
+        audio_seconds = media_duration(audio_path)
+        audio_seconds = round(audio_seconds, 3) if audio_seconds else None
+        vocals_path = timed("separate", lambda: ensure_vocals(video_path, profile=options["profile"]))
+
+        def transcribe():
+            records = list(transcribe_cached(vocals_path, options["mode"], options["batch_size"],
+                                             options["model"]))
+            errors = [record["error"] for record in records if "error" in record]
+            if errors:
+                raise StageFailed(f"transcribe failed: {errors[0]}")
+            return records
+        segments = SegmentStore.from_segments(timed("transcribe", transcribe))
+
+        subtitle_path = stem.with_name(f"{stem.name}.{options['format']}")
+        write_subtitles(segments, subtitle_path, options["format"])
+        outputs["subtitles"] = str(subtitle_path)
+        transcript_path = stem.with_name(f"{stem.name}.json")
+        with open(transcript_path, "w", encoding="utf-8") as f:
+            json.dump({"text": segments.joined_text(), "segments": segments.to_dicts()}, f,
+                      ensure_ascii=False, indent=2)
+        outputs["transcript"] = str(transcript_path)
+
+        if options["export"] != "none":
+            video_out = timed("export", lambda: export_subtitled_video(
+                video_path, segments, stem.with_name(f"{stem.name}.srt"),
+                stem.with_name(f"{stem.name}_subtitled{video_path.suffix}"), options["export"]))
+            outputs["video"] = str(video_out)
+        status, error = "done", None
+    except StageFailed as e:
+        status, error = "failed", str(e)
+    except Exception as e:
+        traceback.print_exc()
+        status, error = "failed", f"{type(e).__name__}: {e}"
+
+    return {
+        "status": status,
+        "error": error,
+        "outputs": outputs,
+        "timings": timings,
+        "total_seconds": round(time.perf_counter() - start, 3),
+        "audio_seconds": audio_seconds,
+    }
+
+
+# --- Driver ---
+
+def write_summary(path: Path, manifest: ProgressManifest, videos):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["video", "status", *STAGES, "total_seconds", "audio_seconds", "real_time_factor", "error"])
+        for video_path, _ in videos:
+            entry = manifest.items.get(str(video_path), {})
+            timings = entry.get("timings", {})
+            total, audio = entry.get("total_seconds"), entry.get("audio_seconds")
+            rtf = round(total / audio, 4) if total is not None and audio else None
+            writer.writerow([str(video_path), entry.get("status", "pending"),
+                             *(timings.get(stage) for stage in STAGES),
+                             total, audio, rtf, entry.get("error") or ""])
+
+
+def run_batch(args) -> int:
+    videos = collect_videos(Path(args.source), args.recursive)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = ProgressManifest(output_dir / PROGRESS_NAME)
+
+    pending = []
+    for video_path, relative in videos:
+        if not video_path.exists():
+            print(f"Missing: {video_path}")
+        elif manifest.is_done(video_path):
+            print(f"Skip (done): {video_path}")
+        elif manifest.status(video_path) == "failed" and not args.retry_failed:
+            print(f"Skip (failed, use --retry-failed): {video_path}")
+        else:
+            pending.append((video_path, output_dir / relative.parent / relative.stem))
+
+    workers = max(1, min(args.workers or default_workers(), len(pending) or 1))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    options = {"mode": args.mode, "batch_size": args.batch_size, "model": args.model, "profile": args.profile,
+               "format": args.format, "export": args.export}
+    print(f"--- {len(videos)} videos, {len(pending)} to process with {workers} workers x {threads} threads ---")
+
+    failed = 0
+    start = time.perf_counter()
+    # Spawned workers start clean instead of inheriting the parent's threads and torch state
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(threads, args.stand_in_models)) as pool:
+        futures = {pool.submit(process_video, str(video_path), str(stem), options): video_path
+                   for video_path, stem in pending}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                video_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process itself died (e.g. out of memory)
+                    result = {"status": "failed", "error": f"{type(e).__name__}: {e}", "outputs": {}, "timings": {}}
+                manifest.record(video_path, result)
+                failed += result["status"] != "done"
+                print(f"[{done}/{len(pending)}] {result['status']}: {video_path.name} "
+                      f"({result.get('total_seconds') or 0:.1f}s)" + (f" - {result['error']}" if result["error"] else ""))
+        except KeyboardInterrupt:
+            print("Interrupted; finished videos are recorded, re-run to resume")
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    summary_path = output_dir / SUMMARY_NAME
+    write_summary(summary_path, manifest, videos)
+    print(f"--- Processed {len(pending)} videos in {time.perf_counter() - start:.1f}s, {failed} failed; "
+          f"summary: {summary_path} ---")
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process a directory (or manifest file) of videos with LyricSyncAI.")
+    parser.add_argument("source", help="directory of videos, or a text file listing one video per line")
+    parser.add_argument("--output-dir", default="batch_output", help="where subtitles, transcripts and progress go")
+    parser.add_argument("--recursive", action="store_true", help="include videos in subdirectories")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (default: sized to CPU and memory)")
+    parser.add_argument("--profile", choices=list(SEPARATION_PROFILES), default=SEPARATION_PROFILE,
+                        help="separation profile (speed vs. quality)")
+    parser.add_argument("--mode", choices=["sequential", "batched"], default="sequential", help="Whisper decoding mode")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--model", default=None, help="Whisper model (default: WHISPER_MODEL_NAME)")
+    parser.add_argument("--format", choices=SUBTITLE_FORMATS, default="srt", help="subtitle file format")
+    parser.add_argument("--export", choices=["none", "soft", "burn"], default="none",
+                        help="also export the video with subtitles")
+    parser.add_argument("--retry-failed", action="store_true", help="process videos that failed in a previous run")
+    parser.add_argument("--stand-in-models", action="store_true",
+                        help="use the benchmark's stand-in models (smoke test without model weights)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    return run_batch(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Offline benchmark of the processing pipeline.
+
+Generates synthetic media with ffmpeg (tone + noise audio, test-pattern video), then times
+each stage separately and reports wall time, real-time factor, throughput and peak RSS.
+
+    python benchmark.py --duration 120 --output results.json
+    python benchmark.py --baseline baseline.json --threshold 0.1
+
+By default Demucs and Whisper are replaced by lightweight stand-in models so the suite runs
+without downloading weights; pass --real-models to benchmark the configured models.
+The exit status is 1 if any stage regressed beyond the thresholds of --baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from audio_processor import (burn_subtitles, create_srt, extract_audio, ffmpeg_binary,
+                             separate_vocals, transcribe_audio_generator)
+from config import SEPARATION_PROFILE, SEPARATION_PROFILES, WHISPER_MODEL_NAME
+from metrics import PeakRss
+from models import MODELS, WHISPER_POOL, separation_model_key
+
+STAGES = ("extract", "separate", "transcribe", "create_srt", "burn")
+
+
+# --- Stand-in models ---
+
+class StandInSeparator(torch.nn.Module):
+    """
+    Demucs-shaped model: splits the mix into four fixed-gain stems after a light convolution,
+    so apply_model's chunking, padding and overlap-add run exactly as with real weights.
+    """
+    samplerate = 44100
+    audio_channels = 2
+    sources = ["drums", "bass", "other", "vocals"]
+    segment = 7.8
+
+    def __init__(self):
+        super().__init__()
+        self.smooth = torch.nn.Conv1d(2, 2, kernel_size=9, padding=4, groups=2, bias=False)
+        torch.nn.init.constant_(self.smooth.weight, 1 / 9)
+        self.register_buffer("gains", torch.tensor([0.3, 0.2, 0.2, 0.3]))
+
+    def forward(self, mix):
+        smoothed = self.smooth(mix)
+        return self.gains.view(1, -1, 1, 1) * smoothed.unsqueeze(1)
+
+
+StandInSegment = namedtuple("StandInSegment", "id start end text")
+StandInInfo = namedtuple("StandInInfo", "language language_probability duration")
+
+
+class StandInWhisper:
+    """
+    faster-whisper-shaped model: emits one segment per `segment_seconds` of audio whose
+    RMS exceeds a threshold, after computing a log-mel-like spectrum of each window.
+    """
+
+    def __init__(self, segment_seconds: float = 5.0):
+        self.segment_seconds = segment_seconds
+
+    def transcribe(self, audio, **kwargs):
+        audio = np.asarray(audio, dtype=np.float32)
+        duration = len(audio) / 16000
+        window = int(self.segment_seconds * 16000)
+
+        def segments():
+            for index, start in enumerate(range(0, len(audio), window)):
+                chunk = audio[start:start + window]
+                # Roughly the per-window feature extraction cost of the real model (25 ms frames)
+                frames = chunk[:len(chunk) // 400 * 400].reshape(-1, 400)
+                np.log1p(np.abs(np.fft.rfft(frames, axis=1)) ** 2)
+                if len(chunk) == 0 or np.sqrt(np.mean(chunk ** 2)) < 1e-4:
+                    continue
+                yield StandInSegment(index + 1, start / 16000, min(start + window, len(audio)) / 16000,
+                                     f"stand-in line {index + 1}")
+
+        return segments(), StandInInfo("ja", 1.0, duration)
+
+
+def install_stand_in_models():
+    # Every profile's registry entry, so no profile falls back to downloading weights
+    for profile in SEPARATION_PROFILES.values():
+        MODELS.install(*separation_model_key(profile), StandInSeparator().eval())
+    WHISPER_POOL.install(WHISPER_MODEL_NAME, StandInWhisper())
+
+
+# --- Synthetic media ---
+
+def generate_media(path: Path, duration: float, width: int, height: int):
+    """
+    Write a test video: a moving test pattern with a 440 Hz tone over pink noise (fixed seed).
+    """
+    cmd = [
+        ffmpeg_binary(), "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.2:seed=42:sample_rate=44100:duration={duration}",
+        "-filter_complex", "[1:a][2:a]amix=inputs=2,aformat=channel_layouts=stereo[a]",
+        "-map", "0:v", "-map", "[a]",
+        "-c:v", "libx264", "-preset", "veryfast", "-g", "50", "-c:a", "aac",
+        str(path),
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def synthetic_segments(count: int, duration: float) -> list:
+    step = duration / count
+    return [{"id": i, "start": i * step, "end": (i + 0.8) * step, "text": f"歌詞のテスト行 {i}"} for i in range(count)]
+
+
+# --- Measurement ---
+
+def measure(fn, repeat: int):
+    """
+    Run fn `repeat` times; returns (result of the last run, median seconds, peak RSS bytes).
+    """
+    timings = []
+    peak = 0
+    result = None
+    for _ in range(repeat):
+        with PeakRss(interval=0.02) as rss:
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+        peak = max(peak, rss.peak)
+    return result, statistics.median(timings), peak
+
+
+def stage_result(seconds: float, peak_rss: int, media_seconds: float, items: float = None, unit: str = None) -> dict:
+    result = {
+        "seconds": round(seconds, 4),
+        "real_time_factor": round(seconds / media_seconds, 5),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+    if items is not None:
+        result["throughput"] = round(items / seconds, 2) if seconds > 0 else None
+        result["throughput_unit"] = unit
+    return result
+
+
+def run_benchmark(args) -> dict:
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="lyricsync-bench-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    stages = args.stages
+    results = {}
+    try:
+        video_path = work_dir / "synthetic.mp4"
+        print(f"--- Generating {args.duration}s of synthetic media in {work_dir} ---")
+        generate_media(video_path, args.duration, args.width, args.height)
+
+        audio_path = work_dir / "synthetic.wav"
+        separated_dir = work_dir / "separated"
+        vocals_path = None
+
+        if "extract" in stages or "separate" in stages or "transcribe" in stages:
+            ok, seconds, peak = measure(lambda: extract_audio(video_path, audio_path), args.repeat)
+            if not ok:
+                raise RuntimeError("extract_audio failed")
+            if "extract" in stages:
+                results["extract"] = stage_result(seconds, peak, args.duration, args.duration, "media_seconds/s")
+
+        if "separate" in stages or "transcribe" in stages:
+            def separate():
+                shutil.rmtree(separated_dir, ignore_errors=True)
+                separated_dir.mkdir()
+                return separate_vocals(audio_path, separated_dir, profile=args.profile)
+            vocals_path, seconds, peak = measure(separate, args.repeat)
+            if not vocals_path:
+                raise RuntimeError("separate_vocals failed")
+            if "separate" in stages:
+                results["separate"] = stage_result(seconds, peak, args.duration, args.duration, "media_seconds/s")
+
+        if "transcribe" in stages:
+            records, seconds, peak = measure(lambda: list(transcribe_audio_generator(Path(vocals_path))), args.repeat)
+            if any("error" in record for record in records):
+                raise RuntimeError("transcribe_audio_generator failed")
+            results["transcribe"] = stage_result(seconds, peak, args.duration, args.duration, "media_seconds/s")
+            results["transcribe"]["segments"] = len(records)
+
+        segments = synthetic_segments(args.srt_segments, args.duration)
+        srt_path = work_dir / "synthetic.srt"
+        if "create_srt" in stages or "burn" in stages:
+            ok, seconds, peak = measure(lambda: create_srt(segments, srt_path), args.repeat)
+            if not ok:
+                raise RuntimeError("create_srt failed")
+            if "create_srt" in stages:
+                results["create_srt"] = stage_result(seconds, peak, args.duration, len(segments), "segments/s")
+
+        if "burn" in stages:
+            output_path = work_dir / "burned.mp4"
+            ok, seconds, peak = measure(lambda: burn_subtitles(video_path, srt_path, output_path), args.repeat)
+            if not ok:
+                raise RuntimeError("burn_subtitles failed")
+            results["burn"] = stage_result(seconds, peak, args.duration, args.duration, "media_seconds/s")
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "cuda": torch.cuda.is_available(),
+            "models": "real" if args.real_models else "stand-in",
+            "separation_profile": args.profile,
+        },
+        "media": {"duration": args.duration, "width": args.width, "height": args.height,
+                  "srt_segments": args.srt_segments},
+        "repeat": args.repeat,
+        "stages": results,
+    }
+
+
+def compare(results: dict, baseline: dict, time_threshold: float, rss_threshold: float) -> list:
+    """
+    Compare stage results against a baseline. Returns the list of regressions found.
+    """
+    regressions = []
+    print(f"{'stage':<12} {'seconds':>10} {'baseline':>10} {'change':>8} {'peak MB':>9} {'baseline':>9}")
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous:
+            print(f"{stage:<12} {current['seconds']:>10.3f} {'-':>10} {'-':>8} {current['peak_rss_mb']:>9.1f} {'-':>9}")
+            continue
+        time_change = current["seconds"] / previous["seconds"] - 1 if previous["seconds"] else 0.0
+        rss_change = current["peak_rss_mb"] / previous["peak_rss_mb"] - 1 if previous["peak_rss_mb"] else 0.0
+        print(f"{stage:<12} {current['seconds']:>10.3f} {previous['seconds']:>10.3f} {time_change:>+8.1%} "
+              f"{current['peak_rss_mb']:>9.1f} {previous['peak_rss_mb']:>9.1f}")
+        if time_change > time_threshold:
+            regressions.append(f"{stage}: {time_change:+.1%} time (threshold {time_threshold:.0%})")
+        if rss_change > rss_threshold:
+            regressions.append(f"{stage}: {rss_change:+.1%} peak RSS (threshold {rss_threshold:.0%})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the LyricSyncAI processing pipeline on synthetic media.")
+    parser.add_argument("--duration", type=float, default=60.0, help="length of the synthetic media in seconds")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--srt-segments", type=int, default=2000, help="segments written by the create_srt stage")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"comma-separated subset of {', '.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage; the median time is reported")
+    parser.add_argument("--real-models", action="store_true", help="use the configured Demucs/Whisper models")
+    parser.add_argument("--profile", choices=list(SEPARATION_PROFILES), default=SEPARATION_PROFILE,
+                        help="separation profile of the separate stage")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown per stage")
+    parser.add_argument("--rss-threshold", type=float, default=0.20, help="allowed relative peak RSS growth per stage")
+    parser.add_argument("--work-dir", help="directory for the generated media (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated media")
+    args = parser.parse_args(argv)
+
+    args.stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not args.real_models:
+        install_stand_in_models()
+
+    results = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"--- Results written to {args.output} ---")
+
+    if not args.baseline:
+        for stage, result in results["stages"].items():
+            print(f"{stage:<12} {result['seconds']:>10.3f}s  RTF {result['real_time_factor']:.4f}  "
+                  f"peak {result['peak_rss_mb']:.1f} MB")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.rss_threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
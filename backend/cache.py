@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from config import (ALIGNMENT_CARRY_MARGIN_SECONDS, ALIGNMENT_MAX_TOKENS,
+                    BANNED_PHRASES, CACHE_DIR, EXPORT_CRF,
+                    EXPORT_PIECE_SECONDS, EXPORT_VIDEO_CODEC, EXTRACT_CHANNELS,
+                    EXTRACT_SAMPLE_RATE, PREVIEW_CRF, PREVIEW_HEIGHT, PREVIEW_PRESET,
+                    SEPARATION_PROFILES, STEM_FORMAT, VOCAL_ACTIVITY_FRAME_SECONDS,
+                    VOCAL_ACTIVITY_MIN_GAP_SECONDS, VOCAL_ACTIVITY_MIN_REGION_SECONDS,
+                    VOCAL_ACTIVITY_PADDING_SECONDS, VOCAL_ACTIVITY_RELATIVE_DB,
+                    VOCAL_ACTIVITY_THRESHOLD_DB, WHISPER_MODEL_NAME, WHISPER_SETTINGS)
+from storage import STORAGE
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Digests are memoized per (path, size, mtime) so repeated lookups of the same
+# upload do not re-read multi-GB files.
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+_stage_locks = {}
+_stage_locks_lock = threading.Lock()
+
+
+def _stat_key(path: Path):
+    stat = path.stat()
+    return (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+def file_digest(path: Path) -> str:
+    """
+    Return the SHA-256 hex digest of a file's content.
+    """
+    key = _stat_key(path)
+    with _digest_lock:
+        if key in _digest_memo:
+            return _digest_memo[key]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    with _digest_lock:
+        _digest_memo[key] = digest
+    return digest
+
+
+def remember_digest(path: Path, digest: str):
+    """
+    Record a digest computed elsewhere (e.g. while the file was being uploaded) so
+    file_digest does not have to read the file again.
+    """
+    key = _stat_key(path)
+    with _digest_lock:
+        _digest_memo[key] = digest
+
+
+def stage_settings(stage: str) -> dict:
+    """
+    Settings that determine the output of a pipeline stage.
+    Stages keyed by the original upload inherit the settings of the stages they consume.
+    """
+    extract = {"format": "wav_f32", "samplerate": EXTRACT_SAMPLE_RATE, "channels": EXTRACT_CHANNELS}
+    vocal_activity = {
+        "frame_seconds": VOCAL_ACTIVITY_FRAME_SECONDS,
+        "threshold_db": VOCAL_ACTIVITY_THRESHOLD_DB,
+        "relative_db": VOCAL_ACTIVITY_RELATIVE_DB,
+        "padding_seconds": VOCAL_ACTIVITY_PADDING_SECONDS,
+        "min_gap_seconds": VOCAL_ACTIVITY_MIN_GAP_SECONDS,
+        "min_region_seconds": VOCAL_ACTIVITY_MIN_REGION_SECONDS,
+    }
+    settings = {
+        "extract": extract,
+        # Separation is further keyed by its profile's settings (see separation_params)
+        "separate": extract,
+        # Transcripts are keyed by the digest of the audio actually transcribed
+        "transcribe": {
+            "whisper_model": WHISPER_MODEL_NAME,
+            "whisper_settings": WHISPER_SETTINGS,
+            "banned_phrases": BANNED_PHRASES,
+            "vocal_activity": vocal_activity,
+        },
+        # Aligned lyrics are further keyed by the lyrics and model (see services.align_cached)
+        "align": {
+            "language": WHISPER_SETTINGS.get("language"),
+            "max_tokens": ALIGNMENT_MAX_TOKENS,
+            "carry_margin_seconds": ALIGNMENT_CARRY_MARGIN_SECONDS,
+            "vocal_activity": vocal_activity,
+        },
+        # Keyframe-aligned pieces of the video and their encodings for burned-in exports
+        "export": {"piece_seconds": EXPORT_PIECE_SECONDS, "codec": EXPORT_VIDEO_CODEC, "crf": EXPORT_CRF},
+        # Range previews are further keyed by their window and subtitles (see exporter.render_preview)
+        "preview": {"height": PREVIEW_HEIGHT, "codec": EXPORT_VIDEO_CODEC, "preset": PREVIEW_PRESET,
+                    "crf": PREVIEW_CRF},
+    }
+    return settings[stage]
+
+
+def separation_params(profile: str) -> dict:
+    """
+    Per-request parameters of the "separate" stage: the settings of a separation profile
+    that change its output, and the format the stems are stored in.
+    """
+    settings = dict(SEPARATION_PROFILES[profile])
+    # The thread count only changes the speed
+    settings.pop("threads", None)
+    return {"separation": settings, "stem_format": STEM_FORMAT}
+
+
+def stage_key(stage: str, params: dict = None) -> str:
+    """
+    Short hash of a stage's settings plus any per-request parameters (e.g. transcription mode).
+    """
+    settings = {**stage_settings(stage), **(params or {})}
+    payload = json.dumps(settings, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def stage_dir(digest: str, stage: str, params: dict = None) -> Path:
+    return CACHE_DIR / digest / f"{stage}-{stage_key(stage, params)}"
+
+
+def lookup(digest: str, stage: str, *names: str, params: dict = None) -> Optional[Path]:
+    """
+    Return the stage directory if every named artifact in it exists, otherwise None.
+    A hit counts as a use of the stage for the storage quota's LRU eviction.
+    """
+    directory = stage_dir(digest, stage, params)
+    if directory.is_dir() and all((directory / name).exists() for name in names):
+        STORAGE.touch(directory)
+        return directory
+    return None
+
+
+@contextmanager
+def populate(digest: str, stage: str, *names: str, params: dict = None):
+    """
+    Yield a scratch directory for producing a stage's artifacts.
+    The directory is published atomically only if every named artifact was written,
+    so a half-finished stage is never mistaken for a cache hit.
+    """
+    final_dir = stage_dir(digest, stage, params)
+    work_dir = final_dir.with_name(f"{final_dir.name}.tmp-{uuid.uuid4().hex[:8]}")
+    work_dir.mkdir(parents=True)
+    try:
+        yield work_dir
+        if all((work_dir / name).exists() for name in names):
+            try:
+                os.replace(work_dir, final_dir)
+            except OSError:
+                # Another worker published the same stage first; keep theirs
+                if not final_dir.is_dir():
+                    raise
+            STORAGE.record(final_dir)
+    finally:
+        if work_dir.exists():
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def partial_dir(digest: str, stage: str, params: dict = None) -> Path:
+    """
+    Directory for a stage whose artifacts are written incrementally and may be resumed
+    after an interruption. It is renamed to the stage directory by publish_partial.
+    """
+    final_dir = stage_dir(digest, stage, params)
+    return final_dir.with_name(f"{final_dir.name}.partial")
+
+
+def publish_partial(digest: str, stage: str, params: dict = None) -> Path:
+    """
+    Mark an incrementally written stage as complete by publishing its partial directory.
+    """
+    final_dir = stage_dir(digest, stage, params)
+    try:
+        os.replace(partial_dir(digest, stage, params), final_dir)
+    except OSError:
+        if not final_dir.is_dir():
+            raise
+    STORAGE.record(final_dir)
+    return final_dir
+
+
+@contextmanager
+def stage_lock(digest: str, stage: str, params: dict = None):
+    """
+    Serialize the producers of one stage entry within this process, so two requests
+    never append to the same partial directory at once.
+    """
+    with _lock_for(digest, stage, params):
+        yield
+
+
+def _lock_for(digest: str, stage: str, params: dict = None) -> threading.Lock:
+    key = stage_dir(digest, stage, params)
+    with _stage_locks_lock:
+        return _stage_locks.setdefault(key, threading.Lock())
+
+
+@contextmanager
+def try_stage_lock(digest: str, stage: str, params: dict = None):
+    """
+    Like stage_lock, but never waits: yields True if this caller holds the lock, False if
+    another producer of the same stage entry does.
+    """
+    lock = _lock_for(digest, stage, params)
+    acquired = lock.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            lock.release()
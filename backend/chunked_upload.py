@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import cache
+from audio_processor import open_decoder_pipe
+from config import (EXTRACT_CHANNELS, EXTRACT_SAMPLE_RATE, UPLOAD_CHUNK_SIZE, UPLOAD_DIR,
+                    UPLOAD_EARLY_DECODE, UPLOAD_SESSION_DIR, UPLOAD_SESSION_TTL_SECONDS)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadNotFound(Exception):
+    pass
+
+
+class UploadOffsetMismatch(Exception):
+    def __init__(self, received: int):
+        super().__init__(f"expected offset {received}")
+        self.received = received
+
+
+class UploadIncomplete(Exception):
+    pass
+
+
+_place_lock = threading.Lock()
+
+
+def place_upload(path: Path, filename: str, digest: str) -> Path:
+    """
+    Move a finished upload into UPLOAD_DIR under `filename` and return its final path.
+    An existing file with the same content is reused; one with different content is never
+    overwritten, the upload gets a name with a digest suffix instead.
+    """
+    name = Path(filename).name
+    candidates = [UPLOAD_DIR / name, UPLOAD_DIR / f"{Path(name).stem}-{digest[:12]}{Path(name).suffix}"]
+    with _place_lock:
+        for target in candidates:
+            if not target.exists():
+                os.replace(path, target)
+                cache.remember_digest(target, digest)
+                return target
+            if cache.file_digest(target) == digest:
+                path.unlink(missing_ok=True)
+                return target
+        raise FileExistsError(f"{candidates[-1].name} exists with different content")
+
+
+def save_upload(source, filename: str) -> Path:
+    """
+    Write an uploaded file object to UPLOAD_DIR, hashing it on the way (see place_upload).
+    """
+    sha = hashlib.sha256()
+    tmp_path = UPLOAD_DIR / f".{Path(filename).name}.upload-{uuid.uuid4().hex[:8]}"
+    try:
+        with open(tmp_path, "wb") as f:
+            for block in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+                sha.update(block)
+                f.write(block)
+        return place_upload(tmp_path, filename, sha.hexdigest())
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+class UploadSession:
+    """
+    One chunked upload. Chunks are appended in order to a partial file next to UPLOAD_DIR
+    and hashed as they arrive; with early decoding they are also piped into ffmpeg.
+    Session state is saved after every chunk, so an upload can resume after a dropped
+    connection or a server restart.
+    """
+
+    def __init__(self, upload_id: str, filename: str, size: int, decode: bool, received: int = 0,
+                 created_at: float = None):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.decode = decode
+        self.received = received
+        self.created_at = created_at or time.time()
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+        self._sha = None
+        self._decoder = None
+
+    @property
+    def partial_path(self) -> Path:
+        return UPLOAD_SESSION_DIR / f"{self.id}.part"
+
+    @property
+    def decoded_path(self) -> Path:
+        return UPLOAD_SESSION_DIR / f"{self.id}.wav"
+
+    @property
+    def decoder_log_path(self) -> Path:
+        return UPLOAD_SESSION_DIR / f"{self.id}.log"
+
+    @property
+    def state_path(self) -> Path:
+        return UPLOAD_SESSION_DIR / f"{self.id}.json"
+
+    def to_dict(self) -> dict:
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "received": self.received,
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+            "decode": self.decode,
+            "created_at": self.created_at,
+        }
+
+    def save(self):
+        state = {"upload_id": self.id, "filename": self.filename, "size": self.size,
+                 "received": self.received, "decode": self.decode, "created_at": self.created_at}
+        tmp_path = self.state_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    @classmethod
+    def load(cls, upload_id: str):
+        path = UPLOAD_SESSION_DIR / f"{upload_id}.json"
+        try:
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # The decoder cannot pick up a stream halfway, so a resumed session extracts normally
+        session = cls(state["upload_id"], state["filename"], state["size"], False,
+                      state["received"], state["created_at"])
+        for path in (session.decoded_path, session.decoder_log_path):
+            path.unlink(missing_ok=True)
+        return session
+
+    def _ensure_hasher(self):
+        """
+        Rebuild the running hash from the bytes on disk (after a restart), dropping any
+        bytes beyond the last acknowledged chunk.
+        """
+        if self._sha is not None:
+            return
+        self._sha = hashlib.sha256()
+        if not self.partial_path.exists():
+            self.partial_path.touch()
+        with open(self.partial_path, "r+b") as f:
+            f.truncate(self.received)
+            for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                self._sha.update(block)
+
+    def _feed_decoder(self, data: bytes):
+        if not self.decode:
+            return
+        if self._decoder is None:
+            if self.received:
+                self.decode = False
+                return
+            with open(self.decoder_log_path, "wb") as log:
+                self._decoder = open_decoder_pipe(self.decoded_path, EXTRACT_SAMPLE_RATE, EXTRACT_CHANNELS, log)
+        try:
+            self._decoder.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            # ffmpeg gave up (e.g. the container needs seeking); extraction runs after the upload instead
+            print(f"Early decoding of upload {self.id} stopped; audio will be extracted after upload")
+            self._stop_decoder()
+            self.decode = False
+
+    def _stop_decoder(self) -> bool:
+        """
+        Close the decoder's input and wait for it. Returns True if it decoded the whole stream.
+        """
+        decoder, self._decoder = self._decoder, None
+        if decoder is None:
+            return False
+        try:
+            decoder.stdin.close()
+        except OSError:
+            pass
+        ok = decoder.wait() == 0
+        # ffmpeg can exit 0 after giving up on a truncated stream, but it always logs an error
+        try:
+            ok = ok and self.decoder_log_path.stat().st_size == 0
+            self.decoder_log_path.unlink()
+        except OSError:
+            pass
+        return ok
+
+    def write(self, offset: int, data: bytes) -> int:
+        with self.lock:
+            if offset != self.received:
+                raise UploadOffsetMismatch(self.received)
+            if self.received + len(data) > self.size:
+                raise ValueError("chunk exceeds the declared file size")
+            self._ensure_hasher()
+            with open(self.partial_path, "r+b") as f:
+                f.seek(offset)
+                f.write(data)
+            self._sha.update(data)
+            self._feed_decoder(data)
+            self.received += len(data)
+            self.updated_at = time.time()
+            self.save()
+            return self.received
+
+    def complete(self):
+        """
+        Move the finished file into UPLOAD_DIR (see place_upload). Returns (video_path, digest, decoded_audio_path);
+        the decoded audio is None unless early decoding succeeded.
+        """
+        with self.lock:
+            if self.received != self.size:
+                raise UploadIncomplete(f"received {self.received} of {self.size} bytes")
+            self._ensure_hasher()
+            decoded = self._stop_decoder() and self.decode and self.decoded_path.exists()
+
+            digest = self._sha.hexdigest()
+            video_path = place_upload(self.partial_path, self.filename, digest)
+            self.state_path.unlink(missing_ok=True)
+            if not decoded:
+                self.decoded_path.unlink(missing_ok=True)
+            return video_path, digest, self.decoded_path if decoded else None
+
+    def discard(self):
+        with self.lock:
+            self._stop_decoder()
+            for path in (self.partial_path, self.decoded_path, self.decoder_log_path, self.state_path):
+                path.unlink(missing_ok=True)
+
+
+class UploadManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def create(self, filename: str, size: int, decode: bool = UPLOAD_EARLY_DECODE) -> UploadSession:
+        self.prune()
+        session = UploadSession(uuid.uuid4().hex, Path(filename).name, size, decode)
+        session.partial_path.touch()
+        session.save()
+        with self._lock:
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, upload_id: str) -> UploadSession:
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None and all(c in "0123456789abcdef" for c in upload_id):
+                session = UploadSession.load(upload_id)
+                if session:
+                    self._sessions[upload_id] = session
+        if session is None:
+            raise UploadNotFound(upload_id)
+        return session
+
+    def finish(self, upload_id: str):
+        session = self.get(upload_id)
+        result = session.complete()
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        return result
+
+    def discard(self, upload_id: str) -> Optional[UploadSession]:
+        session = self.get(upload_id)
+        session.discard()
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        return session
+
+    def prune(self):
+        """
+        Discard sessions (including ones left by a previous server run) idle for longer than
+        UPLOAD_SESSION_TTL_SECONDS.
+        """
+        cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+        for state_path in UPLOAD_SESSION_DIR.glob("*.json"):
+            try:
+                if state_path.stat().st_mtime < cutoff:
+                    self.discard(state_path.stem)
+            except (UploadNotFound, OSError):
+                continue
+
+
+UPLOADS = UploadManager()
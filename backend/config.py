@@ -10,10 +10,181 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 SEPARATED_DIR = UPLOAD_DIR / "separated"
 SEPARATED_DIR.mkdir(exist_ok=True)
 
+# Content-addressed artifact cache (kept under UPLOAD_DIR so it is served by /uploads)
+CACHE_DIR = UPLOAD_DIR / "cache"
+CACHE_DIR.mkdir(exist_ok=True)
+
+# Chunked, resumable uploads: partial files and session state live here until completed
+UPLOAD_SESSION_DIR = UPLOAD_DIR / ".chunked"
+UPLOAD_SESSION_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Unfinished upload sessions untouched for this long are discarded
+UPLOAD_SESSION_TTL_SECONDS = 24 * 3600
+# Decode audio from the bytes as they arrive, so extraction is done when the upload completes
+UPLOAD_EARLY_DECODE = True
+
 # Performance & Model settings
 WHISPER_MODEL_NAME = "medium"
+# CTranslate2 threads per Whisper model (0 = library default) and parallel workers per model
+WHISPER_CPU_THREADS = 0
+WHISPER_NUM_WORKERS = 1
+# Default batch size of the batched transcription mode (faster-whisper BatchedInferencePipeline)
+WHISPER_BATCH_SIZE = 8
+# Whisper models a request may select (e.g. "small" for drafts, "medium" for final)
+WHISPER_ALLOWED_MODELS = ["tiny", "base", "small", "medium", "large-v3"]
+# Replicas per model so concurrent transcriptions run in parallel instead of queueing
+WHISPER_MAX_REPLICAS = 2
+# Memory budget for resident Whisper models; idle models are evicted LRU-first beyond it
+WHISPER_POOL_MEMORY_BUDGET_MB = 6000
+# Approximate resident size of one loaded model, counted against the budget
+WHISPER_MODEL_MEMORY_MB = {
+    "tiny": 150,
+    "base": 250,
+    "small": 600,
+    "medium": 1500,
+    "large-v3": 3000,
+}
 DEMUCS_MODEL_NAME = "htdemucs"
 
+# Demucs separation profiles, selectable per request (speed vs. quality):
+#   model     pretrained model or bag of models
+#   shifts    random time shifts averaged (0 = a single pass)
+#   overlap   overlap between the model's segments
+#   segment   segment length in seconds (None = the model's own, the maximum for HTDemucs)
+#   threads   torch CPU threads while separating (0 = leave torch's default)
+#   quantize  dynamic int8 quantization of the linear layers (CPU only)
+#   vocals_only  keep only the vocals estimate and compute the accompaniment as mix minus vocals;
+#             models of a bag that do not contribute to the vocals are skipped
+SEPARATION_PROFILES = {
+    "draft": {"model": DEMUCS_MODEL_NAME, "shifts": 0, "overlap": 0.1, "segment": None,
+              "threads": 0, "quantize": True, "vocals_only": True},
+    # The settings separation had before profiles existed: no_vocals is the sum of the other stems
+    "standard": {"model": DEMUCS_MODEL_NAME, "shifts": 1, "overlap": 0.25, "segment": None,
+                 "threads": 0, "quantize": False, "vocals_only": False},
+    "max": {"model": "htdemucs_ft", "shifts": 2, "overlap": 0.5, "segment": None,
+            "threads": 0, "quantize": False, "vocals_only": True},
+}
+SEPARATION_PROFILE = "standard"
+# Storage format of the separated stems:
+#   flac     lossless 16-bit FLAC (about half the size of pcm16)
+#   pcm16    16-bit WAV
+#   float32  32-bit float WAV (no clipping or quantization, twice the size of pcm16)
+STEM_FORMAT = "flac"
+
+# Waveform peak pyramid of the separated stems for the editor timeline (GET /peaks):
+# level 0 holds the min/max of every PEAKS_SAMPLES_PER_PEAK samples and each further level
+# combines PEAKS_LEVEL_FACTOR peaks of the level below, until a level has at most PEAKS_MIN_LEVEL_PEAKS
+PEAKS_SAMPLES_PER_PEAK = 256
+PEAKS_LEVEL_FACTOR = 2
+PEAKS_MIN_LEVEL_PEAKS = 1024
+# Upper bound on the peaks returned by one request
+PEAKS_MAX_RESPONSE_PEAKS = 8192
+
+# Disk quota for UPLOAD_DIR in MB (0 = unlimited). Beyond it the least recently used derived
+# artifacts (cached stages, exported videos, subtitle files) are evicted and regenerated when
+# next needed; uploaded originals count towards the quota but are never evicted
+STORAGE_QUOTA_MB = 20 * 1024
+# Artifacts used more recently than this are never evicted. Stages pin the artifacts they read
+# (Storage.pin); this only covers the moment between a cache lookup and the pin
+STORAGE_MIN_IDLE_SECONDS = 60
+# Pins older than this were left by a process that died while holding them and are ignored
+STORAGE_PIN_MAX_SECONDS = 12 * 3600
+# Number of evictions remembered, so evicted vocals can be regenerated on demand (see regenerate_evicted_vocals)
+STORAGE_EVICTED_HISTORY = 1000
+# Last-access updates are written to the storage index at most this often
+STORAGE_INDEX_SAVE_SECONDS = 30
+
+# Extracted audio: lossless float32 WAV at the Demucs models' sample rate and channel count
+EXTRACT_SAMPLE_RATE = 44100
+EXTRACT_CHANNELS = 2
+
+# Tracks at least this long are separated in overlapping windows and written incrementally,
+# so peak memory depends on the window size rather than the track length
+DEMUCS_STREAMING_MIN_SECONDS = 600
+DEMUCS_STREAM_WINDOW_SECONDS = 60
+DEMUCS_STREAM_OVERLAP_SECONDS = 2
+
+# Energy-based vocal activity gating: Whisper only decodes the regions of the separated vocals
+# where someone is audibly singing, skipping instrumental intros, solos and outros
+VOCAL_ACTIVITY_GATE = True
+VOCAL_ACTIVITY_FRAME_SECONDS = 0.05
+# A frame is active above this level (dBFS) and within VOCAL_ACTIVITY_RELATIVE_DB of the track's loud frames
+VOCAL_ACTIVITY_THRESHOLD_DB = -45
+VOCAL_ACTIVITY_RELATIVE_DB = -30
+# Regions are extended by the padding; gaps shorter than MIN_GAP are bridged
+VOCAL_ACTIVITY_PADDING_SECONDS = 0.3
+VOCAL_ACTIVITY_MIN_GAP_SECONDS = 1.5
+VOCAL_ACTIVITY_MIN_REGION_SECONDS = 0.2
+
+# Forced alignment of known lyrics (transcription requests with "lyrics"): the lines are aligned
+# to the vocals window by window from the model's cross-attention instead of being decoded.
+# Lines ending this close to a window's end are carried over to the next window
+ALIGNMENT_CARRY_MARGIN_SECONDS = 1.0
+# Text tokens aligned against one 30 s window at most (Whisper's text context is 448 tokens)
+ALIGNMENT_MAX_TOKENS = 224
+
+# Pipelined separation -> transcription: while a pipelined transcription waits for a video,
+# its separation publishes vocals window by window and Whisper transcribes them while Demucs
+# is still running (separations nobody waits for keep the regular in-memory/streaming path)
+PIPELINED_SEPARATION = True
+PIPELINE_WINDOW_SECONDS = 20
+# Whisper transcribes the published vocals in chunks of at least this length
+PIPELINE_CHUNK_SECONDS = 30
+# A segment ending this close to a chunk's end is re-transcribed with the next chunk
+PIPELINE_CARRY_MARGIN_SECONDS = 1.0
+
+# Live transcription sessions (/transcribe-live): decoding goes on when the client disconnects and
+# the buffered segments can be fetched again from a cursor. Sessions no client has followed for
+# TRANSCRIPTION_SESSION_TTL_SECONDS are stopped and dropped
+TRANSCRIPTION_SESSION_TTL_SECONDS = 600
+# Opt-in progress streams send a heartbeat after this long without other events
+TRANSCRIPTION_HEARTBEAT_SECONDS = 10
+# How often a stream checks its session for new records
+TRANSCRIPTION_STREAM_POLL_SECONDS = 0.2
+
+# Subtitle export
+# Burned-in exports split the video into keyframe-aligned pieces of about this length and
+# encode them in parallel (EXPORT_WORKERS processes, 0 = one per CPU core)
+EXPORT_PIECE_SECONDS = 10
+EXPORT_WORKERS = 0
+EXPORT_VIDEO_CODEC = "libx264"
+EXPORT_CRF = 23
+
+# Range previews (POST /preview): a short window re-encoded at low resolution with a fast preset,
+# to check how the burned-in subtitles look without a full export
+PREVIEW_DURATION_SECONDS = 10
+PREVIEW_MAX_SECONDS = 30
+PREVIEW_HEIGHT = 360
+PREVIEW_PRESET = "ultrafast"
+PREVIEW_CRF = 28
+
+# Batch processing (batch_process.py): each worker process holds its own Demucs and Whisper
+# models, so the pool is sized by both CPU cores and this per-worker memory estimate
+BATCH_WORKER_MEMORY_MB = 4000
+BATCH_VIDEO_EXTENSIONS = [".mp4", ".mov", ".mkv", ".webm", ".avi", ".m4v"]
+
+# Load Demucs and Whisper in the background warm-up at server startup instead of on the
+# first request; GET /readyz reports ready once they are resident
+PRELOAD_MODELS = False
+# Run one throwaway inference after preloading so the first request is not slowed by lazy initialization
+WARM_UP_MODELS = True
+
+# Background job scheduling
+# Number of jobs processed concurrently; each stage additionally waits for one of its own slots
+JOB_WORKERS = 4
+JOB_STAGE_SLOTS = {
+    "extract": 2,
+    "separate": 1,
+    "transcribe": 2,
+    "export": 1,
+    # Previews are short; they get their own slots so they never wait behind full exports
+    "preview": 2,
+}
+# Finished jobs kept for GET /jobs
+JOB_HISTORY_LIMIT = 200
+# Threads for blocking work started from async endpoints (separation waits, live transcription streams)
+BLOCKING_POOL_WORKERS = 8
+
 # Transcription fine-tuning
 WHISPER_SETTINGS = {
     "beam_size": 5,
@@ -0,0 +1,283 @@
+import csv
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cache
+from audio_processor import burn_subtitles, create_srt, ffmpeg_binary
+from config import (EXPORT_CRF, EXPORT_PIECE_SECONDS, EXPORT_VIDEO_CODEC, EXPORT_WORKERS, PREVIEW_CRF,
+                    PREVIEW_HEIGHT, PREVIEW_PRESET, UPLOAD_DIR)
+from segments import SegmentStore, iter_subtitles
+from storage import STORAGE
+
+EXPORT_MODES = ("burn", "soft")
+
+PIECES_LIST_NAME = "pieces.csv"
+MANIFEST_NAME = "manifest.json"
+PREVIEW_NAME = "preview.mp4"
+PREVIEW_SUBTITLES_NAME = "preview.srt"
+# Encoded pieces are Matroska, which holds EXPORT_VIDEO_CODEC whatever the source container
+ENCODED_PIECE_SUFFIX = ".mkv"
+# Containers a burned-in export (EXPORT_VIDEO_CODEC video, the source's audio) is written to as is
+BURN_CONTAINERS = (".mp4", ".m4v", ".mov", ".mkv")
+
+# Subtitle codec for a stream-copied soft-subtitle track, per output container
+SOFT_SUBTITLE_CODECS = {
+    ".mp4": "mov_text",
+    ".m4v": "mov_text",
+    ".mov": "mov_text",
+    ".mkv": "ass",
+    ".webm": "webvtt",
+}
+
+
+def _run_ffmpeg(args: list, cwd: Path = None):
+    cmd = [ffmpeg_binary(), "-nostdin", "-hide_banner", "-loglevel", "error", "-y", *args]
+    result = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg error: {result.stderr.strip()}")
+
+
+def export_workers() -> int:
+    return EXPORT_WORKERS or os.cpu_count() or 1
+
+
+def soft_subtitle_path(output_path: Path) -> Path:
+    """
+    Output path for a soft-subtitle export; containers without a text subtitle codec become .mkv.
+    """
+    if output_path.suffix.lower() in SOFT_SUBTITLE_CODECS:
+        return output_path
+    return output_path.with_suffix(".mkv")
+
+
+def burned_output_path(output_path: Path) -> Path:
+    """
+    Output path for a burned-in export; containers that cannot hold the encoded video (e.g. .webm) become .mkv.
+    """
+    if output_path.suffix.lower() in BURN_CONTAINERS:
+        return output_path
+    return output_path.with_suffix(".mkv")
+
+
+def mux_subtitles(video_path: Path, srt_path: Path, output_path: Path) -> bool:
+    """
+    Attach subtitles as a separate track. Video and audio are stream-copied, so this takes
+    about as long as copying the file.
+    """
+    try:
+        codec = SOFT_SUBTITLE_CODECS[output_path.suffix.lower()]
+        print(f"Muxing subtitles from {srt_path} into {video_path} ({codec})")
+        _run_ffmpeg([
+            "-i", str(video_path), "-i", str(srt_path),
+            "-map", "0:v", "-map", "0:a?", "-map", "1:0",
+            "-c", "copy", "-c:s", codec,
+            str(output_path),
+        ])
+        print(f"Video with subtitle track saved to: {output_path}")
+        return True
+    except Exception as e:
+        print(f"Error muxing subtitles: {e}")
+        return False
+
+
+def split_at_keyframes(video_path: Path, work_dir: Path, piece_seconds: float = EXPORT_PIECE_SECONDS) -> list:
+    """
+    Split the video stream (without audio) into pieces of about `piece_seconds`, cutting at
+    the first keyframe after each boundary. Stream copy, so no decoding is involved.
+    Returns a list of (piece_path, start_seconds, end_seconds).
+    """
+    _run_ffmpeg([
+        "-i", str(video_path), "-map", "0:v:0", "-an", "-sn", "-c", "copy",
+        "-f", "segment", "-segment_time", str(piece_seconds), "-reset_timestamps", "1",
+        "-segment_list", str(work_dir / PIECES_LIST_NAME), "-segment_list_type", "csv",
+        str(work_dir / f"piece_%05d{video_path.suffix}"),
+    ])
+    return _read_pieces(work_dir)
+
+
+def _encode_piece(piece_path: Path, srt_path: Path, output_path: Path, threads: int):
+    # The SRT sits next to the output; a relative filter path (cwd = output directory)
+    # avoids escaping drive letters and colons
+    filters = f"subtitles=filename={srt_path.name}" if srt_path else "null"
+    _run_ffmpeg([
+        "-i", str(piece_path), "-vf", filters,
+        "-c:v", EXPORT_VIDEO_CODEC, "-crf", str(EXPORT_CRF), "-threads", str(threads),
+        output_path.name,
+    ], cwd=output_path.parent)
+
+
+def concat_pieces(pieces: list, audio_source: Path, work_dir: Path, output_path: Path):
+    """
+    Join encoded video pieces with the concat demuxer and mux the original audio back in.
+    Both steps are stream copies.
+    """
+    list_path = work_dir / "concat.txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for piece in pieces:
+            f.write(f"file '{piece.name}'\n")
+    _run_ffmpeg([
+        "-f", "concat", "-safe", "0", "-i", str(list_path), "-i", str(audio_source),
+        "-map", "0:v", "-map", "1:a?", "-c", "copy",
+        str(output_path),
+    ])
+
+
+def _ensure_pieces(video_path: Path, digest: str):
+    """
+    Return the cached export directory holding the video's keyframe-aligned pieces,
+    splitting the video only if it has not been split yet.
+    """
+    cached = cache.lookup(digest, "export", PIECES_LIST_NAME)
+    if cached:
+        return cached
+    with cache.populate(digest, "export", PIECES_LIST_NAME) as work_dir:
+        split_at_keyframes(video_path, work_dir)
+    return cache.lookup(digest, "export", PIECES_LIST_NAME)
+
+
+def _read_pieces(piece_dir: Path) -> list:
+    with open(piece_dir / PIECES_LIST_NAME, newline="") as f:
+        return [(piece_dir / name, float(start), float(end)) for name, start, end in csv.reader(f)]
+
+
+def _read_manifest(encoded_dir: Path) -> dict:
+    try:
+        with open(encoded_dir / MANIFEST_NAME, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _encode_piece_atomic(piece_path: Path, srt_path: Path, output_path: Path, threads: int):
+    partial_path = output_path.with_name(f"partial-{output_path.name}")
+    _encode_piece(piece_path, srt_path, partial_path, threads)
+    os.replace(partial_path, output_path)
+
+
+def burn_subtitles_parallel(video_path: Path, segments, output_path: Path, workers: int = None) -> bool:
+    """
+    Burn subtitles by encoding keyframe-aligned pieces of the video in parallel and
+    concatenating them. Each piece gets its own SRT shifted to the piece's timeline.
+
+    The pieces and their encodings are cached per video, keyed by the piece's SRT, so a
+    re-export after editing a few segments only re-encodes the pieces those segments fall
+    into and splices them with the previous encodings. Falls back to burn_subtitles when
+    the video cannot be split.
+    """
+    workers = workers or export_workers()
+    segments = SegmentStore.from_segments(segments)
+    digest = cache.file_digest(video_path)
+    # Pinned before the lookup, so the pieces cannot be evicted while they are encoded
+    with cache.stage_lock(digest, "export"), STORAGE.pin(cache.stage_dir(digest, "export")):
+        try:
+            piece_dir = _ensure_pieces(video_path, digest)
+        except Exception as e:
+            print(f"Could not split {video_path} at keyframes: {e}")
+            piece_dir = None
+        pieces = _read_pieces(piece_dir) if piece_dir else []
+
+        if len(pieces) < 2:
+            with tempfile.TemporaryDirectory(dir=UPLOAD_DIR, prefix=".export-") as tmp:
+                srt_path = Path(tmp) / "subtitles.srt"
+                return create_srt(segments, srt_path) and burn_subtitles(video_path, srt_path, output_path)
+
+        encoded_dir = piece_dir / "encoded"
+        encoded_dir.mkdir(exist_ok=True)
+        previous = _read_manifest(encoded_dir)
+
+        # An encoded piece is identified by its index and the content of its shifted SRT
+        encoded_paths = []
+        jobs = []
+        for index, (piece_path, start, end) in enumerate(pieces):
+            window = segments.slice(start, end)
+            srt_path = encoded_dir / f"{index:05d}.srt"
+            if window:
+                if not create_srt(window, srt_path):
+                    return False
+                subtitle_key = hashlib.sha256(srt_path.read_bytes()).hexdigest()[:16]
+            else:
+                srt_path = None
+                subtitle_key = "none"
+            encoded_path = encoded_dir / f"{index:05d}-{subtitle_key}{ENCODED_PIECE_SUFFIX}"
+            encoded_paths.append(encoded_path)
+            if not encoded_path.exists():
+                jobs.append((piece_path, srt_path, encoded_path))
+
+        changed = sum(1 for a, b in zip(previous.get("pieces", []), encoded_paths) if a != b.name)
+        print(f"Burning subtitles into {len(jobs)} of {len(pieces)} pieces of {video_path} with {workers} workers"
+              + (f" ({changed} changed since last export)" if previous else ""))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        partial_output = output_path.with_name(f".partial-{output_path.name}")
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_encode_piece_atomic, *job, threads) for job in jobs]
+                for future in futures:
+                    future.result()
+            concat_pieces(encoded_paths, video_path, encoded_dir, partial_output)
+            os.replace(partial_output, output_path)
+        except Exception as e:
+            print(f"Error burning subtitles: {e}")
+            partial_output.unlink(missing_ok=True)
+            return False
+
+        # Remember this export and drop encodings it no longer uses
+        manifest = {"pieces": [path.name for path in encoded_paths]}
+        with open(encoded_dir / MANIFEST_NAME, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        keep = set(manifest["pieces"]) | {MANIFEST_NAME}
+        for path in encoded_dir.iterdir():
+            if path.name not in keep:
+                path.unlink(missing_ok=True)
+        # The stage grew by its encodings
+        STORAGE.record(piece_dir)
+
+    print(f"Burned video saved to: {output_path}")
+    return True
+
+
+def render_preview(video_path: Path, segments, start: float, duration: float) -> Path:
+    """
+    Render `duration` seconds of the video from `start` with burned-in subtitles, scaled down
+    to at most PREVIEW_HEIGHT lines and encoded with a fast preset, for checking how the
+    subtitles look. Only the segments overlapping the window go into its subtitle file.
+    Previews are cached per window and subtitle content, so requesting the same window again
+    after editing other segments is a cache hit. Raises on FFmpeg errors.
+    """
+    window = SegmentStore.from_segments(segments).slice(start, start + duration)
+    subtitles = "".join(iter_subtitles(window, "srt"))
+    digest = cache.file_digest(video_path)
+    params = {
+        "start": round(start, 3),
+        "duration": round(duration, 3),
+        "subtitles": hashlib.sha256(subtitles.encode("utf-8")).hexdigest()[:16],
+    }
+    cached = cache.lookup(digest, "preview", PREVIEW_NAME, params=params)
+    if cached:
+        print(f"Cache hit (preview): {cached}")
+        return cached / PREVIEW_NAME
+
+    with cache.populate(digest, "preview", PREVIEW_NAME, params=params) as work_dir:
+        filters = f"scale=-2:min(ih\\,{PREVIEW_HEIGHT})"
+        if len(window):
+            (work_dir / PREVIEW_SUBTITLES_NAME).write_text(subtitles, encoding="utf-8")
+            # Relative filter path (cwd = work_dir), as for the export pieces
+            filters += f",subtitles=filename={PREVIEW_SUBTITLES_NAME}"
+        # Input seeking: decoding starts at the keyframe before `start` and the window's
+        # timestamps begin at zero, matching the shifted subtitles
+        _run_ffmpeg([
+            "-ss", f"{start:.3f}", "-t", f"{duration:.3f}", "-i", str(video_path),
+            "-map", "0:v:0", "-map", "0:a:0?", "-vf", filters,
+            "-c:v", EXPORT_VIDEO_CODEC, "-preset", PREVIEW_PRESET, "-crf", str(PREVIEW_CRF),
+            "-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart",
+            PREVIEW_NAME,
+        ], cwd=work_dir)
+
+    cached = cache.lookup(digest, "preview", PREVIEW_NAME, params=params)
+    if cached is None:
+        raise RuntimeError(f"Preview of {video_path} was not written")
+    return cached / PREVIEW_NAME
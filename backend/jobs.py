@@ -0,0 +1,276 @@
+import asyncio
+import contextvars
+import itertools
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from config import BLOCKING_POOL_WORKERS, JOB_HISTORY_LIMIT, JOB_STAGE_SLOTS, JOB_WORKERS
+from metrics import QUEUE_WAIT, TRACE_ID, current_trace_id
+
+# Relative cost of each stage, used to turn per-stage progress into an overall percentage
+STAGE_WEIGHTS = {"extract": 1, "separate": 8, "transcribe": 4, "export": 4}
+
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# Cancel event of the work running in the current context (a live transcription session).
+# Generators check it between units of work and blocking waits wake up this often to check it
+CANCEL_EVENT = contextvars.ContextVar("cancel_event", default=None)
+CANCEL_CHECK_SECONDS = 0.25
+
+
+class WorkCancelled(BaseException):
+    """
+    Raised by check_cancelled. Like GeneratorExit it is not an Exception, so the catch-all
+    error handlers of the transcription generators do not turn a cancellation into an error record.
+    """
+
+
+def check_cancelled():
+    event = CANCEL_EVENT.get()
+    if event is not None and event.is_set():
+        raise WorkCancelled()
+
+
+class Job:
+    def __init__(self, name: str, stages: list, priority: int):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.stages = stages
+        self.priority = priority
+        self.status = "queued"
+        self.stage = None
+        self.stage_index = 0
+        self.stage_progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.stage_started_at = None
+        self.finished_at = None
+        # Trace id of the request that submitted the job; stage spans are logged under it
+        self.trace_id = current_trace_id()
+        # Resolved with the job itself once it finishes; awaitable via asyncio.wrap_future
+        self.future = Future()
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def report(self, fraction: float):
+        """
+        Progress callback for stage functions. Raises JobCancelled once the job is cancelled
+        so long-running work can stop at its next progress report.
+        """
+        self.stage_progress = min(max(fraction, 0.0), 1.0)
+        if self.cancelled:
+            raise JobCancelled(self.id)
+
+    def _eta_seconds(self):
+        if self.status != "running" or not self.stage_started_at or self.stage_progress <= 0:
+            return None
+        elapsed = time.time() - self.stage_started_at
+        return round(elapsed / self.stage_progress * (1 - self.stage_progress), 1)
+
+    def _percent(self) -> float:
+        if self.status == "done":
+            return 100.0
+        weights = [STAGE_WEIGHTS.get(stage, 1) for stage, _ in self.stages]
+        completed = sum(weights[:self.stage_index])
+        if self.status == "running" and self.stage_index < len(weights):
+            completed += weights[self.stage_index] * self.stage_progress
+        return round(100.0 * completed / sum(weights), 1) if weights else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "priority": self.priority,
+            "stage": self.stage,
+            "stages": [stage for stage, _ in self.stages],
+            "stage_percent": round(100.0 * self.stage_progress, 1),
+            "percent": self._percent(),
+            "eta_seconds": self._eta_seconds(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "trace_id": self.trace_id,
+        }
+
+
+class JobScheduler:
+    """
+    Priority/FIFO job queue with a bounded number of concurrent slots per stage.
+    A job runs its stages in order on a worker thread, waiting for a free slot
+    of each stage before running it.
+    """
+
+    def __init__(self, workers: int, stage_slots: dict):
+        self._workers = workers
+        self._slots = {stage: threading.BoundedSemaphore(n) for stage, n in stage_slots.items()}
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    @contextmanager
+    def slot(self, stage: str):
+        """
+        Hold one slot of a stage. Also usable directly by synchronous request handlers.
+        """
+        semaphore = self._slots.get(stage)
+        if semaphore is None:
+            yield
+            return
+        check_cancelled()
+        while not semaphore.acquire(timeout=CANCEL_CHECK_SECONDS):
+            check_cancelled()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def submit(self, name: str, stages: list, priority: int = 0) -> Job:
+        """
+        Queue a job. `stages` is a list of (stage, fn) where fn(job) returns the stage result;
+        a None result fails the job. Lower priority values run first, ties run in FIFO order.
+        """
+        job = Job(name, stages, priority)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._queue.put((priority, next(self._counter), job))
+        self._ensure_workers()
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job and job.status not in FINISHED_STATUSES:
+            job.cancel()
+        return job
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.status in FINISHED_STATUSES]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(len(finished) - JOB_HISTORY_LIMIT, 0)]:
+            del self._jobs[job.id]
+
+    def _finish(self, job: Job, status: str, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job.future.set_result(job)
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job):
+        token = TRACE_ID.set(job.trace_id)
+        try:
+            self._run_stages(job)
+        except WorkCancelled:
+            # Cancellation of the work that called into a shared helper; the job itself stops here
+            pass
+        finally:
+            TRACE_ID.reset(token)
+            # Whatever a stage raised, the job must finish, or waiters on its future hang forever
+            if not job.future.done():
+                self._finish(job, "cancelled" if job.cancelled else "failed",
+                             None if job.cancelled else f"{job.stage} interrupted")
+
+    def _run_stages(self, job: Job):
+        if job.cancelled:
+            self._finish(job, "cancelled")
+            return
+
+        job.started_at = time.time()
+        result = None
+        for index, (stage, fn) in enumerate(job.stages):
+            job.stage = stage
+            job.stage_index = index
+            job.stage_progress = 0.0
+            job.status = "waiting"
+            # The first stage's wait includes the time the job sat in the queue
+            waiting_since = job.created_at if index == 0 else time.time()
+            with self.slot(stage):
+                if job.cancelled:
+                    self._finish(job, "cancelled")
+                    return
+                job.status = "running"
+                job.stage_started_at = time.time()
+                QUEUE_WAIT.observe(job.stage_started_at - waiting_since, stage=stage)
+                print(f"Job {job.id} ({job.name}): stage {stage} started")
+                try:
+                    result = fn(job)
+                except JobCancelled:
+                    result = None
+                except Exception as e:
+                    print(f"Job {job.id} ({job.name}): stage {stage} raised {e}")
+                    self._finish(job, "failed", str(e))
+                    return
+
+            if job.cancelled:
+                self._finish(job, "cancelled")
+                return
+            if result is None:
+                self._finish(job, "failed", f"{stage} failed")
+                return
+
+        job.result = result
+        job.stage_index = len(job.stages)
+        self._finish(job, "done")
+        print(f"Job {job.id} ({job.name}): done")
+
+
+SCHEDULER = JobScheduler(JOB_WORKERS, JOB_STAGE_SLOTS)
+
+
+# Dedicated pool for blocking work started from async request handlers, so heavy
+# calls never run on the event loop and do not compete with Starlette's own threadpool.
+BLOCKING_POOL = ThreadPoolExecutor(max_workers=BLOCKING_POOL_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(fn, *args):
+    """
+    Run a blocking call on BLOCKING_POOL and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    # Executor threads do not inherit context variables (e.g. the trace id) on their own
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(BLOCKING_POOL, context.run, fn, *args)
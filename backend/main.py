@@ -1,13 +1,30 @@
 # Trigger Reload 2
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-import shutil
-import os
 from pathlib import Path
+from typing import Optional
 
-from services import process_video_background, perform_transcription, get_upload_dir, export_video_with_subtitles
-from schemas import TranscribeRequest, ExportRequest
+from services import (submit_processing_job, perform_transcription, get_upload_dir, export_video_with_subtitles,
+                      adopt_extracted_audio, find_stem_peaks, render_preview)
+from schemas import (TranscribeRequest, ExportRequest, PreviewRequest, SeparateRequest, SubtitleRequest,
+                     UploadInitRequest)
+from chunked_upload import UPLOADS, UploadIncomplete, UploadNotFound, UploadOffsetMismatch, save_upload
+from segments import SUBTITLE_MEDIA_TYPES, SegmentStore, iter_subtitles
+from config import (PEAKS_MAX_RESPONSE_PEAKS, PRELOAD_MODELS, PREVIEW_DURATION_SECONDS, PREVIEW_MAX_SECONDS,
+                    SEPARATION_PROFILE, SEPARATION_PROFILES, TRANSCRIPTION_HEARTBEAT_SECONDS,
+                    TRANSCRIPTION_STREAM_POLL_SECONDS, UPLOAD_EARLY_DECODE, WARM_UP_MODELS, WHISPER_ALLOWED_MODELS)
+from models import MODELS, import_heavy_modules
+from audio_processor import ffmpeg_binary
+from jobs import SCHEDULER, run_blocking
+from storage import STORAGE
+from peaks import PEAK_SCALE, reduce_peaks
+from alignment import lyric_lines
+import metrics
+import asyncio
+import threading
+import time
 
 app = FastAPI()
 
@@ -25,36 +42,231 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the browser read the session id of a live transcription to resume it
+    expose_headers=["X-Transcription-Session"],
 )
 
 UPLOAD_DIR = get_upload_dir()
 
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Reuse the caller's trace id if it sent one, so spans can be correlated across services
+    trace_id = request.headers.get(metrics.TRACE_HEADER) or metrics.new_trace_id()
+    token = metrics.TRACE_ID.set(trace_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        metrics.TRACE_ID.reset(token)
+        route = request.scope.get("route")
+        metrics.HTTP_DURATION.observe(time.perf_counter() - start, method=request.method,
+                                      route=getattr(route, "path", "unmatched"), status=status)
+    response.headers[metrics.TRACE_HEADER] = trace_id
+    return response
+
+@app.middleware("http")
+async def touch_served_files(request: Request, call_next):
+    # Files fetched through /uploads count as used for the storage quota's LRU eviction
+    response = await call_next(request)
+    if request.method == "GET" and request.url.path.startswith("/uploads/") and response.status_code < 400:
+        await run_blocking(STORAGE.touch, UPLOAD_DIR / request.url.path[len("/uploads/"):])
+    return response
+
+# Set once the background warm-up has finished; /readyz reports it
+WARM_UP_DONE = threading.Event()
+WARM_UP_ERROR = None
+
+def warm_up_server():
+    # Inference libraries and models are loaded here so the server answers immediately after start
+    global WARM_UP_ERROR
+    try:
+        with metrics.span("warm_up"):
+            # Pick up artifacts written by earlier runs and apply the quota to them
+            STORAGE.scan()
+            ffmpeg_binary()
+            import_heavy_modules()
+            if PRELOAD_MODELS:
+                MODELS.preload(warm_up=WARM_UP_MODELS)
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        WARM_UP_ERROR = str(e)
+    finally:
+        WARM_UP_DONE.set()
+
+@app.on_event("startup")
+def start_warm_up():
+    threading.Thread(target=warm_up_server, name="warm-up", daemon=True).start()
+
 @app.get("/")
 def read_root():
     return {"Hello": "World", "app": "LyricSyncAI"}
 
+@app.get("/healthz")
+def healthz():
+    # Liveness: the process is up and serving requests
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    # Readiness: the warm-up has loaded the inference libraries (and models, if preloading)
+    if not WARM_UP_DONE.is_set():
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    if WARM_UP_ERROR is not None:
+        return JSONResponse(status_code=503, content={"status": "error", "error": WARM_UP_ERROR})
+    return {"status": "ready", "models": MODELS.stats()}
+
+@app.get("/models")
+def models_endpoint():
+    # Resident models with their load time, warm-up time and approximate memory use
+    return {"models": MODELS.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    # Prometheus text format; model and job gauges are refreshed on every scrape
+    metrics.MODEL_LOAD_SECONDS.clear()
+    metrics.MODEL_MEMORY_BYTES.clear()
+    for model in MODELS.stats():
+        labels = {"kind": model["kind"], "name": model["name"], "device": model["device"]}
+        if model["load_seconds"] is not None:
+            metrics.MODEL_LOAD_SECONDS.set(model["load_seconds"], **labels)
+        if model["memory_bytes"] is not None:
+            metrics.MODEL_MEMORY_BYTES.set(model["memory_bytes"], **labels)
+    metrics.JOBS.clear()
+    for status in ("queued", "waiting", "running", "done", "failed", "cancelled"):
+        metrics.JOBS.set(sum(1 for job in SCHEDULER.list() if job.status == status), status=status)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/storage")
+def storage_endpoint():
+    # Disk usage of UPLOAD_DIR against the quota (see STORAGE_QUOTA_MB)
+    return STORAGE.stats()
+
+def check_separation_profile(profile: Optional[str]) -> str:
+    if profile is None:
+        return SEPARATION_PROFILE
+    if profile not in SEPARATION_PROFILES:
+        raise HTTPException(status_code=400, detail=f"指定された分離プロファイルは使用できません: {profile}")
+    return profile
+
 @app.post("/upload")
-async def upload_video(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_video(file: UploadFile = File(...), priority: int = 0, profile: Optional[str] = None):
+    profile = check_separation_profile(profile)
     if not file.content_type.startswith("video/"):
         raise HTTPException(status_code=400, detail="無効なファイル形式です。動画ファイルをアップロードしてください。")
     
-    file_path = UPLOAD_DIR / file.filename
     try:
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        with metrics.span("upload"):
+            # Never overwrites an upload with other content of the same name
+            file_path = await run_blocking(save_upload, file.file, file.filename)
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="同じ名前の別のファイルが既に存在します")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ファイルの保存に失敗しました: {str(e)}")
+    await run_blocking(STORAGE.record, file_path)
     
-    # Schedule background processing
-    background_tasks.add_task(process_video_background, file_path)
+    # Queue background processing (bounded by the scheduler's per-stage slots)
+    job = submit_processing_job(file_path, priority, profile)
         
-    return {"filename": file.filename, "filepath": str(file_path), "message": "アップロードが完了しました。バックグラウンドで処理を開始します。"}
+    return {"filename": file_path.name, "filepath": str(file_path), "job_id": job.id, "message": "アップロードが完了しました。バックグラウンドで処理を開始します。"}
+
+# Chunked, resumable uploads: init -> PUT chunks in order (?offset=received) -> complete.
+# After a dropped connection, GET the session to find where to resume.
+@app.post("/upload/init")
+def upload_init(request: UploadInitRequest):
+    if not request.content_type.startswith("video/"):
+        raise HTTPException(status_code=400, detail="無効なファイル形式です。動画ファイルをアップロードしてください。")
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="ファイルサイズが不正です")
+    decode = UPLOAD_EARLY_DECODE if request.decode is None else request.decode
+    return UPLOADS.create(request.filename, request.size, decode).to_dict()
+
+def get_upload_session(upload_id: str):
+    try:
+        return UPLOADS.get(upload_id)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+
+@app.get("/upload/{upload_id}")
+def upload_status(upload_id: str):
+    return get_upload_session(upload_id).to_dict()
+
+@app.put("/upload/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    session = get_upload_session(upload_id)
+    data = await request.body()
+    try:
+        with metrics.span("upload_chunk"):
+            received = await run_blocking(session.write, offset, data)
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=f"オフセットが一致しません（受信済み: {e.received} バイト）")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="宣言されたファイルサイズを超えています")
+    return {"upload_id": upload_id, "received": received, "size": session.size}
+
+@app.post("/upload/{upload_id}/complete")
+async def upload_complete(upload_id: str, priority: int = 0, profile: Optional[str] = None):
+    profile = check_separation_profile(profile)
+    try:
+        video_path, _, decoded_audio = await run_blocking(UPLOADS.finish, upload_id)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    except UploadIncomplete:
+        raise HTTPException(status_code=409, detail="アップロードが完了していません")
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="同じ名前の別のファイルが既に存在します")
+    await run_blocking(STORAGE.record, video_path)
+
+    if decoded_audio:
+        # Audio was decoded while the upload was in progress; the job skips extraction
+        await run_blocking(adopt_extracted_audio, video_path, decoded_audio)
+    job = submit_processing_job(video_path, priority, profile)
+
+    return {"filename": video_path.name, "filepath": str(video_path), "job_id": job.id, "message": "アップロードが完了しました。バックグラウンドで処理を開始します。"}
+
+@app.delete("/upload/{upload_id}")
+def upload_abort(upload_id: str):
+    try:
+        UPLOADS.discard(upload_id)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    return {"upload_id": upload_id, "message": "アップロードを中止しました"}
+
+@app.get("/jobs")
+def list_jobs():
+    return {"jobs": [job.to_dict() for job in SCHEDULER.list()]}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = SCHEDULER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job.to_dict()
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = SCHEDULER.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job.to_dict()
+
+def check_whisper_model(request: TranscribeRequest):
+    if request.model is not None and request.model not in WHISPER_ALLOWED_MODELS:
+        raise HTTPException(status_code=400, detail=f"指定されたモデルは使用できません: {request.model}")
+    if request.separation_profile is not None:
+        check_separation_profile(request.separation_profile)
+    if request.lyrics is not None and not lyric_lines(request.lyrics):
+        raise HTTPException(status_code=400, detail="歌詞が空です")
 
 @app.post("/transcribe")
 def transcribe_endpoint(request: TranscribeRequest):
-    result = perform_transcription(request.filename)
+    check_whisper_model(request)
+    with SCHEDULER.slot("transcribe"):
+        result = perform_transcription(request.filename, request.mode, request.batch_size, request.model,
+                                       request.vocal_gate, request.separation_profile, request.lyrics)
     
     if result is None:
         # result is None can mean file not found or transcription error.
@@ -71,46 +283,171 @@ def transcribe_endpoint(request: TranscribeRequest):
 
 from fastapi.responses import StreamingResponse
 import json
-from services import perform_transcription_generator
+from services import media_duration, perform_transcription_generator, upload_relative_path
+from transcription_sessions import TRANSCRIPTIONS, SessionNotFound, TranscriptionSession
+
+# Response header carrying the session id of a /transcribe-live stream
+SESSION_HEADER = "X-Transcription-Session"
+
+def stream_session(session: TranscriptionSession, since: int, progress: bool, http_request: Request):
+    """
+    NDJSON stream of a transcription session's records from the `since` cursor on. With
+    `progress`, session, progress, heartbeat and done events are interleaved with them.
+    A client disconnect only ends the stream; the transcription itself goes on. The trace
+    id is sent once, in the X-Trace-Id header and the session event, not on every record.
+    """
+    trace_id = metrics.current_trace_id()
+
+    def line(record: dict) -> str:
+        # ensure_ascii=False to correctly handle Japanese characters
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    async def event_generator():
+        cursor = since
+        if progress:
+            yield line({"event": "session", "session_id": session.id, "cursor": cursor, "trace_id": trace_id})
+        last_event = time.monotonic()
+        while True:
+            session.touch()
+            # Read before the records, so a finished session's last records are never missed
+            finished = session.finished
+            records = session.records_since(cursor)
+            for record in records:
+                yield line(record)
+            cursor += len(records)
+            if progress and records:
+                yield line(session.progress())
+                last_event = time.monotonic()
+            if finished:
+                if progress:
+                    yield line({"event": "done", "status": session.status, "cursor": cursor})
+                break
+            if progress and time.monotonic() - last_event >= TRANSCRIPTION_HEARTBEAT_SECONDS:
+                yield line({"event": "heartbeat", "cursor": cursor})
+                last_event = time.monotonic()
+            if await http_request.is_disconnected():
+                print(f"Client disconnected; transcription session {session.id} continues")
+                break
+            await asyncio.sleep(TRANSCRIPTION_STREAM_POLL_SECONDS)
+
+    return StreamingResponse(event_generator(), media_type="application/x-ndjson",
+                             headers={SESSION_HEADER: session.id})
 
 @app.post("/transcribe-live")
-async def transcribe_live_endpoint(request: TranscribeRequest):
-    def event_generator():
-        for segment in perform_transcription_generator(request.filename):
-            # JSON formatted data with newline for streaming
-            # ensure_ascii=False to correctly handle Japanese characters
-            yield json.dumps(segment, ensure_ascii=False) + "\n"
+async def transcribe_live_endpoint(request: TranscribeRequest, http_request: Request):
+    check_whisper_model(request)
 
-    return StreamingResponse(event_generator(), media_type="application/x-ndjson")
+    def transcribe_records():
+        with SCHEDULER.slot("transcribe"):
+            yield from perform_transcription_generator(request.filename, request.pipelined,
+                                                       request.mode, request.batch_size, request.model,
+                                                       request.vocal_gate, request.separation_profile,
+                                                       request.lyrics)
+
+    duration = await run_blocking(media_duration, UPLOAD_DIR / upload_relative_path(request.filename))
+    session = TRANSCRIPTIONS.start(request.filename, duration, transcribe_records)
+    return stream_session(session, 0, request.progress, http_request)
+
+def get_transcription_session(session_id: str) -> TranscriptionSession:
+    try:
+        return TRANSCRIPTIONS.get(session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="文字起こしセッションが見つかりません")
+
+@app.get("/transcribe-live/{session_id}")
+async def transcribe_live_resume(session_id: str, http_request: Request, since: int = 0, progress: bool = False):
+    # Reconnect after a dropped connection: `since` is the number of records already received
+    session = get_transcription_session(session_id)
+    if not 0 <= since <= len(session.records):
+        raise HTTPException(status_code=400, detail=f"カーソルが不正です（0〜{len(session.records)}）")
+    return stream_session(session, since, progress, http_request)
+
+@app.get("/transcribe-live/{session_id}/status")
+def transcribe_live_status(session_id: str):
+    return get_transcription_session(session_id).to_dict()
+
+@app.delete("/transcribe-live/{session_id}")
+def transcribe_live_cancel(session_id: str):
+    try:
+        session = TRANSCRIPTIONS.cancel(session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="文字起こしセッションが見つかりません")
+    return {**session.to_dict(), "message": "文字起こしを中止しました"}
 
 @app.post("/separate")
-async def separate_endpoint(request: TranscribeRequest):
+async def separate_endpoint(request: SeparateRequest):
+    profile = check_separation_profile(request.profile)
     video_path = UPLOAD_DIR / request.filename
     if not video_path.exists():
         raise HTTPException(status_code=404, detail="動画ファイルが見つかりません")
-        
-    audio_path = video_path.with_suffix(".mp3")
     
-    from audio_processor import extract_audio, separate_vocals
-    from config import SEPARATED_DIR
+    # Extraction and separation run as a scheduled job (cached stages are skipped);
+    # awaiting its future keeps the event loop free while Demucs runs.
+    job = submit_processing_job(video_path, profile=profile)
+    await asyncio.wrap_future(job.future)
     
-    # 1. Extract Audio
-    if not extract_audio(video_path, audio_path):
-        raise HTTPException(status_code=500, detail="音声の抽出に失敗しました")
-        
-    # 2. Separate Vocals
-    vocals_path = separate_vocals(audio_path, SEPARATED_DIR)
-    if not vocals_path:
+    if job.status != "done":
+        if job.stage == "extract":
+            raise HTTPException(status_code=500, detail="音声の抽出に失敗しました")
         raise HTTPException(status_code=500, detail="ボーカルの分離に失敗しました")
+    vocals_path = job.result
         
     return {
-        "vocals_url": f"http://localhost:8001/uploads/separated/{Path(vocals_path).name}",
+        "vocals_url": f"http://localhost:8001/uploads/{Path(vocals_path).relative_to(UPLOAD_DIR).as_posix()}",
+        "profile": profile,
         "message": "分離が完了しました"
     }
 
+@app.get("/peaks")
+def peaks_endpoint(filename: str, stem: str = "vocals", profile: Optional[str] = None, start: float = 0.0,
+                   end: Optional[float] = None, level: Optional[int] = None, max_peaks: int = 2000):
+    """
+    Min/max waveform peaks of a separated stem for the editor timeline. `filename` is the
+    uploaded video (or a stem under /uploads). Without `level`, the finest zoom level that
+    covers [start, end) seconds with at most `max_peaks` peaks is chosen, and peaks of the
+    coarsest level are combined further when even that level holds more.
+    """
+    if stem not in ("vocals", "no_vocals"):
+        raise HTTPException(status_code=400, detail=f"指定されたステムは存在しません: {stem}")
+    if profile is not None:
+        check_separation_profile(profile)
+    pyramid = find_stem_peaks(filename, stem, profile)
+    if pyramid is None:
+        raise HTTPException(status_code=404, detail="波形データが見つかりません。先にボーカル分離を実行してください")
+
+    end = pyramid.duration if end is None else min(end, pyramid.duration)
+    start = max(start, 0.0)
+    max_peaks = min(max(max_peaks, 1), PEAKS_MAX_RESPONSE_PEAKS)
+    auto_level = level is None
+    if auto_level:
+        level = pyramid.best_level(start, end, max_peaks)
+    elif not 0 <= level < pyramid.levels:
+        raise HTTPException(status_code=400, detail=f"ズームレベルは 0〜{pyramid.levels - 1} で指定してください")
+    elif (end - start) / pyramid.seconds_per_peak(level) > PEAKS_MAX_RESPONSE_PEAKS:
+        raise HTTPException(status_code=400, detail="範囲が広すぎます。範囲を狭めるか粗いズームレベルを指定してください")
+
+    first, data = pyramid.read(level, start, end)
+    seconds_per_peak = pyramid.seconds_per_peak(level)
+    if auto_level:
+        # Even the coarsest level may hold more peaks than asked for; combine them further
+        data, factor = reduce_peaks(data, max_peaks)
+        seconds_per_peak *= factor
+    return {
+        "level": level,
+        "levels": pyramid.levels,
+        "seconds_per_peak": seconds_per_peak,
+        "start": first * pyramid.seconds_per_peak(level),
+        "duration": pyramid.duration,
+        # Interleaved (min, max) pairs scaled to -scale..scale
+        "scale": PEAK_SCALE,
+        "peaks": data.ravel().tolist(),
+    }
+
 @app.post("/export")
 def export_endpoint(request: ExportRequest):
-    output_filename = export_video_with_subtitles(request.video_filename, request.segments)
+    with SCHEDULER.slot("export"):
+        segments = SegmentStore.from_segments(request.segments)
+        output_filename = export_video_with_subtitles(request.video_filename, segments, request.mode)
     
     if output_filename is None:
         raise HTTPException(status_code=500, detail="動画の書き出しに失敗しました")
@@ -119,3 +456,46 @@ def export_endpoint(request: ExportRequest):
         "filename": output_filename,
         "url": f"http://localhost:8001/uploads/{output_filename}"
     }
+
+@app.post("/preview")
+def preview_endpoint(request: PreviewRequest):
+    """
+    Render a short, low-resolution window of the video with burned-in subtitles to check
+    their look without a full export.
+    """
+    video_path = UPLOAD_DIR / request.video_filename
+    if not video_path.is_file():
+        raise HTTPException(status_code=404, detail="動画ファイルが見つかりません")
+    duration = PREVIEW_DURATION_SECONDS if request.duration is None else request.duration
+    if duration <= 0 or duration > PREVIEW_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"プレビューの長さは {PREVIEW_MAX_SECONDS} 秒以内で指定してください")
+    video_duration = media_duration(video_path)
+    if request.start < 0 or (video_duration is not None and request.start >= video_duration):
+        raise HTTPException(status_code=400, detail="プレビューの開始位置が動画の範囲外です")
+    if video_duration is not None:
+        duration = min(duration, video_duration - request.start)
+
+    with SCHEDULER.slot("preview"):
+        preview_path = render_preview(video_path, request.segments, request.start, duration)
+    if preview_path is None:
+        raise HTTPException(status_code=500, detail="プレビューの作成に失敗しました")
+
+    relative = preview_path.relative_to(UPLOAD_DIR).as_posix()
+    return {
+        "filename": relative,
+        "url": f"http://localhost:8001/uploads/{relative}",
+        "start": request.start,
+        "duration": duration,
+    }
+
+@app.post("/subtitles")
+def subtitles_endpoint(request: SubtitleRequest):
+    """
+    Stream the edited segments as a subtitle file (SRT, WebVTT, ASS or LRC).
+    """
+    segments = SegmentStore.from_segments(request.segments)
+    return StreamingResponse(
+        iter_subtitles(segments, request.format),
+        media_type=f"{SUBTITLE_MEDIA_TYPES[request.format]}; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="subtitles.{request.format}"'},
+    )
@@ -6,7 +6,7 @@ import sys
 BASE_DIR = Path(__file__).parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 VIDEO_PATH = UPLOAD_DIR / "demo.mp4"
-AUDIO_PATH = VIDEO_PATH.with_suffix(".mp3")
+AUDIO_PATH = VIDEO_PATH.with_suffix(".wav")
 SEPARATION_OUT_DIR = UPLOAD_DIR / "separated"
 
 print(f"Python executable: {sys.executable}")
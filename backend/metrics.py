@@ -0,0 +1,261 @@
+import contextvars
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Propagated to worker threads by jobs.run_blocking, the job scheduler and transcription sessions
+TRACE_ID = contextvars.ContextVar("trace_id", default=None)
+TRACE_HEADER = "X-Trace-Id"
+
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id():
+    return TRACE_ID.get()
+
+
+def current_rss_bytes():
+    """
+    Resident set size of this process in bytes, or None if it cannot be determined.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakRss:
+    """
+    Sample the process RSS in a background thread and keep the peak seen while active.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.peak = current_rss_bytes() or 0
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            self.peak = max(self.peak, current_rss_bytes() or 0)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes() or 0)
+
+
+# --- Prometheus text exposition (format 0.0.4) ---
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.label_names, key), value) for key, value in items]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> list:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                le = f'le="{_format_value(bound)}"'
+                samples.append((f"{self.name}_bucket", _format_labels(self.label_names, key, le), count))
+            samples.append((f"{self.name}_sum", _format_labels(self.label_names, key), total))
+            samples.append((f"{self.name}_count", _format_labels(self.label_names, key), counts[-1]))
+        return samples
+
+
+REGISTRY = []
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+STAGE_DURATION = Histogram(
+    "lyricsync_stage_duration_seconds", "Wall time of pipeline stages.", ["stage", "status"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+STAGE_REAL_TIME_FACTOR = Histogram(
+    "lyricsync_stage_real_time_factor", "Wall time divided by audio duration per stage run.", ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+STAGE_AUDIO_SECONDS = Counter(
+    "lyricsync_stage_audio_seconds_total", "Seconds of audio processed per stage.", ["stage"],
+)
+STAGE_PEAK_RSS = Gauge(
+    "lyricsync_stage_peak_rss_bytes", "Peak process RSS during the last run of each stage.", ["stage"],
+)
+STAGE_SEGMENTS_PER_SECOND = Gauge(
+    "lyricsync_stage_segments_per_second", "Segments produced per second of wall time by the last run.", ["stage"],
+)
+QUEUE_WAIT = Histogram(
+    "lyricsync_job_queue_wait_seconds", "Time a job waited for a worker and a free slot before each stage.",
+    ["stage"], buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900),
+)
+HTTP_DURATION = Histogram(
+    "lyricsync_http_request_duration_seconds", "Time until the response headers were sent.",
+    ["method", "route", "status"], buckets=(0.005, 0.025, 0.1, 0.25, 1, 2.5, 10, 60),
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "lyricsync_model_load_seconds", "Load time of resident models.", ["kind", "name", "device"],
+)
+MODEL_MEMORY_BYTES = Gauge(
+    "lyricsync_model_memory_bytes", "Approximate memory of resident models.", ["kind", "name", "device"],
+)
+JOBS = Gauge("lyricsync_jobs", "Jobs known to the scheduler by status.", ["status"])
+
+
+class Span:
+    """
+    Timing of one stage run. Code inside the span can fill in `audio_seconds` and `segments`
+    once they are known.
+    """
+
+    def __init__(self, stage: str, audio_seconds: float = None):
+        self.stage = stage
+        self.audio_seconds = audio_seconds
+        self.segments = None
+        self.trace_id = current_trace_id()
+        self.status = "ok"
+        self.wall_seconds = None
+        self.peak_rss_bytes = None
+
+
+@contextmanager
+def span(stage: str, audio_seconds: float = None):
+    """
+    Measure a stage: wall time, real-time factor, peak RSS and segment throughput are
+    recorded as metrics and logged with the current trace id.
+    """
+    current = Span(stage, audio_seconds)
+    rss = PeakRss()
+    start = time.perf_counter()
+    try:
+        with rss:
+            yield current
+    except GeneratorExit:
+        current.status = "cancelled"
+        raise
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        current.wall_seconds = time.perf_counter() - start
+        current.peak_rss_bytes = rss.peak
+        _record(current)
+
+
+def _record(current: Span):
+    stage = current.stage
+    wall = current.wall_seconds
+    STAGE_DURATION.observe(wall, stage=stage, status=current.status)
+    STAGE_PEAK_RSS.set(current.peak_rss_bytes, stage=stage)
+
+    details = [f"status={current.status}", f"wall={wall:.3f}s"]
+    if current.audio_seconds:
+        STAGE_AUDIO_SECONDS.inc(current.audio_seconds, stage=stage)
+        rtf = wall / current.audio_seconds
+        details += [f"audio={current.audio_seconds:.1f}s", f"rtf={rtf:.3f}"]
+        if current.status == "ok":
+            STAGE_REAL_TIME_FACTOR.observe(rtf, stage=stage)
+    if current.segments is not None and wall > 0:
+        segments_per_second = current.segments / wall
+        STAGE_SEGMENTS_PER_SECOND.set(segments_per_second, stage=stage)
+        details.append(f"segments/s={segments_per_second:.2f}")
+    details.append(f"peak_rss={current.peak_rss_bytes / (1024 * 1024):.0f}MB")
+    print(f"[span] {stage} trace={current.trace_id or '-'} " + " ".join(details))
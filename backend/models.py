@@ -0,0 +1,417 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import (SEPARATION_PROFILE, SEPARATION_PROFILES, WHISPER_CPU_THREADS, WHISPER_MAX_REPLICAS,
+                    WHISPER_MODEL_MEMORY_MB, WHISPER_MODEL_NAME, WHISPER_NUM_WORKERS,
+                    WHISPER_POOL_MEMORY_BUDGET_MB, WHISPER_SETTINGS)
+from jobs import CANCEL_CHECK_SECONDS, check_cancelled
+from metrics import current_rss_bytes
+
+
+# torch, demucs and faster_whisper take seconds to import, so they are imported on first use
+# (or by import_heavy_modules during the background warm-up) instead of at server start
+
+def import_heavy_modules():
+    """
+    Import the inference libraries ahead of the first request that needs them.
+    """
+    import demucs.apply  # noqa: F401
+    import demucs.pretrained  # noqa: F401
+    import faster_whisper  # noqa: F401
+    import torch  # noqa: F401
+
+
+def default_device() -> str:
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _load_demucs(name: str):
+    from demucs.pretrained import get_model
+
+    device = default_device()
+    print(f"--- Loading Demucs model ({name}) on {device} ---")
+    model = get_model(name)
+    model.to(device)
+    model.eval()
+    return model, device
+
+
+def _load_demucs_int8(name: str):
+    import torch
+    from demucs.pretrained import get_model
+
+    print(f"--- Loading Demucs model ({name}) on cpu with int8 dynamic quantization ---")
+    model = get_model(name)
+    model.eval()
+    # Weights of the linear (and LSTM) layers are stored as int8; activations are quantized on the fly
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+    return model, "cpu"
+
+
+def default_compute_type(device: str) -> str:
+    # Fast fallback or specific compute type
+    return "float16" if device == "cuda" else "int8"
+
+
+def _load_whisper(name: str, device: str, compute_type: str):
+    """
+    Load a faster-whisper model. Returns (model, device, compute_type) as actually loaded,
+    which differ from the requested ones after a fallback to CPU.
+    """
+    from faster_whisper import WhisperModel
+
+    threading_args = dict(cpu_threads=WHISPER_CPU_THREADS, num_workers=WHISPER_NUM_WORKERS)
+
+    print(f"--- Loading faster-whisper model ({name}) on {device} ({compute_type}) ---")
+    try:
+        return WhisperModel(name, device=device, compute_type=compute_type, **threading_args), device, compute_type
+    except Exception as e:
+        if device == "cpu":
+            raise
+        print(f"Failed to load model on {device}: {e}. Falling back to CPU...")
+        return WhisperModel(name, device="cpu", compute_type="int8", **threading_args), "cpu", "int8"
+
+
+def _warm_up_demucs(model, device):
+    import torch
+    from demucs.apply import apply_model
+
+    # One second of silence is padded to a full model segment, exercising every layer
+    silence = torch.zeros(1, model.audio_channels, model.samplerate)
+    with torch.no_grad():
+        apply_model(model, silence, device=device, shifts=0, split=True, progress=False)
+
+
+def _warm_up_whisper(model, device):
+    silence = np.zeros(16000, dtype=np.float32)
+    segments, _ = model.transcribe(silence, language=WHISPER_SETTINGS.get("language"), beam_size=1)
+    list(segments)
+
+
+def _is_torch_module(model) -> bool:
+    # A model cannot be a torch module if torch has not been imported yet
+    torch = sys.modules.get("torch")
+    return torch is not None and isinstance(model, torch.nn.Module)
+
+
+def _torch_model_bytes(model):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+_LOADERS = {
+    "demucs": (_load_demucs, _warm_up_demucs),
+    "demucs_int8": (_load_demucs_int8, _warm_up_demucs),
+}
+
+
+def separation_model_key(profile: dict):
+    """
+    Registry (kind, name) of the Demucs model a separation profile runs on.
+    Quantization only applies on CPU; on GPU the profile uses the regular model.
+    """
+    if profile.get("quantize") and default_device() == "cpu":
+        return "demucs_int8", profile["model"]
+    return "demucs", profile["model"]
+
+
+class ModelRegistry:
+    """
+    Thread-safe registry of resident models.
+    Each (kind, name) is loaded at most once; concurrent callers asking for a model
+    that is still loading wait for that load instead of starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._load_locks = {}
+
+    def get(self, kind: str, name: str):
+        key = (kind, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                return entry["model"]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry:
+                return entry["model"]
+
+            load, _ = _LOADERS[kind]
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            model, device = load(name)
+            load_seconds = time.perf_counter() - start
+            rss_after = current_rss_bytes()
+
+            if _is_torch_module(model):
+                memory_bytes = _torch_model_bytes(model)
+            elif rss_before is not None and rss_after is not None:
+                memory_bytes = max(rss_after - rss_before, 0)
+            else:
+                memory_bytes = None
+
+            print(f"--- Loaded {kind} model ({name}) in {load_seconds:.2f}s ---")
+            with self._lock:
+                self._entries[key] = {
+                    "model": model,
+                    "device": device,
+                    "load_seconds": load_seconds,
+                    "memory_bytes": memory_bytes,
+                    "warm_up_seconds": None,
+                }
+            return model
+
+    def install(self, kind: str, name: str, model, device: str = "cpu"):
+        """
+        Register an already constructed model under (kind, name), e.g. a stand-in for benchmarks.
+        """
+        with self._lock:
+            self._entries[(kind, name)] = {
+                "model": model,
+                "device": device,
+                "load_seconds": 0.0,
+                "memory_bytes": None,
+                "warm_up_seconds": None,
+            }
+
+    def device(self, kind: str, name: str) -> str:
+        self.get(kind, name)
+        with self._lock:
+            return self._entries[(kind, name)]["device"]
+
+    def warm_up(self, kind: str, name: str):
+        """
+        Run one throwaway inference so lazy kernel initialization is not paid by the first request.
+        """
+        model = self.get(kind, name)
+        device = self.device(kind, name)
+        _, warm_up = _LOADERS[kind]
+        start = time.perf_counter()
+        try:
+            warm_up(model, device)
+        except Exception as e:
+            print(f"Warm-up of {kind} model ({name}) failed: {e}")
+            return
+        with self._lock:
+            self._entries[(kind, name)]["warm_up_seconds"] = time.perf_counter() - start
+
+    def preload(self, warm_up: bool = True):
+        """
+        Load (and optionally warm up) the models used by the default pipeline.
+        """
+        kind, name = separation_model_key(SEPARATION_PROFILES[SEPARATION_PROFILE])
+        self.get(kind, name)
+        if warm_up:
+            self.warm_up(kind, name)
+        WHISPER_POOL.preload(WHISPER_MODEL_NAME, warm_up)
+
+    def stats(self) -> list:
+        with self._lock:
+            resident = [
+                {
+                    "kind": kind,
+                    "name": name,
+                    "device": entry["device"],
+                    "load_seconds": round(entry["load_seconds"], 3),
+                    "warm_up_seconds": None if entry["warm_up_seconds"] is None else round(entry["warm_up_seconds"], 3),
+                    "memory_bytes": entry["memory_bytes"],
+                }
+                for (kind, name), entry in self._entries.items()
+            ]
+        return resident + WHISPER_POOL.stats()
+
+
+@contextmanager
+def _cancellable_encode(model):
+    """
+    Check for cancellation before each window a faster-whisper model encodes, so cancelled work
+    stops even in long stretches that produce no segments. The replica is checked out exclusively,
+    so the instance attribute shadows the class's encode only for the current user.
+    """
+    encode = getattr(type(model), "encode", None)
+    if encode is None:
+        yield
+        return
+
+    def checked_encode(*args, **kwargs):
+        check_cancelled()
+        return encode(model, *args, **kwargs)
+
+    model.encode = checked_encode
+    try:
+        yield
+    finally:
+        del model.encode
+
+
+class _Replica:
+    def __init__(self, key):
+        self.key = key
+        self.model = None
+        self.busy = True
+        self.last_used = time.monotonic()
+        self.load_seconds = None
+        self.warm_up_seconds = None
+
+
+class WhisperPool:
+    """
+    Pool of faster-whisper models keyed by (model name, device, compute_type).
+    Concurrent transcriptions check out separate replicas (up to WHISPER_MAX_REPLICAS per key)
+    instead of sharing one instance. Loaded models stay resident within
+    WHISPER_POOL_MEMORY_BUDGET_MB; when a new replica does not fit, the least recently
+    used idle replicas of any model are evicted first.
+    """
+
+    def __init__(self, memory_budget_bytes: int, max_replicas: int):
+        self._memory_budget = memory_budget_bytes
+        self._max_replicas = max_replicas
+        self._cond = threading.Condition()
+        self._replicas = []
+        # Requested key -> key a model was actually loaded with (after a fallback to CPU)
+        self._fallbacks = {}
+
+    def _estimate_bytes(self, key) -> int:
+        # A static size per model: RSS deltas around a load are skewed by concurrent loads and inference
+        return WHISPER_MODEL_MEMORY_MB.get(key[0], max(WHISPER_MODEL_MEMORY_MB.values())) * 1024 * 1024
+
+    def _used_bytes(self) -> int:
+        return sum(self._estimate_bytes(r.key) for r in self._replicas)
+
+    def _make_room(self, needed: int) -> bool:
+        """
+        Evict idle replicas, least recently used first, until `needed` bytes fit the budget.
+        Nothing is evicted if that would not be enough, unless no replica is busy at all
+        (a model larger than the whole budget still loads on an otherwise idle pool).
+        """
+        idle = sorted((r for r in self._replicas if not r.busy and r.model is not None), key=lambda r: r.last_used)
+        reclaimable = sum(self._estimate_bytes(r.key) for r in idle)
+        used = self._used_bytes()
+        if used + needed <= self._memory_budget:
+            return True
+        if used - reclaimable + needed > self._memory_budget and any(r.busy for r in self._replicas):
+            return False
+        while self._used_bytes() + needed > self._memory_budget and idle:
+            victim = idle.pop(0)
+            print(f"--- Evicting faster-whisper model {victim.key} (LRU) ---")
+            self._replicas.remove(victim)
+        return True
+
+    def _checkout(self, key) -> _Replica:
+        with self._cond:
+            while True:
+                key = self._fallbacks.get(key, key)
+                for replica in self._replicas:
+                    if replica.key == key and not replica.busy and replica.model is not None:
+                        replica.busy = True
+                        return replica
+
+                count = sum(1 for r in self._replicas if r.key == key)
+                if count < self._max_replicas and self._make_room(self._estimate_bytes(key)):
+                    replica = _Replica(key)
+                    self._replicas.append(replica)
+                    break
+                # Woken by releases; also checks now and then whether the waiting work was cancelled
+                self._cond.wait(CANCEL_CHECK_SECONDS)
+                check_cancelled()
+
+        # Load outside the lock; the reserved replica counts against the budget meanwhile
+        try:
+            name, device, compute_type = key
+            start = time.perf_counter()
+            model, device, compute_type = _load_whisper(name, device, compute_type)
+            replica.load_seconds = time.perf_counter() - start
+            if (name, device, compute_type) != key:
+                # Register the replica under the device it is actually on, and send later
+                # requests for the unavailable one there as well
+                with self._cond:
+                    replica.key = (name, device, compute_type)
+                    self._fallbacks[key] = replica.key
+                    self._cond.notify_all()
+            replica.model = model
+            print(f"--- Loaded whisper model {replica.key} in {replica.load_seconds:.2f}s ---")
+        except Exception:
+            with self._cond:
+                self._replicas.remove(replica)
+                self._cond.notify_all()
+            raise
+        return replica
+
+    def _release(self, replica: _Replica):
+        with self._cond:
+            replica.busy = False
+            replica.last_used = time.monotonic()
+            self._cond.notify_all()
+
+    @contextmanager
+    def acquire(self, name: str = WHISPER_MODEL_NAME):
+        """
+        Check out a Whisper model replica for exclusive use, loading one if needed.
+        """
+        device = default_device()
+        replica = self._checkout((name, device, default_compute_type(device)))
+        try:
+            with _cancellable_encode(replica.model):
+                yield replica.model
+        finally:
+            self._release(replica)
+
+    def install(self, name: str, model):
+        """
+        Add an already constructed model as an idle replica for `name` on the default device.
+        """
+        device = default_device()
+        replica = _Replica((name, device, default_compute_type(device)))
+        replica.model = model
+        replica.busy = False
+        replica.load_seconds = 0.0
+        with self._cond:
+            self._replicas.append(replica)
+            self._cond.notify_all()
+
+    def preload(self, name: str, warm_up: bool = True):
+        with self.acquire(name) as model:
+            if not warm_up:
+                return
+            start = time.perf_counter()
+            try:
+                _warm_up_whisper(model, default_device())
+            except Exception as e:
+                print(f"Warm-up of whisper model ({name}) failed: {e}")
+                return
+            elapsed = time.perf_counter() - start
+        with self._cond:
+            for replica in self._replicas:
+                if replica.model is model:
+                    replica.warm_up_seconds = elapsed
+
+    def stats(self) -> list:
+        with self._cond:
+            return [
+                {
+                    "kind": "whisper",
+                    "name": replica.key[0],
+                    "device": replica.key[1],
+                    "compute_type": replica.key[2],
+                    "busy": replica.busy,
+                    "load_seconds": None if replica.load_seconds is None else round(replica.load_seconds, 3),
+                    "warm_up_seconds": None if replica.warm_up_seconds is None else round(replica.warm_up_seconds, 3),
+                    "memory_bytes": self._estimate_bytes(replica.key),
+                }
+                for replica in self._replicas
+                if replica.model is not None
+            ]
+
+
+MODELS = ModelRegistry()
+WHISPER_POOL = WhisperPool(WHISPER_POOL_MEMORY_BUDGET_MB * 1024 * 1024, WHISPER_MAX_REPLICAS)
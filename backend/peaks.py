@@ -0,0 +1,155 @@
+import os
+import struct
+import uuid
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from config import PEAKS_LEVEL_FACTOR, PEAKS_MIN_LEVEL_PEAKS, PEAKS_SAMPLES_PER_PEAK
+
+# Peak pyramid file: a header followed by the levels' (min, max) int16 pairs, finest level first.
+#   magic, version, levels, samplerate, samples per peak at level 0, level factor, frames
+HEADER = struct.Struct("<4sHHIIIQ")
+MAGIC = b"LSPK"
+VERSION = 1
+# Level-0 peaks computed per block of audio read, bounding memory for long tracks
+READ_BLOCK_PEAKS = 4096
+PEAK_SCALE = 32767
+
+
+def peaks_path_for(audio_path: Path) -> Path:
+    return audio_path.with_suffix(".peaks")
+
+
+def _reduce(block: np.ndarray, samples_per_peak: int) -> np.ndarray:
+    """
+    (min, max) over all channels of each run of `samples_per_peak` frames of a [Time, Channels] block.
+    A trailing partial run gets a peak of its own.
+    """
+    frames, channels = block.shape
+    full = frames // samples_per_peak
+    # Rows of consecutive frames are contiguous, so each run is one row of the reshaped block
+    runs = block[:full * samples_per_peak].reshape(full, samples_per_peak * channels)
+    peaks = np.stack([runs.min(axis=1), runs.max(axis=1)], axis=1)
+    if frames > full * samples_per_peak:
+        tail = block[full * samples_per_peak:]
+        peaks = np.concatenate([peaks, [[tail.min(), tail.max()]]])
+    return peaks
+
+
+def _downsample(peaks: np.ndarray, factor: int) -> np.ndarray:
+    # Pad with the last peak so the final group is complete; it does not change its min/max
+    padded = np.concatenate([peaks, np.repeat(peaks[-1:], -len(peaks) % factor, axis=0)])
+    groups = padded.reshape(-1, factor, 2)
+    return np.stack([groups[:, :, 0].min(axis=1), groups[:, :, 1].max(axis=1)], axis=1)
+
+
+def reduce_peaks(peaks: np.ndarray, max_peaks: int):
+    """
+    Combine runs of consecutive (min, max) peaks so at most `max_peaks` remain.
+    Returns (peaks, number of input peaks per output peak).
+    """
+    factor = max(-(-len(peaks) // max(max_peaks, 1)), 1)
+    if factor == 1 or not len(peaks):
+        return peaks, 1
+    return _downsample(peaks, factor), factor
+
+
+def compute_peaks(audio_path: Path, peaks_path: Path, samples_per_peak: int = PEAKS_SAMPLES_PER_PEAK,
+                  factor: int = PEAKS_LEVEL_FACTOR) -> Path:
+    """
+    Compute the min/max peak pyramid of an audio file and write it atomically to `peaks_path`.
+    The audio is read in blocks, so memory stays bounded for long tracks.
+    """
+    info = sf.info(str(audio_path))
+    blocks = sf.blocks(str(audio_path), blocksize=samples_per_peak * READ_BLOCK_PEAKS, dtype="float32",
+                       always_2d=True)
+    level = np.concatenate([_reduce(block, samples_per_peak) for block in blocks] or [np.zeros((1, 2))])
+    levels = [level]
+    while len(levels[-1]) > PEAKS_MIN_LEVEL_PEAKS:
+        levels.append(_downsample(levels[-1], factor))
+
+    tmp_path = peaks_path.with_name(f"{peaks_path.name}.tmp-{uuid.uuid4().hex[:8]}")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(levels), info.samplerate, samples_per_peak, factor, info.frames))
+            f.write(np.array([len(level) for level in levels], dtype="<u8").tobytes())
+            for level in levels:
+                f.write(np.round(np.clip(level, -1.0, 1.0) * PEAK_SCALE).astype("<i2").tobytes())
+        os.replace(tmp_path, peaks_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return peaks_path
+
+
+class PeakPyramid:
+    """
+    Reader for a peak pyramid file. Only the header is read up front; range queries read
+    just the requested peaks of one level.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, levels, self.samplerate, self.samples_per_peak, self.factor, self.frames = \
+                HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"Not a peak pyramid file: {path}")
+            self.counts = np.frombuffer(f.read(8 * levels), dtype="<u8").astype(int).tolist()
+        self._offsets = []
+        offset = HEADER.size + 8 * levels
+        for count in self.counts:
+            self._offsets.append(offset)
+            offset += count * 4
+
+    @property
+    def levels(self) -> int:
+        return len(self.counts)
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.samplerate
+
+    def seconds_per_peak(self, level: int) -> float:
+        return self.samples_per_peak * self.factor ** level / self.samplerate
+
+    def best_level(self, start: float, end: float, max_peaks: int) -> int:
+        """
+        Finest level that covers [start, end) with at most `max_peaks` peaks.
+        """
+        for level in range(self.levels):
+            if (end - start) / self.seconds_per_peak(level) <= max_peaks:
+                return level
+        return self.levels - 1
+
+    def read(self, level: int, start: float, end: float):
+        """
+        Peaks of one level covering [start, end) seconds, as (first peak index, [N, 2] int16 array).
+        """
+        seconds = self.seconds_per_peak(level)
+        count = self.counts[level]
+        first = min(max(int(start // seconds), 0), count)
+        last = min(max(int(np.ceil(end / seconds)), first), count)
+        peaks = np.fromfile(self.path, dtype="<i2", count=(last - first) * 2,
+                            offset=self._offsets[level] + first * 4)
+        return first, peaks.reshape(-1, 2)
+
+    def matches_settings(self) -> bool:
+        return self.samples_per_peak == PEAKS_SAMPLES_PER_PEAK and self.factor == PEAKS_LEVEL_FACTOR
+
+
+def ensure_peaks(audio_path: Path) -> PeakPyramid:
+    """
+    Return the peak pyramid stored next to an audio file, computing it if it is missing or
+    was computed with other settings.
+    """
+    peaks_path = peaks_path_for(audio_path)
+    try:
+        pyramid = PeakPyramid(peaks_path)
+        if pyramid.matches_settings():
+            return pyramid
+    except (OSError, ValueError, struct.error):
+        pass
+    compute_peaks(audio_path, peaks_path)
+    return PeakPyramid(peaks_path)
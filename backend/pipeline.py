@@ -0,0 +1,309 @@
+import math
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from audio_processor import WHISPER_SAMPLE_RATE, segment_record
+from config import (PIPELINE_CARRY_MARGIN_SECONDS, PIPELINE_CHUNK_SECONDS,
+                    WHISPER_MODEL_NAME, WHISPER_SETTINGS)
+from jobs import CANCEL_CHECK_SECONDS, check_cancelled
+from models import WHISPER_POOL
+from vocal_activity import SILENCE_DB, detect_vocal_regions, frame_levels_db, reference_level_db
+
+
+# Samples of context on each side of a block resampled by StreamResampler (at least the
+# resampling filter's half width)
+RESAMPLE_CONTEXT_SECONDS = 0.02
+
+
+class StreamResampler:
+    """
+    Resample audio that arrives in blocks as if it were one signal. Each block is resampled
+    together with context from its neighbours, which is trimmed off again, so block boundaries
+    leave no edge artifacts. The last RESAMPLE_CONTEXT_SECONDS are held back until the next
+    block (or flush) provides what follows them.
+    """
+
+    def __init__(self, old_sr: int, new_sr: int):
+        gcd = math.gcd(old_sr, new_sr)
+        self.old, self.new = old_sr // gcd, new_sr // gcd
+        self.old_sr, self.new_sr = old_sr, new_sr
+        # Whole resampling periods, so emitted blocks map to whole output samples
+        self.context = self.old * max(math.ceil(RESAMPLE_CONTEXT_SECONDS * old_sr / self.old), 1)
+        self._history = np.zeros(0, dtype=np.float32)
+        self._pending = np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples: np.ndarray, final: bool = False) -> np.ndarray:
+        import julius
+        import torch
+
+        self._pending = np.concatenate([self._pending, np.asarray(samples, dtype=np.float32)])
+        if final:
+            emit = len(self._pending)
+        else:
+            emit = max(len(self._pending) - self.context, 0) // self.old * self.old
+        if emit == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        lookahead = self._pending[emit:emit + self.context]
+        buffer = np.concatenate([self._history, self._pending[:emit], lookahead])
+        resampled = julius.resample_frac(torch.from_numpy(buffer), self.old_sr, self.new_sr).numpy()
+        first = len(self._history) // self.old * self.new
+        count = emit * self.new // self.old
+        self._history = np.concatenate([self._history, self._pending[:emit]])[-self.context:]
+        self._pending = self._pending[emit:]
+        return resampled[first:first + count]
+
+    def flush(self) -> np.ndarray:
+        return self.feed(np.zeros(0, dtype=np.float32), final=True)
+
+
+class VocalsBroadcast:
+    """
+    Vocals published window by window while Demucs runs, as 16 kHz mono arrays.
+    Each subscriber iterates them from the start of the track. A chunk is released once every
+    subscriber has read it, so memory stays bounded by how far the slowest reader lags behind;
+    once chunks were released (or dropped because nobody was waiting) no new subscriber can join.
+    """
+
+    def __init__(self, key):
+        self._key = key
+        self._chunks = []
+        # Index of self._chunks[0] in the whole stream
+        self._first = 0
+        self._positions = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._failed = False
+        self._resampler = None
+
+    def publish(self, start_seconds: float, vocals, samplerate: int):
+        with self._cond:
+            unread = not self._positions
+        if unread and not wanted(*self._key):
+            # The transcription that asked for this broadcast is gone; do not keep the track in memory
+            with self._cond:
+                self._first += len(self._chunks) + 1
+                self._chunks = []
+            return
+
+        if self._resampler is None:
+            self._resampler = StreamResampler(samplerate, WHISPER_SAMPLE_RATE)
+        self._append(self._resampler.feed(vocals.mean(axis=1)))
+
+    def _append(self, audio: np.ndarray):
+        if len(audio):
+            with self._cond:
+                self._chunks.append(audio)
+                self._cond.notify_all()
+
+    def close(self, failed: bool = False):
+        if not failed and self._resampler is not None:
+            # The end of the track the resampler held back
+            self._append(self._resampler.flush())
+        with self._cond:
+            self._closed = True
+            self._failed = failed
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """
+        Iterator over the vocals from the start of the track, or None if it can no longer be replayed.
+        """
+        with self._cond:
+            if self._first:
+                return None
+            token = object()
+            self._positions[token] = 0
+        return self._iterate(token)
+
+    def _release(self):
+        # Caller holds self._cond
+        if self._positions:
+            done = min(self._positions.values()) - self._first
+            del self._chunks[:done]
+            self._first += done
+
+    def _iterate(self, token):
+        try:
+            while True:
+                with self._cond:
+                    index = self._positions[token]
+                    while index >= self._first + len(self._chunks) and not self._closed:
+                        self._cond.wait(CANCEL_CHECK_SECONDS)
+                        check_cancelled()
+                    if index >= self._first + len(self._chunks):
+                        if self._failed:
+                            raise RuntimeError("Vocal separation failed")
+                        return
+                    chunk = self._chunks[index - self._first]
+                    self._positions[token] = index + 1
+                    self._release()
+                yield chunk
+        finally:
+            with self._cond:
+                del self._positions[token]
+                self._release()
+
+
+# Separations being broadcast and the pipelined transcriptions waiting for them, by (digest, profile)
+_broadcasts = {}
+_waiting = {}
+_cond = threading.Condition()
+
+
+@contextmanager
+def awaiting(digest: str, profile: str):
+    """
+    Register a pipelined transcription waiting for the vocals of a video's content digest,
+    so a separation with `profile` starting meanwhile broadcasts them (see wanted).
+    """
+    key = (digest, profile)
+    with _cond:
+        _waiting[key] = _waiting.get(key, 0) + 1
+    try:
+        yield
+    finally:
+        with _cond:
+            _waiting[key] -= 1
+            if not _waiting[key]:
+                del _waiting[key]
+
+
+def wanted(digest: str, profile: str) -> bool:
+    """
+    Whether a pipelined transcription is waiting for this separation; only then is it broadcast.
+    """
+    with _cond:
+        return (digest, profile) in _waiting
+
+
+def wake():
+    """
+    Wake the transcriptions in subscribe_when_ready, e.g. because a separation job finished.
+    """
+    with _cond:
+        _cond.notify_all()
+
+
+@contextmanager
+def broadcasting(digest: str, profile: str):
+    """
+    Register a VocalsBroadcast for a video's content digest while its separation with
+    `profile` runs.
+    """
+    key = (digest, profile)
+    broadcast = VocalsBroadcast(key)
+    with _cond:
+        _broadcasts[key] = broadcast
+        _cond.notify_all()
+    try:
+        yield broadcast
+    finally:
+        with _cond:
+            if _broadcasts.get(key) is broadcast:
+                del _broadcasts[key]
+
+
+def subscribe_when_ready(digest: str, profile: str, done):
+    """
+    Block until the separation's vocals are broadcast and return an iterator over them, or
+    return None once `done()` is true (the separation finished or cannot be followed live).
+    Waiters are woken by new broadcasts and by wake().
+    """
+    key = (digest, profile)
+    with _cond:
+        while True:
+            broadcast = _broadcasts.get(key)
+            chunks = broadcast.subscribe() if broadcast else None
+            if chunks is not None:
+                return chunks
+            if done():
+                return None
+            _cond.wait(CANCEL_CHECK_SECONDS)
+            check_cancelled()
+
+
+def _transcribe_window(model, audio, final: bool, vocal_gate: bool = False, reference_db: float = None):
+    """
+    Yield the segments of one chunk. Returns the chunk-relative time to carry into the next
+    chunk when the last segment runs into the chunk's end (it is re-transcribed there
+    instead of being cut mid-line), or None. With `vocal_gate` only regions of the chunk
+    with audible singing are decoded, gated against the track's level `reference_db`.
+    """
+    duration = len(audio) / WHISPER_SAMPLE_RATE
+    if vocal_gate:
+        regions = detect_vocal_regions(audio, WHISPER_SAMPLE_RATE, reference_db=reference_db)
+        if not regions:
+            return None
+        segments, _ = model.transcribe(audio, **WHISPER_SETTINGS,
+                                       clip_timestamps=[t for region in regions for t in region])
+    else:
+        segments, _ = model.transcribe(audio, **WHISPER_SETTINGS)
+
+    held = None
+    for segment in segments:
+        if held is not None:
+            yield held
+        held = segment
+
+    if held is None:
+        return None
+    if not final and held.end > duration - PIPELINE_CARRY_MARGIN_SECONDS and held.start > PIPELINE_CARRY_MARGIN_SECONDS:
+        return held.start
+    yield held
+    return None
+
+
+def transcribe_vocals_stream(chunks, model_name: str = WHISPER_MODEL_NAME, vocal_gate: bool = False):
+    """
+    Transcribe vocals arriving as 16 kHz mono chunks, yielding records on the original timeline.
+    """
+    with WHISPER_POOL.acquire(model_name) as model:
+        yield from _transcribe_chunks(model, chunks, vocal_gate)
+
+
+def _transcribe_chunks(model, chunks, vocal_gate: bool = False):
+    min_samples = int(PIPELINE_CHUNK_SECONDS * WHISPER_SAMPLE_RATE)
+    pending = []
+    pending_samples = 0
+    offset = 0.0
+    next_id = 1
+    # Loudness reference of the vocals so far: a chunk of a quiet passage is gated against
+    # the track's singing rather than against its own noise
+    reference_db = SILENCE_DB
+
+    def flush(final: bool):
+        nonlocal pending, pending_samples, offset, next_id, reference_db
+        audio = np.concatenate(pending)
+        if vocal_gate:
+            reference_db = max(reference_db, reference_level_db(frame_levels_db(audio, WHISPER_SAMPLE_RATE)))
+        window = _transcribe_window(model, audio, final, vocal_gate, reference_db)
+        while True:
+            try:
+                segment = next(window)
+            except StopIteration as stop:
+                carry = stop.value
+                break
+            record = segment_record(segment, offset, next_id)
+            if record:
+                next_id += 1
+                yield record
+
+        consumed = len(audio) if carry is None else int(carry * WHISPER_SAMPLE_RATE)
+        pending = [audio[consumed:]] if consumed < len(audio) else []
+        pending_samples = len(audio) - consumed
+        offset += consumed / WHISPER_SAMPLE_RATE
+
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_samples += len(chunk)
+        if pending_samples >= min_samples:
+            check_cancelled()
+            yield from flush(final=False)
+
+    if pending_samples:
+        check_cancelled()
+        yield from flush(final=True)
+    print("--- Pipelined Transcription Finished ---")
@@ -1,15 +1,64 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal, Optional
+
+class Word(BaseModel):
+    word: str
+    start: float
+    end: float
+    probability: float
 
 class Segment(BaseModel):
     id: int
     start: float
     end: float
     text: str
+    # Word timings, present on segments of aligned lyrics
+    words: Optional[List[Word]] = None
+
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: int
+    content_type: str = "video/mp4"
+    # Decode audio while the upload is still in progress (defaults to UPLOAD_EARLY_DECODE)
+    decode: Optional[bool] = None
 
 class TranscribeRequest(BaseModel):
     filename: str = "vocals.wav"
+    # Transcribe while vocals are still being separated (videos only)
+    pipelined: bool = False
+    # Whisper decoding: "sequential" streams segment by segment, "batched" maximizes throughput
+    mode: Literal["sequential", "batched"] = "sequential"
+    batch_size: Optional[int] = None
+    # Whisper model (one of WHISPER_ALLOWED_MODELS); defaults to WHISPER_MODEL_NAME
+    model: Optional[str] = None
+    # Skip passages of separated vocals without singing (defaults to VOCAL_ACTIVITY_GATE)
+    vocal_gate: Optional[bool] = None
+    # Separation profile whose vocals are transcribed (one of SEPARATION_PROFILES)
+    separation_profile: Optional[str] = None
+    # Known lyrics: align their non-empty lines to the vocals instead of transcribing
+    # (one segment per line; "pipelined", "mode" and "batch_size" do not apply)
+    lyrics: Optional[str] = None
+    # /transcribe-live: interleave session, progress, heartbeat and done events with the segments
+    progress: bool = False
+
+class SeparateRequest(BaseModel):
+    filename: str
+    # Speed/quality settings (one of SEPARATION_PROFILES); defaults to SEPARATION_PROFILE
+    profile: Optional[str] = None
 
 class ExportRequest(BaseModel):
     video_filename: str
     segments: List[Segment]
+    # "burn" renders subtitles into the picture, "soft" muxes them as a track without re-encoding
+    mode: Literal["burn", "soft"] = "burn"
+
+class PreviewRequest(BaseModel):
+    video_filename: str
+    segments: List[Segment]
+    # Window to render, in seconds of the video; duration defaults to PREVIEW_DURATION_SECONDS
+    start: float = 0.0
+    duration: Optional[float] = None
+
+class SubtitleRequest(BaseModel):
+    segments: List[Segment]
+    format: Literal["srt", "vtt", "ass", "lrc"] = "srt"
@@ -0,0 +1,194 @@
+from pathlib import Path
+
+import numpy as np
+
+SUBTITLE_FORMATS = ("srt", "vtt", "ass", "lrc")
+
+SUBTITLE_MEDIA_TYPES = {
+    "srt": "application/x-subrip",
+    "vtt": "text/vtt",
+    "ass": "text/x-ssa",
+    "lrc": "text/plain",
+}
+
+
+class SegmentStore:
+    """
+    Columnar container for subtitle segments: id/start/end NumPy arrays plus one packed
+    UTF-8 buffer holding every text back to back (segment i is buffer[offsets[i]:offsets[i + 1]]).
+    Slicing works on whole arrays and returns a new store; texts are only decoded when a
+    segment is read or written out.
+    """
+
+    __slots__ = ("ids", "starts", "ends", "_buffer", "_offsets")
+
+    def __init__(self, ids, starts, ends, buffer: bytes, offsets):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self._buffer = buffer
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_texts(cls, ids, starts, ends, texts) -> "SegmentStore":
+        encoded = [text.strip().encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return cls(ids, starts, ends, b"".join(encoded), offsets)
+
+    @classmethod
+    def from_segments(cls, segments) -> "SegmentStore":
+        """
+        Build a store from segment dicts (Whisper records) or objects (Pydantic Segment).
+        An existing store is returned as is.
+        """
+        if isinstance(segments, SegmentStore):
+            return segments
+        segments = list(segments)
+        if segments and not isinstance(segments[0], dict):
+            segments = [vars(seg) for seg in segments]
+        return cls.from_texts(
+            [seg.get("id", i) for i, seg in enumerate(segments)],
+            [seg["start"] for seg in segments],
+            [seg["end"] for seg in segments],
+            [seg["text"] for seg in segments],
+        )
+
+    @classmethod
+    def empty(cls) -> "SegmentStore":
+        return cls([], [], [], b"", [0])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.to_dicts())
+
+    def text(self, index: int) -> str:
+        return self._buffer[self._offsets[index]:self._offsets[index + 1]].decode("utf-8")
+
+    def texts(self) -> list:
+        return [self.text(i) for i in range(len(self))]
+
+    def joined_text(self) -> str:
+        """
+        All texts concatenated, decoded in one pass from the packed buffer.
+        """
+        return self._buffer.decode("utf-8")
+
+    def to_dicts(self) -> list:
+        return [
+            {"id": int(i), "start": float(start), "end": float(end), "text": text}
+            for i, start, end, text in zip(self.ids, self.starts, self.ends, self.texts())
+        ]
+
+    def _take(self, mask) -> "SegmentStore":
+        indices = np.flatnonzero(mask)
+        return SegmentStore.from_texts(self.ids[indices], self.starts[indices], self.ends[indices],
+                                       [self.text(i) for i in indices])
+
+    def slice(self, start: float, end: float) -> "SegmentStore":
+        """
+        Segments overlapping [start, end), clipped to the range and shifted so that `start` becomes 0.
+        """
+        clipped = self._take((self.ends > start) & (self.starts < end))
+        return SegmentStore(np.arange(len(clipped)), np.maximum(clipped.starts, start) - start,
+                            np.minimum(clipped.ends, end) - start, clipped._buffer, clipped._offsets)
+
+
+def _time_fields(seconds):
+    # Work in integer milliseconds so every field is exact
+    ms = np.rint(np.maximum(seconds, 0.0) * 1000).astype(np.int64)
+    return ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000
+
+
+def _clock_times(seconds, decimal: str) -> list:
+    hours, minutes, secs, millis = _time_fields(seconds)
+    return [f"{h:02d}:{m:02d}:{s:02d}{decimal}{ms:03d}" for h, m, s, ms in zip(hours, minutes, secs, millis)]
+
+
+def iter_srt(store: SegmentStore):
+    starts = _clock_times(store.starts, ",")
+    ends = _clock_times(store.ends, ",")
+    for i in range(len(store)):
+        # Using 1-based index for SRT
+        yield f"{i + 1}\n{starts[i]} --> {ends[i]}\n{store.text(i)}\n\n"
+
+
+def iter_vtt(store: SegmentStore):
+    starts = _clock_times(store.starts, ".")
+    ends = _clock_times(store.ends, ".")
+    yield "WEBVTT\n\n"
+    for i in range(len(store)):
+        yield f"{starts[i]} --> {ends[i]}\n{store.text(i)}\n\n"
+
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+WrapStyle: 0
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,64,&H00FFFFFF,&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,3,0,2,40,40,60,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def _ass_times(seconds) -> list:
+    hours, minutes, secs, millis = _time_fields(seconds)
+    return [f"{h:d}:{m:02d}:{s:02d}.{ms // 10:02d}" for h, m, s, ms in zip(hours, minutes, secs, millis)]
+
+
+def iter_ass(store: SegmentStore):
+    starts = _ass_times(store.starts)
+    ends = _ass_times(store.ends)
+    yield ASS_HEADER
+    for i in range(len(store)):
+        text = store.text(i).replace("\n", "\\N")
+        yield f"Dialogue: 0,{starts[i]},{ends[i]},Default,,0,0,0,,{text}\n"
+
+
+def _lrc_times(seconds) -> list:
+    _, _, secs, millis = _time_fields(seconds)
+    minutes = np.rint(np.maximum(seconds, 0.0) * 1000).astype(np.int64) // 60000
+    return [f"[{m:02d}:{s:02d}.{ms // 10:02d}]" for m, s, ms in zip(minutes, secs, millis)]
+
+
+def iter_lrc(store: SegmentStore):
+    starts = _lrc_times(store.starts)
+    ends = _lrc_times(store.ends)
+    # A line ending before the next one starts is closed with an empty timestamped line
+    next_starts = np.append(store.starts[1:], np.inf)
+    closes = store.ends < next_starts
+    for i in range(len(store)):
+        yield f"{starts[i]}{store.text(i)}\n"
+        if closes[i]:
+            yield f"{ends[i]}\n"
+
+
+WRITERS = {
+    "srt": iter_srt,
+    "vtt": iter_vtt,
+    "ass": iter_ass,
+    "lrc": iter_lrc,
+}
+
+
+def iter_subtitles(segments, fmt: str = "srt"):
+    """
+    Yield a subtitle file in one of SUBTITLE_FORMATS chunk by chunk.
+    """
+    return WRITERS[fmt](SegmentStore.from_segments(segments))
+
+
+def write_subtitles(segments, output_path: Path, fmt: str = None):
+    """
+    Write segments as a subtitle file; the format defaults to the file extension.
+    """
+    fmt = fmt or Path(output_path).suffix.lstrip(".").lower()
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.writelines(iter_subtitles(segments, fmt))
@@ -0,0 +1,106 @@
+import threading
+import weakref
+from contextlib import contextmanager
+
+import torch
+from demucs.apply import BagOfModels, apply_model
+
+# Imported lazily by audio_processor: this module pulls in torch and demucs
+
+_vocals_only_models = weakref.WeakKeyDictionary()
+_vocals_only_lock = threading.Lock()
+
+
+class VocalsOnly(torch.nn.Module):
+    """
+    A Demucs model whose output is reduced to the vocals stem, so apply_model only
+    accumulates one stem instead of all of them.
+    """
+
+    def __init__(self, model, index: int):
+        super().__init__()
+        self.model = model
+        self.index = index
+        self.samplerate = model.samplerate
+        self.audio_channels = model.audio_channels
+        self.segment = model.segment
+        self.sources = ["vocals"]
+
+    def valid_length(self, length: int) -> int:
+        if hasattr(self.model, "valid_length"):
+            return self.model.valid_length(length)
+        return length
+
+    def forward(self, mix):
+        return self.model(mix)[:, self.index:self.index + 1]
+
+
+def _as_bag(model) -> BagOfModels:
+    if isinstance(model, BagOfModels):
+        return model
+    return BagOfModels([model])
+
+
+def vocals_only(model) -> BagOfModels:
+    """
+    Vocals-only view of a model or bag of models, sharing its weights. Models of a bag that
+    do not contribute to the vocals (e.g. the drums/bass/other models of htdemucs_ft) are dropped.
+    """
+    with _vocals_only_lock:
+        reduced = _vocals_only_models.get(model)
+        if reduced is None:
+            bag = _as_bag(model)
+            index = bag.sources.index("vocals")
+            kept = [(VocalsOnly(sub_model, index), [weights[index]])
+                    for sub_model, weights in zip(bag.models, bag.weights) if weights[index]]
+            reduced = BagOfModels([sub_model for sub_model, _ in kept], [weights for _, weights in kept])
+            _vocals_only_models[model] = reduced
+        return reduced
+
+
+def effective_segment(model, profile: dict):
+    """
+    Segment length of a profile for a model; HTDemucs cannot run segments longer than it was trained on.
+    """
+    segment = profile.get("segment")
+    if segment is None:
+        return None
+    return min(float(segment), float(_as_bag(model).max_allowed_segment))
+
+
+@contextmanager
+def torch_threads(threads: int):
+    """
+    Run with `threads` torch CPU threads (0 = unchanged). The setting is process-wide.
+    """
+    if not threads:
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def separate_block(model, mix, device, profile: dict, ref_mean, ref_std, progress: bool = False, callback=None):
+    """
+    Separate a [Channels, Time] block of the mix with the settings of a separation profile.
+    The model sees the block normalized by the given reference statistics. Returns
+    (vocals, no_vocals) as [Channels, Time] tensors at the mix's level.
+    """
+    wav = (mix - ref_mean) / ref_std
+    args = dict(device=device, shifts=profile["shifts"], split=True, overlap=profile["overlap"],
+                segment=effective_segment(model, profile), progress=progress, callback=callback)
+    with torch.no_grad():
+        if profile["vocals_only"]:
+            vocals = apply_model(vocals_only(model), wav[None], **args)[0, 0]
+            vocals = vocals * ref_std + ref_mean
+            return vocals, mix - vocals
+
+        sources = apply_model(model, wav[None], **args)[0]
+    # Denormalize to restore original amplitude
+    sources = sources * ref_std + ref_mean
+    vocals = sources[model.sources.index("vocals")]
+    return vocals, sources.sum(0) - vocals
@@ -1,46 +1,311 @@
+import hashlib
+import json
+import os
 from pathlib import Path
-from audio_processor import extract_audio, separate_vocals, transcribe_audio, create_srt, burn_subtitles
-from config import UPLOAD_DIR, SEPARATED_DIR
+from typing import Optional
+from audio_processor import extract_audio, separate_vocals, create_srt, probe_duration
+from config import (PIPELINE_WINDOW_SECONDS, PIPELINED_SEPARATION, SEPARATION_PROFILE, SEPARATION_PROFILES,
+                    UPLOAD_DIR, SEPARATED_DIR, VOCAL_ACTIVITY_GATE, WHISPER_MODEL_NAME)
+import cache
+import exporter
+from jobs import FINISHED_STATUSES, SCHEDULER
+from metrics import span
+import peaks
+import pipeline
+from segments import SegmentStore
+from storage import STORAGE, stem_suffix
+
+# Artifact names inside a cache stage directory
+EXTRACTED_AUDIO_NAME = "audio.wav"
+VOCALS_NAME = f"{Path(EXTRACTED_AUDIO_NAME).stem}_vocals{stem_suffix()}"
+NO_VOCALS_NAME = f"{Path(EXTRACTED_AUDIO_NAME).stem}_no_vocals{stem_suffix()}"
+TRANSCRIPT_NAME = "segments.ndjson"
 
 def get_upload_dir() -> Path:
     return UPLOAD_DIR
 
 
+def media_duration(path: Path) -> Optional[float]:
+    """
+    Duration of a media file for instrumentation, or None if it cannot be read.
+    """
+    try:
+        return probe_duration(path)
+    except Exception:
+        return None
+
+
+def ensure_audio(video_path: Path) -> Optional[Path]:
+    """
+    Return the extracted audio for a video, extracting it only if not cached yet.
+    """
+    digest = cache.file_digest(video_path)
+    cached = cache.lookup(digest, "extract", EXTRACTED_AUDIO_NAME)
+    if cached:
+        print(f"Cache hit (extract): {cached}")
+        return cached / EXTRACTED_AUDIO_NAME
+
+    with cache.populate(digest, "extract", EXTRACTED_AUDIO_NAME) as work_dir, span("extract") as stage:
+        if extract_audio(video_path, work_dir / EXTRACTED_AUDIO_NAME):
+            stage.audio_seconds = media_duration(work_dir / EXTRACTED_AUDIO_NAME)
+        else:
+            stage.status = "error"
+
+    cached = cache.lookup(digest, "extract", EXTRACTED_AUDIO_NAME)
+    return cached / EXTRACTED_AUDIO_NAME if cached else None
+
+
+def adopt_extracted_audio(video_path: Path, audio_path: Path) -> Optional[Path]:
+    """
+    Publish audio that was already decoded elsewhere (e.g. during a chunked upload) as the
+    video's cached extraction, so ensure_audio does not decode the video again.
+    """
+    digest = cache.file_digest(video_path)
+    if not cache.lookup(digest, "extract", EXTRACTED_AUDIO_NAME):
+        with cache.populate(digest, "extract", EXTRACTED_AUDIO_NAME) as work_dir:
+            os.replace(audio_path, work_dir / EXTRACTED_AUDIO_NAME)
+    else:
+        audio_path.unlink(missing_ok=True)
+    cached = cache.lookup(digest, "extract", EXTRACTED_AUDIO_NAME)
+    return cached / EXTRACTED_AUDIO_NAME if cached else None
+
+
+def ensure_vocals(video_path: Path, progress_callback=None, profile: str = SEPARATION_PROFILE) -> Optional[Path]:
+    """
+    Return the separated vocals for a video, running extraction and separation only if not cached yet.
+    `profile` names the separation settings (see SEPARATION_PROFILES); each profile is cached separately.
+    """
+    digest = cache.file_digest(video_path)
+    params = cache.separation_params(profile)
+    cached = cache.lookup(digest, "separate", VOCALS_NAME, NO_VOCALS_NAME, params=params)
+    if cached:
+        print(f"Cache hit (separate): {cached}")
+        return cached / VOCALS_NAME
+
+    audio_path = ensure_audio(video_path)
+    if not audio_path:
+        print("Audio extraction failed")
+        return None
+
+    # Profiles are measured separately so their real-time factors can be compared
+    with STORAGE.pin(audio_path), span(f"separate_{profile}", media_duration(audio_path)) as stage:
+        vocals_path = None
+        if pipeline.wanted(digest, profile):
+            # A pipelined transcription is waiting: publish vocals window by window so it can start right away
+            with pipeline.broadcasting(digest, profile) as broadcast:
+                try:
+                    with cache.populate(digest, "separate", VOCALS_NAME, NO_VOCALS_NAME, params=params) as work_dir:
+                        vocals_path = separate_vocals(audio_path, work_dir, progress_callback,
+                                                      broadcast.publish, PIPELINE_WINDOW_SECONDS, profile)
+                        if vocals_path:
+                            write_stem_peaks(work_dir)
+                finally:
+                    broadcast.close(failed=vocals_path is None)
+        else:
+            with cache.populate(digest, "separate", VOCALS_NAME, NO_VOCALS_NAME, params=params) as work_dir:
+                vocals_path = separate_vocals(audio_path, work_dir, progress_callback, profile=profile)
+                if vocals_path:
+                    write_stem_peaks(work_dir)
+        if vocals_path is None:
+            stage.status = "error"
+
+    cached = cache.lookup(digest, "separate", VOCALS_NAME, NO_VOCALS_NAME, params=params)
+    return cached / VOCALS_NAME if cached else None
+
+
+def write_stem_peaks(stem_dir: Path):
+    """
+    Precompute the waveform peak pyramids of freshly separated stems for GET /peaks.
+    A failure only costs computing them on first request instead.
+    """
+    for name in (VOCALS_NAME, NO_VOCALS_NAME):
+        try:
+            with span("peaks"):
+                peaks.compute_peaks(stem_dir / name, peaks.peaks_path_for(stem_dir / name))
+        except Exception as e:
+            print(f"Could not compute peaks of {name}: {e}")
+
+
+def find_stem_peaks(filename: str, stem: str = "vocals", profile: Optional[str] = None):
+    """
+    Return the peak pyramid of a separated stem, or None if it has not been separated yet.
+    `filename` is either an uploaded video, whose cached stem of `profile` is used (without one,
+    the default profile's and then any other profile's), or a stem file under UPLOAD_DIR itself.
+    """
+    path = Path(UPLOAD_DIR) / filename
+    if not path.is_file() or not path.resolve().is_relative_to(Path(UPLOAD_DIR).resolve()):
+        return None
+    if path.suffix.lower() in (".wav", ".flac"):
+        return _ensure_stem_peaks(path)
+
+    name = VOCALS_NAME if stem == "vocals" else NO_VOCALS_NAME
+    digest = cache.file_digest(path)
+    for profile_name in [profile] if profile else [SEPARATION_PROFILE, *SEPARATION_PROFILES]:
+        cached = cache.lookup(digest, "separate", name, params=cache.separation_params(profile_name))
+        if cached:
+            return _ensure_stem_peaks(cached / name)
+    return None
+
+
+def _ensure_stem_peaks(audio_path: Path):
+    # A pyramid (re)computed on demand is a derived artifact that counts towards the storage quota
+    peaks_path = peaks.peaks_path_for(audio_path)
+    before = peaks_path.stat().st_mtime_ns if peaks_path.exists() else None
+    pyramid = peaks.ensure_peaks(audio_path)
+    if peaks_path.stat().st_mtime_ns != before:
+        STORAGE.record(peaks_path)
+    return pyramid
+
+
+def is_vocals_stem(path: Path) -> bool:
+    """
+    Whether an audio file is separated vocals (cached or legacy *_vocals.wav) rather than a full mix.
+    """
+    stem = path.stem
+    return stem == "vocals" or (stem.endswith("_vocals") and not stem.endswith("_no_vocals"))
+
+
+def find_cached_audio(video_path: Path, profile: Optional[str] = None) -> Optional[Path]:
+    """
+    Return the best already-processed audio for a video (vocals, then extracted audio) without computing anything.
+    Vocals of `profile` are preferred; without one, the default profile's and then any other profile's are used.
+    """
+    digest = cache.file_digest(video_path)
+    profiles = [profile] if profile else [SEPARATION_PROFILE, *SEPARATION_PROFILES]
+    for name in profiles:
+        cached = cache.lookup(digest, "separate", VOCALS_NAME, params=cache.separation_params(name))
+        if cached:
+            return cached / VOCALS_NAME
+    cached = cache.lookup(digest, "extract", EXTRACTED_AUDIO_NAME)
+    if cached:
+        return cached / EXTRACTED_AUDIO_NAME
+    return None
+
+
+def regenerate_evicted_vocals(video_path: Path, profile: Optional[str] = None) -> Optional[Path]:
+    """
+    Separate a video again if its vocals were evicted by the storage quota, so a transcription
+    does not silently fall back to the full mix. Returns None if there was nothing to regenerate.
+    """
+    digest = cache.file_digest(video_path)
+    for name in [profile] if profile else [SEPARATION_PROFILE, *SEPARATION_PROFILES]:
+        if STORAGE.was_evicted(cache.stage_dir(digest, "separate", cache.separation_params(name))):
+            print(f"Vocals ({name}) of {video_path.name} were evicted; separating again")
+            return ensure_vocals(video_path, profile=name)
+    return None
+
+
 def process_video_background(video_path: Path):
     """
     Process uploaded video in background: extract audio and separate vocals.
+    Stages whose output is already cached for this content are skipped.
     """
     print(f"Starting processing for: {video_path}")
-    
-    # 1. Extract Audio
-    audio_path = video_path.with_suffix(".mp3")
-    print(f"Extracting audio to: {audio_path}")
-    if extract_audio(video_path, audio_path):
-        print("Audio extraction successful")
-        
-        # 2. Separate Vocals
-        print("Starting vocal separation...")
-        # Output directory for separated tracks
-        separation_out_dir = SEPARATED_DIR
-        
-        vocals_path = separate_vocals(audio_path, separation_out_dir)
-        if vocals_path:
-             print(f"Vocal separation successful: {vocals_path}")
-        else:
-             print("Vocal separation failed")
+
+    vocals_path = ensure_vocals(video_path)
+    if vocals_path:
+        print(f"Vocal separation successful: {vocals_path}")
     else:
-        print("Audio extraction failed")
+        print("Vocal separation failed")
 
-def perform_transcription_generator(filename: str):
+def submit_processing_job(video_path: Path, priority: int = 0, profile: str = SEPARATION_PROFILE):
     """
-    Perform transcription as a generator. Prioritize separated vocals if available.
+    Queue extraction and separation of an uploaded video on the job scheduler.
+    An unfinished job for the same content and profile is reused rather than queued twice.
+    """
+    name = f"process:{cache.file_digest(video_path)}"
+    if profile != SEPARATION_PROFILE:
+        name += f":{profile}"
+    for job in SCHEDULER.list():
+        if job.name == name and job.status not in FINISHED_STATUSES:
+            return job
+
+    stages = [
+        ("extract", lambda job: ensure_audio(video_path)),
+        ("separate", lambda job: ensure_vocals(video_path, job.report, profile)),
+    ]
+    return SCHEDULER.submit(name, stages, priority)
+
+def _pipelined_transcription(video_path: Path, model_name: str, vocal_gate: bool = False,
+                             profile: str = SEPARATION_PROFILE):
+    """
+    Transcribe a video's vocals while they are being separated.
+    Yields records as Whisper finishes them. Returns the vocals path instead if the
+    separation had already completed (or was already running without being broadcast and
+    has now finished), so the caller can use the regular (cached) path.
+    """
+    digest = cache.file_digest(video_path)
+    with pipeline.awaiting(digest, profile):
+        job = submit_processing_job(video_path, profile=profile)
+        job.future.add_done_callback(lambda _: pipeline.wake())
+        # A separation that was already running without a broadcast is waited for instead
+        chunks = pipeline.subscribe_when_ready(digest, profile, job.future.done)
+        if chunks is not None:
+            print(f"--- Pipelined transcription of {video_path.name} ---")
+            records = []
+            with span("transcribe_pipelined") as stage:
+                stage.segments = 0
+                for record in pipeline.transcribe_vocals_stream(chunks, model_name, vocal_gate):
+                    stage.segments += 1
+                    stage.audio_seconds = record["end"]
+                    records.append(record)
+                    yield record
+            _cache_pipelined_transcript(digest, profile, records, model_name, vocal_gate)
+            return None
+
+    cached = cache.lookup(digest, "separate", VOCALS_NAME, params=cache.separation_params(profile))
+    if cached:
+        return cached / VOCALS_NAME
+    yield {"error": job.error or "Vocal separation failed"}
+    return None
+
+def _cache_pipelined_transcript(digest: str, profile: str, records: list, model_name: str, vocal_gate: bool):
+    """
+    Store a completed pipelined transcript as the transcript of the separated vocals, so the next
+    request for the video replays it instead of running Whisper again. Pipelined transcription
+    decodes sequentially, so it is stored for the "sequential" mode.
+    """
+    # The stream ends once separation has published the stems
+    cached = cache.lookup(digest, "separate", VOCALS_NAME, params=cache.separation_params(profile))
+    if not cached:
+        return
+    try:
+        params = {"mode": "sequential", "whisper_model": model_name, "vocal_gate": vocal_gate}
+        for _ in _populate_transcript(cache.file_digest(cached / VOCALS_NAME), "transcribe", params, records):
+            pass
+    except Exception as e:
+        print(f"Could not cache the pipelined transcript: {e}")
+
+def upload_relative_path(filename: str) -> str:
+    """
+    Path relative to UPLOAD_DIR of a filename or /uploads URL sent by the frontend.
     """
-    # If filename is a URL, extract the relative path from /uploads/
     if filename.startswith("http"):
         if "/uploads/" in filename:
-            filename = filename.split("/uploads/")[1]
-        else:
-            filename = Path(filename).name
+            return filename.split("/uploads/")[1]
+        return Path(filename).name
+    return filename
+
+def perform_transcription_generator(filename: str, pipelined: bool = False, mode: str = "sequential",
+                                    batch_size: Optional[int] = None, model_name: Optional[str] = None,
+                                    vocal_gate: Optional[bool] = None, separation_profile: Optional[str] = None,
+                                    lyrics: Optional[str] = None):
+    """
+    Perform transcription as a generator. Prioritize separated vocals if available.
+    With `pipelined`, a video whose vocals are not separated yet is transcribed while
+    Demucs runs instead of after it finishes. `mode`/`batch_size` select the Whisper
+    decoding strategy (see audio_processor.TRANSCRIPTION_MODES) and `model_name` the
+    Whisper model (default WHISPER_MODEL_NAME). `vocal_gate` (default VOCAL_ACTIVITY_GATE)
+    skips passages without singing when the source is a separated vocal stem.
+    `separation_profile` selects whose separated vocals are used (and produced, when pipelined).
+    With known `lyrics`, their lines are aligned to the audio instead (see align_cached).
+    """
+    model_name = model_name or WHISPER_MODEL_NAME
+    vocal_gate = VOCAL_ACTIVITY_GATE if vocal_gate is None else vocal_gate
+    # Alignment needs the whole vocals up front, so it never runs pipelined
+    pipelined = pipelined and lyrics is None
+
+    filename = upload_relative_path(filename)
             
     # Now filename is either "demo3.mp4" OR "separated/demo3_vocals.wav"
     input_path = Path(UPLOAD_DIR) / filename
@@ -54,8 +319,22 @@ def perform_transcription_generator(filename: str):
     
     if input_path.exists() and input_path.is_file():
         # If the input specifically points to a separated track or extracted audio, use it directly
-        if "separated" in str(input_path) or input_path.suffix in [".mp3", ".wav"]:
+        if "separated" in str(input_path) or input_path.suffix in [".mp3", ".wav", ".flac"]:
              target_path = input_path
+        else:
+             target_path = find_cached_audio(input_path, separation_profile)
+             if not pipelined and (target_path is None or target_path.name != VOCALS_NAME):
+                 target_path = regenerate_evicted_vocals(input_path, separation_profile) or target_path
+             if pipelined and PIPELINED_SEPARATION and (target_path is None or target_path.name != VOCALS_NAME):
+                 try:
+                     target_path = yield from _pipelined_transcription(input_path, model_name, vocal_gate,
+                                                                       separation_profile or SEPARATION_PROFILE)
+                 except Exception as e:
+                     print(f"!!! Error in pipelined transcription: {e}")
+                     yield {"error": str(e)}
+                     return
+                 if target_path is None:
+                     return
     
     # If we don't have a direct target yet, try to find alternates based on the video filename
     if not target_path:
@@ -78,47 +357,237 @@ def perform_transcription_generator(filename: str):
         print(f"--- ERROR: No audio source found for {filename}")
         yield {"error": "No audio source found"}
         return
-         
+
+    # The source may be a cached stage; keep it from being evicted while Whisper reads it
+    with STORAGE.pin(target_path):
+        if lyrics is not None:
+            yield from align_cached(target_path, lyrics, model_name, vocal_gate)
+            return
+        yield from transcribe_cached(target_path, mode, batch_size, model_name, vocal_gate)
+
+def transcribe_cached(target_path: Path, mode: str = "sequential", batch_size: Optional[int] = None,
+                      model_name: Optional[str] = None, vocal_gate: Optional[bool] = None):
+    """
+    Transcribe an audio file as a generator, replaying the cached transcript if there is one.
+    """
+    model_name = model_name or WHISPER_MODEL_NAME
+    vocal_gate = VOCAL_ACTIVITY_GATE if vocal_gate is None else vocal_gate
+    # Energy gating only makes sense on a clean vocal stem, not on the full mix
+    vocal_gate = vocal_gate and is_vocals_stem(target_path)
+
     try:
+        digest = cache.file_digest(target_path)
+        # Batch size does not change the output, only the decoding mode does
+        params = {"mode": mode, "whisper_model": model_name, "vocal_gate": vocal_gate}
+        cached = cache.lookup(digest, "transcribe", TRANSCRIPT_NAME, params=params)
+        if cached:
+            print(f"Cache hit (transcribe): {cached}")
+            yield from _read_transcript(cached / TRANSCRIPT_NAME)[0]
+            return
+
+        with cache.try_stage_lock(digest, "transcribe", params) as owner:
+            if owner:
+                # A concurrent request may have finished the same transcript meanwhile
+                cached = cache.lookup(digest, "transcribe", TRANSCRIPT_NAME, params=params)
+                if cached:
+                    print(f"Cache hit (transcribe): {cached}")
+                    yield from _read_transcript(cached / TRANSCRIPT_NAME)[0]
+                    return
+                yield from _transcribe_resumable(target_path, digest, params, mode, batch_size, model_name,
+                                                 vocal_gate)
+                return
+        # Another request is producing this transcript at the pace of its own client; rather than
+        # waiting for that client, transcribe independently (the first run to finish is kept)
         from audio_processor import transcribe_audio_generator
-        yield from transcribe_audio_generator(target_path)
+
+        print(f"Transcript of {target_path.name} is being produced by another request; transcribing separately")
+        with span("transcribe", media_duration(target_path)) as stage:
+            stage.segments = 0
+            for segment in _populate_transcript(digest, "transcribe", params, transcribe_audio_generator(
+                    target_path, mode, batch_size, model_name, vocal_gate=vocal_gate)):
+                if "error" not in segment:
+                    stage.segments += 1
+                yield segment
     except Exception as e:
-        print(f"!!! Error in perform_transcription_generator: {e}")
+        print(f"!!! Error in transcribe_cached: {e}")
         yield {"error": str(e)}
 
-def perform_transcription(filename: str):
+def align_cached(target_path: Path, lyrics: str, model_name: Optional[str] = None,
+                 vocal_gate: Optional[bool] = None):
+    """
+    Align known lyrics to an audio file as a generator, replaying the cached alignment if there is one.
+    """
+    from audio_processor import align_audio_generator
+
+    model_name = model_name or WHISPER_MODEL_NAME
+    vocal_gate = VOCAL_ACTIVITY_GATE if vocal_gate is None else vocal_gate
+    vocal_gate = vocal_gate and is_vocals_stem(target_path)
+
+    try:
+        digest = cache.file_digest(target_path)
+        params = {"whisper_model": model_name, "vocal_gate": vocal_gate,
+                  "lyrics": hashlib.sha256(lyrics.encode("utf-8")).hexdigest()}
+        cached = cache.lookup(digest, "align", TRANSCRIPT_NAME, params=params)
+        if cached:
+            print(f"Cache hit (align): {cached}")
+            yield from _read_transcript(cached / TRANSCRIPT_NAME)[0]
+            return
+
+        # Alignment is a single pass and cheap to redo, so an interrupted run is not resumed
+        with span("align", media_duration(target_path)) as stage:
+            stage.segments = 0
+            for segment in _populate_transcript(digest, "align", params, align_audio_generator(
+                    target_path, lyrics, model_name, vocal_gate)):
+                if "error" not in segment:
+                    stage.segments += 1
+                yield segment
+    except Exception as e:
+        print(f"!!! Error in align_cached: {e}")
+        yield {"error": str(e)}
+
+def _populate_transcript(digest: str, stage: str, params: dict, records):
+    """
+    Pass records through while writing them to a new cache entry of `stage`. The transcript is
+    published only if the records end without an error; an interrupted run leaves nothing behind.
+    """
+    failed = False
+    with cache.populate(digest, stage, TRANSCRIPT_NAME, params=params) as work_dir:
+        partial_path = work_dir / f"{TRANSCRIPT_NAME}.partial"
+        with open(partial_path, "wb") as f:
+            for record in records:
+                if "error" in record:
+                    failed = True
+                else:
+                    f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                yield record
+        if not failed:
+            partial_path.rename(work_dir / TRANSCRIPT_NAME)
+
+def _read_transcript(path: Path):
+    """
+    Read an NDJSON transcript. Returns (segments, valid_bytes); a trailing line cut off
+    by an interrupted write is ignored and not counted in valid_bytes.
+    """
+    segments = []
+    valid_bytes = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                segments.append(json.loads(line))
+            except ValueError:
+                break
+            valid_bytes += len(line)
+    return segments, valid_bytes
+
+def _transcribe_resumable(target_path: Path, digest: str, params: dict, mode: str,
+                          batch_size: Optional[int], model_name: str, vocal_gate: bool = False):
+    """
+    Transcribe into the cache, appending each segment to the partial transcript as it is produced.
+    Segments left by an interrupted run are replayed first and Whisper resumes from the end of
+    the last one. The transcript is published (and becomes a cache hit) only once a run completes
+    without errors.
+    """
+    from audio_processor import transcribe_audio_generator
+
+    work_dir = cache.partial_dir(digest, "transcribe", params)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    transcript_path = work_dir / TRANSCRIPT_NAME
+
+    done, valid_bytes = _read_transcript(transcript_path) if transcript_path.exists() else ([], 0)
+    start_seconds = done[-1]["end"] if done else 0.0
+    first_id = done[-1]["id"] + 1 if done else None
+    if done:
+        print(f"Resuming transcription at {start_seconds:.2f}s ({len(done)} segments cached)")
+        yield from done
+
+    failed = False
+    duration = media_duration(target_path)
+    audio_seconds = duration - start_seconds if duration else None
+    with open(transcript_path, "ab") as f, span("transcribe", audio_seconds) as stage:
+        f.truncate(valid_bytes)
+        stage.segments = 0
+        for segment in transcribe_audio_generator(target_path, mode, batch_size, model_name,
+                                                  start_seconds, first_id, vocal_gate):
+            if "error" in segment:
+                failed = True
+            else:
+                f.write((json.dumps(segment, ensure_ascii=False) + "\n").encode("utf-8"))
+                f.flush()
+                stage.segments += 1
+            yield segment
+
+    if not failed:
+        cache.publish_partial(digest, "transcribe", params)
+
+def perform_transcription(filename: str, mode: str = "sequential", batch_size: Optional[int] = None,
+                          model_name: Optional[str] = None, vocal_gate: Optional[bool] = None,
+                          separation_profile: Optional[str] = None, lyrics: Optional[str] = None):
     """
     Perform transcription. Prioritize separated vocals if available.
     (Wrapped around generator for compatibility)
     """
-    full_result = {"text": "", "segments": []}
-    for segment in perform_transcription_generator(filename):
+    segments = []
+    for segment in perform_transcription_generator(filename, mode=mode, batch_size=batch_size, model_name=model_name,
+                                                   vocal_gate=vocal_gate, separation_profile=separation_profile,
+                                                   lyrics=lyrics):
         if "error" in segment:
             return None
-        full_result["segments"].append(segment)
-        full_result["text"] += segment["text"]
-    return full_result
-
+        segments.append(segment)
+    return {"text": SegmentStore.from_segments(segments).joined_text(), "segments": segments}
 
-
-def export_video_with_subtitles(video_filename: str, segments: list):
+def export_video_with_subtitles(video_filename: str, segments, mode: str = "burn"):
     """
-    Export video with burned subtitles based on provided segments.
+    Export video with subtitles based on provided segments (any form SegmentStore.from_segments accepts).
+    "burn" renders them into the picture (encoding keyframe-aligned pieces in parallel),
+    "soft" attaches them as a subtitle track without re-encoding (see exporter.EXPORT_MODES).
     """
     video_path = UPLOAD_DIR / video_filename
     if not video_path.exists():
         return None
+    output_path = export_subtitled_video(video_path, segments, video_path.with_suffix(".srt"),
+                                         UPLOAD_DIR / f"exported_{video_filename}", mode)
+    return output_path.name if output_path else None
+
+def render_preview(video_path: Path, segments, start: float, duration: float) -> Optional[Path]:
+    """
+    Render a low-resolution preview of `duration` seconds from `start` with burned-in subtitles
+    (see exporter.render_preview). Returns the cached preview, or None on failure.
+    """
+    with span("preview", duration) as stage:
+        try:
+            return exporter.render_preview(video_path, segments, start, duration)
+        except Exception as e:
+            print(f"Error rendering preview: {e}")
+            stage.status = "error"
+            return None
+
+def export_subtitled_video(video_path: Path, segments, srt_path: Path, output_path: Path,
+                           mode: str = "burn") -> Optional[Path]:
+    """
+    Write the segments to `srt_path` and export the video with them to `output_path`
+    (whose extension may be adjusted to a container that holds the result). Returns the written video, or None on failure.
+    """
+    segments = SegmentStore.from_segments(segments)
         
     # 1. Create SRT file
-    srt_path = video_path.with_suffix(".srt")
     if not create_srt(segments, srt_path):
         return None
         
-    # 2. Burn subtitles
-    output_filename = f"exported_{video_filename}"
-    output_path = UPLOAD_DIR / output_filename
-    
-    if burn_subtitles(video_path, srt_path, output_path):
-        return output_filename
-    
-    return None
+    # 2. Attach or burn subtitles
+    with span(f"export_{mode}", media_duration(video_path)) as stage:
+        if mode == "soft":
+            output_path = exporter.soft_subtitle_path(output_path)
+            ok = exporter.mux_subtitles(video_path, srt_path, output_path)
+        else:
+            output_path = exporter.burned_output_path(output_path)
+            ok = exporter.burn_subtitles_parallel(video_path, segments, output_path)
+        if not ok:
+            stage.status = "error"
+
+    STORAGE.record(srt_path)
+    if ok:
+        STORAGE.record(output_path)
+
+    return output_path if ok else None
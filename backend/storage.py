@@ -0,0 +1,371 @@
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from config import (CACHE_DIR, SEPARATED_DIR, STEM_FORMAT, STORAGE_EVICTED_HISTORY, STORAGE_INDEX_SAVE_SECONDS,
+                    STORAGE_MIN_IDLE_SECONDS, STORAGE_PIN_MAX_SECONDS, STORAGE_QUOTA_MB, UPLOAD_DIR)
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# --- Stem files ---
+
+# format -> (libsndfile container, sample subtype, file suffix)
+STEM_FORMATS = {
+    "flac": ("FLAC", "PCM_16", ".flac"),
+    "pcm16": ("WAV", "PCM_16", ".wav"),
+    "float32": ("WAV", "FLOAT", ".wav"),
+}
+
+
+def stem_suffix(stem_format: str = STEM_FORMAT) -> str:
+    return STEM_FORMATS[stem_format][2]
+
+
+def stem_samples(data: np.ndarray, stem_format: str = STEM_FORMAT) -> np.ndarray:
+    # Integer formats would wrap around instead of clipping separated peaks above full scale
+    if STEM_FORMATS[stem_format][1] == "FLOAT":
+        return data
+    return np.clip(data, -1.0, 1.0)
+
+
+def open_stem_writer(path: Path, samplerate: int, channels: int, stem_format: str = STEM_FORMAT) -> sf.SoundFile:
+    """
+    Open a stem file for incremental writing; pass blocks through stem_samples first.
+    """
+    container, subtype, _ = STEM_FORMATS[stem_format]
+    return sf.SoundFile(str(path), mode="w", samplerate=samplerate, channels=channels,
+                        format=container, subtype=subtype)
+
+
+def write_stem(path: Path, data: np.ndarray, samplerate: int, stem_format: str = STEM_FORMAT):
+    container, subtype, _ = STEM_FORMATS[stem_format]
+    sf.write(str(path), stem_samples(data, stem_format), samplerate, format=container, subtype=subtype)
+
+
+# --- Disk quota ---
+
+INDEX_PATH = CACHE_DIR / "storage_index.json"
+# Top-level files in UPLOAD_DIR with these names are derived from an upload, not uploads themselves
+DERIVED_PREFIXES = ("exported_",)
+DERIVED_SUFFIXES = (".srt", ".mp3", ".wav", ".flac", ".peaks")
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """
+    Hold an exclusive lock on `path` (created if missing), shared by every process on the machine.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ten seconds; keep waiting
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Storage:
+    """
+    Index of the artifacts under UPLOAD_DIR with their size and last access, enforcing a
+    disk quota by evicting the least recently used derived artifacts. An artifact is a
+    cache stage directory, a legacy file in SEPARATED_DIR or a top-level file; uploaded
+    originals count towards the quota but are never evicted. Evicted stages are simply
+    cache misses and are regenerated by the ensure_* functions when next needed.
+
+    The index is shared with the other processes using UPLOAD_DIR (e.g. batch_process
+    workers): every change reloads it and saves it back under a file lock, and artifacts
+    pinned by any of them are not evicted.
+    """
+
+    def __init__(self, root: Path = UPLOAD_DIR, index_path: Path = INDEX_PATH,
+                 quota_bytes: int = STORAGE_QUOTA_MB * 1024 * 1024):
+        self.root = root.resolve()
+        self.index_path = index_path
+        self.quota_bytes = quota_bytes
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._evicted = {}
+        # Pins of all processes, {key: {pid: pinned_at}}, and this process's pin counts
+        self._pins = {}
+        self._own_pins = {}
+        # Last accesses not yet written to the index
+        self._touched = {}
+        self._saved_at = 0.0
+        self._load()
+
+    def _artifact(self, path: Path) -> Optional[str]:
+        """
+        Index key of the artifact containing `path`, or None if it is not managed.
+        """
+        try:
+            parts = Path(path).resolve().relative_to(self.root).parts
+        except ValueError:
+            return None
+        if not parts or parts[0].startswith("."):
+            return None
+        if parts[0] == CACHE_DIR.name:
+            # cache/<digest>/<stage>-<key>; scratch and resumable directories are not artifacts yet
+            if len(parts) < 3 or ".tmp-" in parts[2] or parts[2].endswith(".partial"):
+                return None
+            return "/".join(parts[:3])
+        if parts[0] == SEPARATED_DIR.name:
+            return "/".join(parts[:2]) if len(parts) >= 2 else None
+        if len(parts) == 1 and ".partial-" not in parts[0]:
+            return parts[0]
+        return None
+
+    @staticmethod
+    def _is_original(key: str) -> bool:
+        if "/" in key:
+            return False
+        return not key.startswith(DERIVED_PREFIXES) and not key.lower().endswith(DERIVED_SUFFIXES)
+
+    def _load(self):
+        """
+        Replace the in-memory index with the saved one, keeping this process's pending accesses and pins.
+        """
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        self._entries = state.get("entries", {})
+        self._evicted = state.get("evicted", {})
+        self._pins = state.get("pins", {})
+        for key, last_access in self._touched.items():
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["last_access"] = max(entry["last_access"], last_access)
+        pid = str(os.getpid())
+        for key in set(self._pins) | set(self._own_pins):
+            holders = self._pins.setdefault(key, {})
+            holders.pop(pid, None)
+            if key in self._own_pins:
+                holders[pid] = self._own_pins[key][1]
+            if not holders:
+                del self._pins[key]
+
+    def _save(self):
+        if len(self._evicted) > STORAGE_EVICTED_HISTORY:
+            recent = sorted(self._evicted.items(), key=lambda item: item[1])[-STORAGE_EVICTED_HISTORY:]
+            self._evicted = dict(recent)
+        tmp_path = self.index_path.with_name(f"{self.index_path.name}.tmp-{os.getpid()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self._entries, "evicted": self._evicted, "pins": self._pins}, f)
+        os.replace(tmp_path, self.index_path)
+        self._touched = {}
+        self._saved_at = time.monotonic()
+
+    @contextmanager
+    def _update(self):
+        """
+        Read-modify-write the index: reload it under the index file lock, so changes made by
+        other processes since the last save are kept, and save it once the block is done.
+        """
+        with self._lock, _file_lock(self.index_path.with_name(f"{self.index_path.name}.lock")):
+            self._load()
+            yield
+            self._save()
+
+    def _pinned(self, key: str) -> bool:
+        # A pin older than STORAGE_PIN_MAX_SECONDS was left by a process that died holding it
+        cutoff = time.time() - STORAGE_PIN_MAX_SECONDS
+        return key in self._own_pins or any(pinned_at >= cutoff
+                                            for pinned_at in self._pins.get(key, {}).values())
+
+    @contextmanager
+    def pin(self, path: Path):
+        """
+        Keep the artifact containing `path` from being evicted, by any process, while a stage uses it.
+        """
+        key = self._artifact(path)
+        if key is None:
+            yield
+            return
+        with self._update():
+            count, pinned_at = self._own_pins.get(key, (0, time.time()))
+            self._own_pins[key] = (count + 1, pinned_at)
+            self._pins.setdefault(key, {})[str(os.getpid())] = pinned_at
+        try:
+            yield
+        finally:
+            with self._update():
+                count, pinned_at = self._own_pins.pop(key)
+                if count > 1:
+                    self._own_pins[key] = (count - 1, pinned_at)
+                else:
+                    self._pins.get(key, {}).pop(str(os.getpid()), None)
+
+    def record(self, path: Path):
+        """
+        Register a new or changed artifact as just used and enforce the quota.
+        """
+        key = self._artifact(path)
+        if key is None or not (self.root / key).exists():
+            return
+        size = _size(self.root / key)
+        with self._update():
+            self._entries[key] = {"size": size, "last_access": time.time(), "original": self._is_original(key)}
+            self._evicted.pop(key, None)
+        self.enforce_quota()
+
+    def touch(self, path: Path):
+        """
+        Mark an artifact as used so it is evicted last.
+        """
+        key = self._artifact(path)
+        if key is None:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["last_access"] = self._touched[key] = time.time()
+                if time.monotonic() - self._saved_at >= STORAGE_INDEX_SAVE_SECONDS:
+                    # An empty update saves the pending accesses on top of the current index
+                    with self._update():
+                        pass
+                return
+        self.record(path)
+
+    def was_evicted(self, path: Path) -> bool:
+        key = self._artifact(path)
+        with self._lock:
+            return key in self._evicted
+
+    def scan(self):
+        """
+        Reconcile the index with the disk: add artifacts written without being recorded
+        (last access = modification time) and forget those deleted by other means.
+        """
+        found = {}
+        candidates = [p for p in self.root.iterdir() if p.is_file()]
+        for directory in (self.root / SEPARATED_DIR.name,):
+            if directory.is_dir():
+                candidates += [p for p in directory.iterdir()]
+        cache_root = self.root / CACHE_DIR.name
+        if cache_root.is_dir():
+            for digest_dir in cache_root.iterdir():
+                if digest_dir.is_dir():
+                    candidates += [p for p in digest_dir.iterdir() if p.is_dir()]
+        for path in candidates:
+            key = self._artifact(path)
+            if key is not None and key not in found:
+                found[key] = path
+
+        with self._update():
+            for key in list(self._entries):
+                # Artifacts another process published since the listing above are kept
+                if key not in found and not (self.root / key).exists():
+                    del self._entries[key]
+            for key, path in found.items():
+                entry = self._entries.get(key)
+                size = _size(path)
+                if entry is None:
+                    entry = {"last_access": path.stat().st_mtime}
+                    self._entries[key] = entry
+                # Reclassified on every scan, so entries indexed under older rules are corrected
+                entry["original"] = self._is_original(key)
+                entry["size"] = size
+        self.enforce_quota()
+
+    def _evict(self, key: str) -> bool:
+        path = self.root / key
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+                # Drop the digest directory once its last stage is gone
+                try:
+                    path.parent.rmdir()
+                except OSError:
+                    pass
+            else:
+                path.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"[storage] could not evict {key}: {e}")
+            return False
+        return True
+
+    def enforce_quota(self):
+        """
+        Evict least recently used derived artifacts until usage is within the quota.
+        Pinned artifacts and those used within STORAGE_MIN_IDLE_SECONDS are kept.
+        """
+        if not self.quota_bytes:
+            return
+        with self._lock:
+            if sum(entry["size"] for entry in self._entries.values()) <= self.quota_bytes:
+                return
+        with self._update():
+            total = sum(entry["size"] for entry in self._entries.values())
+            idle_before = time.time() - STORAGE_MIN_IDLE_SECONDS
+            candidates = sorted((entry["last_access"], key) for key, entry in self._entries.items()
+                                if not entry["original"] and entry["last_access"] <= idle_before
+                                and not self._pinned(key))
+            for _, key in candidates:
+                if total <= self.quota_bytes:
+                    break
+                if self._evict(key):
+                    size = self._entries.pop(key)["size"]
+                    self._evicted[key] = time.time()
+                    total -= size
+                    print(f"[storage] evicted {key} ({size / (1024 * 1024):.1f} MB)")
+        if total > self.quota_bytes:
+            print(f"[storage] usage {total / (1024 * 1024):.0f} MB still exceeds the quota "
+                  f"({self.quota_bytes / (1024 * 1024):.0f} MB); nothing else can be evicted yet")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = list(self._entries.values())
+            evicted = len(self._evicted)
+        original = sum(entry["size"] for entry in entries if entry["original"])
+        derived = sum(entry["size"] for entry in entries if not entry["original"])
+        return {
+            "quota_bytes": self.quota_bytes or None,
+            "used_bytes": original + derived,
+            "original_bytes": original,
+            "derived_bytes": derived,
+            "artifacts": len(entries),
+            "evicted": evicted,
+        }
+
+
+STORAGE = Storage()
@@ -0,0 +1,73 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from jobs import JobScheduler
+from models import WhisperPool
+from transcription_sessions import TranscriptionSessionManager
+
+
+def wait_until_finished(session, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not session.finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return session.finished
+
+
+def test_cancel_while_waiting_for_transcribe_slot():
+    scheduler = JobScheduler(1, {"transcribe": 1})
+    manager = TranscriptionSessionManager()
+
+    def records():
+        with scheduler.slot("transcribe"):
+            yield {"id": 1, "start": 0.0, "end": 1.0, "text": "never reached"}
+
+    with scheduler.slot("transcribe"):
+        session = manager.start("song.mp4", None, records)
+        time.sleep(0.3)
+        assert not session.finished
+        manager.cancel(session.id)
+        assert wait_until_finished(session)
+
+    assert session.status == "cancelled"
+    assert session.records == []
+    # The cancelled session never took the slot
+    with scheduler.slot("transcribe"):
+        pass
+
+
+class SilentModel:
+    """Decodes window after window without ever producing a segment."""
+
+    def __init__(self):
+        self.windows = 0
+
+    def encode(self, features):
+        self.windows += 1
+        time.sleep(0.01)
+
+
+def test_cancel_during_decoding_without_segments():
+    pool = WhisperPool(1024 * 1024 * 1024, 1)
+    model = SilentModel()
+    pool.install("tiny", model)
+    manager = TranscriptionSessionManager()
+
+    def records():
+        with pool.acquire("tiny") as whisper:
+            while True:
+                whisper.encode(None)
+        yield
+
+    session = manager.start("song.mp4", None, records)
+    time.sleep(0.3)
+    manager.cancel(session.id)
+    assert wait_until_finished(session)
+
+    assert session.status == "cancelled"
+    assert session.records == []
+    assert model.windows > 0
+    assert not any(replica["busy"] for replica in pool.stats())
+    assert "encode" not in vars(model)
@@ -0,0 +1,157 @@
+import contextvars
+import threading
+import time
+import uuid
+from typing import Optional
+
+from config import TRANSCRIPTION_SESSION_TTL_SECONDS
+from jobs import CANCEL_EVENT, WorkCancelled
+
+
+class SessionNotFound(Exception):
+    pass
+
+
+class TranscriptionSession:
+    """
+    One live transcription, running on its own thread independently of the HTTP connection
+    that started it. Emitted records are buffered, so a client that lost its connection can
+    reconnect and continue from the number of records it has already received.
+    """
+
+    def __init__(self, session_id: str, filename: str, duration: Optional[float]):
+        self.id = session_id
+        self.filename = filename
+        self.duration = duration
+        self.records = []
+        self.status = "running"
+        self.error = None
+        self.created_at = time.time()
+        self.last_seen = time.time()
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != "running"
+
+    def touch(self):
+        self.last_seen = time.time()
+
+    def records_since(self, cursor: int) -> list:
+        with self._lock:
+            return self.records[cursor:]
+
+    def position(self) -> float:
+        """
+        End of the last transcribed segment, in seconds of the track.
+        """
+        with self._lock:
+            ends = [record["end"] for record in self.records if "end" in record]
+        return max(ends, default=0.0)
+
+    def progress(self) -> dict:
+        position = self.position()
+        percent = None
+        if self.duration:
+            percent = 100.0 if self.status == "done" else round(min(100.0 * position / self.duration, 99.9), 1)
+        return {"event": "progress", "cursor": len(self.records), "position": position,
+                "duration": self.duration, "percent": percent}
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self, make_iterator):
+        """
+        Produce the session's records. The cancel event is visible to the producer through
+        jobs.CANCEL_EVENT, so waits for slots, models and vocals and Whisper's windows stop
+        on cancel() even before the first record.
+        """
+        token = CANCEL_EVENT.set(self._cancel)
+        iterator = make_iterator()
+        try:
+            for record in iterator:
+                with self._lock:
+                    self.records.append(record)
+                if "error" in record:
+                    self.error = record["error"]
+                if self._cancel.is_set():
+                    self.status = "cancelled"
+                    break
+        except WorkCancelled:
+            self.status = "cancelled"
+        except Exception as e:
+            self.error = str(e)
+            with self._lock:
+                self.records.append({"error": self.error})
+        finally:
+            # Closing the generator stops Whisper and releases its scheduler slot
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+            if self.status == "running":
+                self.status = "failed" if self.error else "done"
+            CANCEL_EVENT.reset(token)
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "records": len(self.records),
+            "error": self.error,
+            **{key: value for key, value in self.progress().items() if key != "event"},
+        }
+
+
+class TranscriptionSessionManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def start(self, filename: str, duration: Optional[float], make_iterator) -> TranscriptionSession:
+        """
+        Start transcribing on a new thread. `make_iterator` returns the record generator.
+        """
+        self.prune()
+        session = TranscriptionSession(uuid.uuid4().hex, filename, duration)
+        with self._lock:
+            self._sessions[session.id] = session
+        # Threads do not inherit context variables (e.g. the trace id) on their own
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(session.run, make_iterator),
+                         name=f"transcription-{session.id[:8]}", daemon=True).start()
+        return session
+
+    def get(self, session_id: str) -> TranscriptionSession:
+        self.prune()
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound(session_id)
+        session.touch()
+        return session
+
+    def cancel(self, session_id: str) -> TranscriptionSession:
+        session = self.get(session_id)
+        session.cancel()
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        return session
+
+    def prune(self):
+        """
+        Stop and drop sessions no client has followed for TRANSCRIPTION_SESSION_TTL_SECONDS.
+        """
+        cutoff = time.time() - TRANSCRIPTION_SESSION_TTL_SECONDS
+        with self._lock:
+            expired = [session for session in self._sessions.values() if session.last_seen < cutoff]
+            for session in expired:
+                del self._sessions[session.id]
+        for session in expired:
+            if not session.finished:
+                print(f"Transcription session {session.id} abandoned; stopping it")
+            session.cancel()
+
+
+TRANSCRIPTIONS = TranscriptionSessionManager()
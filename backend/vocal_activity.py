@@ -0,0 +1,85 @@
+import numpy as np
+
+from config import (VOCAL_ACTIVITY_FRAME_SECONDS, VOCAL_ACTIVITY_MIN_GAP_SECONDS,
+                    VOCAL_ACTIVITY_MIN_REGION_SECONDS, VOCAL_ACTIVITY_PADDING_SECONDS,
+                    VOCAL_ACTIVITY_RELATIVE_DB, VOCAL_ACTIVITY_THRESHOLD_DB)
+
+# Loudness reference of a track: this percentile of its frame levels
+REFERENCE_PERCENTILE = 95
+# Level reported for digital silence instead of -inf
+SILENCE_DB = -120.0
+
+
+def frame_levels_db(audio: np.ndarray, samplerate: int,
+                    frame_seconds: float = VOCAL_ACTIVITY_FRAME_SECONDS) -> np.ndarray:
+    """
+    RMS level in dBFS of consecutive non-overlapping frames of mono audio.
+    A trailing partial frame is ignored.
+    """
+    frame = max(int(frame_seconds * samplerate), 1)
+    count = len(audio) // frame
+    if count == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = np.asarray(audio[:count * frame], dtype=np.float32).reshape(count, frame)
+    # Row-wise sum of squares without materializing a squared copy of the audio
+    power = np.einsum("ij,ij->i", frames, frames) / frame
+    return np.maximum(10.0 * np.log10(np.maximum(power, 1e-12)), SILENCE_DB).astype(np.float32)
+
+
+def reference_level_db(levels: np.ndarray) -> float:
+    """
+    Loudness reference of frame levels (see frame_levels_db): the level of the loud frames.
+    """
+    return float(np.percentile(levels, REFERENCE_PERCENTILE)) if len(levels) else SILENCE_DB
+
+
+def detect_vocal_regions(audio: np.ndarray, samplerate: int, max_region_seconds: float = None,
+                         frame_seconds: float = VOCAL_ACTIVITY_FRAME_SECONDS, reference_db: float = None):
+    """
+    Find the regions of a separated vocal stem where someone is singing, as a list of
+    (start, end) seconds. A frame is active when it is louder than VOCAL_ACTIVITY_THRESHOLD_DB
+    and within VOCAL_ACTIVITY_RELATIVE_DB of the track's loud frames, so bleed from the
+    accompaniment in instrumental passages stays below the gate. Gaps shorter than
+    VOCAL_ACTIVITY_MIN_GAP_SECONDS are bridged, isolated blips dropped and regions padded.
+    With `max_region_seconds`, longer regions are split into equal parts no longer than that.
+    `reference_db` replaces the audio's own loudness reference, for audio that is only part of
+    a track (a quiet passage would otherwise be gated against its own noise).
+    """
+    duration = len(audio) / samplerate
+    levels = frame_levels_db(audio, samplerate, frame_seconds)
+    if len(levels) == 0:
+        return []
+
+    if reference_db is None:
+        reference_db = reference_level_db(levels)
+    threshold = max(VOCAL_ACTIVITY_THRESHOLD_DB, reference_db + VOCAL_ACTIVITY_RELATIVE_DB)
+    active = np.concatenate(([False], levels > threshold, [False]))
+    # Rising and falling edges alternate: [start0, end0, start1, end1, ...] in frames
+    edges = np.flatnonzero(np.diff(active.astype(np.int8)))
+    frame = max(int(frame_seconds * samplerate), 1) / samplerate
+    starts = edges[0::2] * frame
+    ends = edges[1::2] * frame
+    if len(starts) == 0:
+        return []
+
+    # Bridge short gaps, measured between the padded regions (padding may make neighbours overlap)
+    separate = starts[1:] - ends[:-1] >= VOCAL_ACTIVITY_MIN_GAP_SECONDS + 2 * VOCAL_ACTIVITY_PADDING_SECONDS
+    starts = starts[np.concatenate(([True], separate))]
+    ends = ends[np.concatenate((separate, [True]))]
+
+    # Isolated clicks and breaths are dropped before padding, so that regions clamped
+    # at the start or end of the track are judged by their own length too
+    keep = ends - starts >= VOCAL_ACTIVITY_MIN_REGION_SECONDS
+    starts = np.maximum(starts[keep] - VOCAL_ACTIVITY_PADDING_SECONDS, 0.0)
+    ends = np.minimum(ends[keep] + VOCAL_ACTIVITY_PADDING_SECONDS, duration)
+
+    regions = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        parts = int(np.ceil((end - start) / max_region_seconds)) if max_region_seconds else 1
+        bounds = np.linspace(start, end, parts + 1)
+        regions.extend((round(float(a), 3), round(float(b), 3)) for a, b in zip(bounds[:-1], bounds[1:]))
+    return regions
+
+
+def active_seconds(regions) -> float:
+    return sum(end - start for start, end in regions)
@@ -52,6 +52,7 @@ function App() {
     segments,
     setSegments,
     isTranscribing,
+    transcriptionProgress,
     isExporting,
     handleTranscribe,
     handleExport,
@@ -313,7 +314,9 @@ function App() {
                     {isTranscribing && (
                       <div className="p-8 flex flex-col items-center justify-center space-y-4">
                         <div className="w-12 h-12 border-4 border-purple-500/30 border-t-purple-500 rounded-full animate-spin" />
-                        <span className="text-purple-300 animate-pulse">AIが歌詞を解析中...</span>
+                        <span className="text-purple-300 animate-pulse">
+                          AIが歌詞を解析中...{transcriptionProgress !== null && ` ${Math.floor(transcriptionProgress)}%`}
+                        </span>
                       </div>
                     )}
 
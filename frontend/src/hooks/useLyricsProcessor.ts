@@ -6,6 +6,7 @@ import { api } from '../services/api';
 export const useLyricsProcessor = (uploadResult: UploadResult | null) => {
     const [segments, setSegments] = useState<Segment[]>([]);
     const [isTranscribing, setIsTranscribing] = useState(false);
+    const [transcriptionProgress, setTranscriptionProgress] = useState<number | null>(null);
     const [isExporting, setIsExporting] = useState(false);
 
     const handleTranscribe = async (audioPath?: string) => {
@@ -14,9 +15,10 @@ export const useLyricsProcessor = (uploadResult: UploadResult | null) => {
 
         setIsTranscribing(true);
         setSegments([]);
+        setTranscriptionProgress(null);
 
         try {
-            const stream = api.transcribeLive(targetFile);
+            const stream = api.transcribeLive(targetFile, {}, progress => setTranscriptionProgress(progress.percent));
             for await (const segment of stream) {
                 setSegments(prev => [...prev, segment]);
             }
@@ -25,6 +27,7 @@ export const useLyricsProcessor = (uploadResult: UploadResult | null) => {
             toast.error('文字起こしに失敗しました');
         } finally {
             setIsTranscribing(false);
+            setTranscriptionProgress(null);
         }
     };
 
@@ -53,6 +56,7 @@ export const useLyricsProcessor = (uploadResult: UploadResult | null) => {
         segments,
         setSegments,
         isTranscribing,
+        transcriptionProgress,
         isExporting,
         handleTranscribe,
         handleExport,
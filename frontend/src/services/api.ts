@@ -1,9 +1,101 @@
-import type { Segment } from '../types';
+import type {
+    ExportMode, PeaksQuery, PreviewResult, Segment, SeparationProfile, TranscribeOptions, TranscriptionProgress,
+    WaveformPeaks,
+} from '../types';
 
 const API_BASE_URL = 'http://localhost:8001';
 
+// Files larger than this are sent in chunks through the resumable upload endpoints
+const CHUNKED_UPLOAD_THRESHOLD = 64 * 1024 * 1024;
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+const UPLOAD_CHUNK_RETRIES = 5;
+
+// Reconnection attempts of a live transcription stream before giving up
+const TRANSCRIBE_RECONNECT_RETRIES = 10;
+const TRANSCRIBE_RECONNECT_DELAY_MS = 2000;
+
+class TranscriptionError extends Error { }
+
+async function* readNdjson(response: Response): AsyncIterableIterator<any> {
+    const reader = response.body?.getReader();
+    if (!reader) throw new Error('Response body is null');
+
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() || '';
+
+        for (const line of lines) {
+            if (!line.trim()) continue;
+            let record;
+            try {
+                record = JSON.parse(line);
+            } catch (e) {
+                console.error('Error parsing JSON line:', line, e);
+                continue;
+            }
+            yield record;
+        }
+    }
+}
+
+async function readError(response: Response, fallback: string): Promise<Error> {
+    let errorMsg = fallback;
+    try {
+        const errorData = await response.json();
+        if (errorData.detail) errorMsg = errorData.detail;
+    } catch { }
+    return new Error(errorMsg);
+}
+
+async function uploadVideoChunked(file: File): Promise<any> {
+    const init = await fetch(`${API_BASE_URL}/upload/init`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size, content_type: file.type }),
+    });
+    if (!init.ok) throw await readError(init, 'Upload failed');
+    const { upload_id } = await init.json();
+
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(`${API_BASE_URL}/upload/${upload_id}?offset=${offset}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE),
+            });
+            if (!response.ok && response.status !== 409) throw await readError(response, 'Upload failed');
+            failures = 0;
+            if (response.ok) {
+                offset = (await response.json()).received;
+                continue;
+            }
+        } catch (e) {
+            if (++failures > UPLOAD_CHUNK_RETRIES) throw e;
+        }
+        // Connection dropped or offsets diverged: ask the server how much it has and resume there
+        const status = await fetch(`${API_BASE_URL}/upload/${upload_id}`);
+        if (!status.ok) throw await readError(status, 'Upload failed');
+        offset = (await status.json()).received;
+    }
+
+    const complete = await fetch(`${API_BASE_URL}/upload/${upload_id}/complete`, { method: 'POST' });
+    if (!complete.ok) throw await readError(complete, 'Upload failed');
+    return await complete.json();
+}
+
 export const api = {
     async uploadVideo(file: File): Promise<any> {
+        if (file.size > CHUNKED_UPLOAD_THRESHOLD) return await uploadVideoChunked(file);
+
         const formData = new FormData();
         formData.append('file', file);
 
@@ -23,11 +115,11 @@ export const api = {
         return await response.json();
     },
 
-    async separateAudio(filename: string): Promise<any> {
+    async separateAudio(filename: string, profile?: SeparationProfile): Promise<any> {
         const response = await fetch(`${API_BASE_URL}/separate`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ filename }),
+            body: JSON.stringify({ filename, profile }),
         });
 
         if (!response.ok) {
@@ -41,56 +133,84 @@ export const api = {
         return await response.json();
     },
 
-    async *transcribeLive(filename: string): AsyncIterableIterator<Segment> {
-        const response = await fetch(`${API_BASE_URL}/transcribe-live`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ filename }),
-        });
-
-        if (!response.ok) {
-            let errorMsg = 'Transcription failed';
-            try {
-                const errorData = await response.json();
-                if (errorData.detail) errorMsg = errorData.detail;
-            } catch { }
-            throw new Error(errorMsg);
+    // Min/max waveform peaks of a separated stem, for drawing the timeline without decoding audio
+    async getPeaks(filename: string, query: PeaksQuery = {}): Promise<WaveformPeaks> {
+        const params = new URLSearchParams({ filename });
+        for (const [key, value] of Object.entries(query)) {
+            if (value !== undefined) params.set(key, String(value));
         }
+        const response = await fetch(`${API_BASE_URL}/peaks?${params}`);
+        if (!response.ok) throw await readError(response, 'Loading waveform failed');
+        return await response.json();
+    },
 
-        const reader = response.body?.getReader();
-        if (!reader) throw new Error('Response body is null');
-
-        const decoder = new TextDecoder();
-        let buffer = '';
+    // Live transcription as a resumable server-side session: when the connection drops, the
+    // stream is reopened from the number of segments already received instead of starting over
+    async *transcribeLive(
+        filename: string,
+        options: TranscribeOptions = {},
+        onProgress?: (progress: TranscriptionProgress) => void,
+    ): AsyncIterableIterator<Segment> {
+        let sessionId: string | null = null;
+        let received = 0;
+        let failures = 0;
 
         while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            buffer += decoder.decode(value, { stream: true });
-            const lines = buffer.split('\n');
-            buffer = lines.pop() || '';
-
-            for (const line of lines) {
-                if (!line.trim()) continue;
-                try {
-                    const segment = JSON.parse(line);
-                    if (segment.error) throw new Error(segment.error);
-                    yield segment as Segment;
-                } catch (e) {
-                    console.error('Error parsing JSON line:', line, e);
+            let finished = false;
+            try {
+                const response: Response = sessionId === null
+                    ? await fetch(`${API_BASE_URL}/transcribe-live`, {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ filename, ...options, progress: true }),
+                    })
+                    : await fetch(`${API_BASE_URL}/transcribe-live/${sessionId}?since=${received}&progress=true`);
+                if (!response.ok) throw new TranscriptionError((await readError(response, 'Transcription failed')).message);
+
+                for await (const event of readNdjson(response)) {
+                    failures = 0;
+                    if (event.event === 'session') {
+                        sessionId = event.session_id;
+                    } else if (event.event === 'progress') {
+                        onProgress?.(event as TranscriptionProgress);
+                    } else if (event.event === 'done') {
+                        finished = true;
+                    } else if (event.event !== 'heartbeat') {
+                        received++;
+                        if (event.error) throw new TranscriptionError(event.error);
+                        yield event as Segment;
+                    }
                 }
+            } catch (e) {
+                // Errors reported by the server are final; network errors are retried
+                if (e instanceof TranscriptionError || sessionId === null || ++failures > TRANSCRIBE_RECONNECT_RETRIES) throw e;
+                console.warn('Transcription stream interrupted, reconnecting:', e);
             }
+            if (finished) return;
+            if (sessionId === null) throw new Error('Transcription failed');
+            await new Promise(resolve => setTimeout(resolve, TRANSCRIBE_RECONNECT_DELAY_MS));
         }
     },
 
-    async exportVideo(filename: string, segments: Segment[]): Promise<{ url: string; filename: string }> {
+    // Low-resolution render of a short window with burned-in subtitles, to check their look quickly
+    async previewRange(filename: string, segments: Segment[], start: number, duration?: number): Promise<PreviewResult> {
+        const response = await fetch(`${API_BASE_URL}/preview`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ video_filename: filename, segments, start, duration }),
+        });
+        if (!response.ok) throw await readError(response, 'Preview failed');
+        return await response.json();
+    },
+
+    async exportVideo(filename: string, segments: Segment[], mode: ExportMode = 'burn'): Promise<{ url: string; filename: string }> {
         const response = await fetch(`${API_BASE_URL}/export`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 video_filename: filename,
                 segments: segments,
+                mode,
             }),
         });
 
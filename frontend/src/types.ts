@@ -1,13 +1,76 @@
+export type Word = {
+    word: string;
+    start: number;
+    end: number;
+    probability: number;
+};
+
 export type Segment = {
     id: number;
     start: number;
     end: number;
     text: string;
+    // Word timings, present on segments of aligned lyrics
+    words?: Word[];
+};
+
+export type TranscribeOptions = {
+    pipelined?: boolean;
+    mode?: 'sequential' | 'batched';
+    batch_size?: number;
+    model?: string;
+    vocal_gate?: boolean;
+    separation_profile?: SeparationProfile;
+    // Known lyrics: their lines are aligned to the vocals instead of transcribed
+    lyrics?: string;
+};
+
+// Progress event of a live transcription; percent is null when the duration is unknown
+export type TranscriptionProgress = {
+    cursor: number;
+    position: number;
+    duration: number | null;
+    percent: number | null;
+};
+
+// 'burn' renders subtitles into the picture, 'soft' adds them as a subtitle track
+export type ExportMode = 'burn' | 'soft';
+
+// Demucs speed/quality trade-off (SEPARATION_PROFILES in the backend config)
+export type SeparationProfile = 'draft' | 'standard' | 'max';
+
+export type PeaksQuery = {
+    stem?: 'vocals' | 'no_vocals';
+    profile?: SeparationProfile;
+    start?: number;
+    end?: number;
+    level?: number;
+    max_peaks?: number;
+};
+
+// GET /peaks: interleaved (min, max) pairs scaled to -scale..scale, the first at `start` seconds
+export type WaveformPeaks = {
+    level: number;
+    levels: number;
+    seconds_per_peak: number;
+    start: number;
+    duration: number;
+    scale: number;
+    peaks: number[];
+};
+
+// POST /preview: `url` plays the rendered window, which starts at `start` seconds of the video
+export type PreviewResult = {
+    filename: string;
+    url: string;
+    start: number;
+    duration: number;
 };
 
 export type UploadResult = {
     filename: string;
     filepath: string;
+    job_id?: string;
     message: string;
 };
 